@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Crafter achievement analytics over the stats.jsonl episodes of many runs:
+- per-achievement success rates (share of episodes in which it was unlocked),
+- the Crafter score, S = exp(mean_i ln(1 + s_i)) - 1 over the success rates s_i in %,
+- both per run and training-step bin, then mean, std and a bootstrap confidence
+  interval over the runs (seeds).
+Episodes come from the columnar cache in <logdir>/.results_cache (results_cache.py), so
+only lines appended since the last call are parsed; everything after that is array
+arithmetic on the episodes x achievements matrix (one reduceat over the run and bin slices).
+
+    python analysis/achievements.py --logdir logdir/random_agent logdir/qr_dqn --bin-steps 100000
+
+Writes <label>_score.csv (step, mean, std, ci_low, ci_high, n) and <label>_achievements.csv
+(step, achievement, mean, std, ci_low, ci_high, n) per logdir, step = end of the bin; the
+last bin holds the whole run ("all") for the usual one-number score per agent.
+"""
+import argparse
+import pathlib
+import time
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from results_cache import EpisodeCache
+
+
+def unlock_counts(run: np.ndarray, bins: np.ndarray, unlocked: np.ndarray, num_runs: int, num_bins: int):
+    """
+    Episodes [R, B] and episodes that unlocked each achievement [R, B, A] per (run, bin).
+    `run` and `bins` index every episode, sorted by run and then step as EpisodeCache.episodes()
+    returns them, so every (run, bin) is one slice of `unlocked`.
+    """
+    cell = run * num_bins + bins
+    first = np.flatnonzero(np.r_[True, cell[1:] != cell[:-1]])
+    hits = np.zeros((num_runs * num_bins, unlocked.shape[1]), dtype=np.int64)
+    hits[cell[first]] = np.add.reduceat(unlocked, first, axis=0, dtype=np.int64)
+    episodes = np.bincount(cell, minlength=num_runs * num_bins)
+    return episodes.reshape(num_runs, num_bins), hits.reshape(num_runs, num_bins, -1)
+
+
+def crafter_score(rates: np.ndarray) -> np.ndarray:
+    """Geometric mean over the last axis of 1 + success rate in %, minus 1 (Hafner, 2021)."""
+    return np.exp(np.log1p(100.0 * rates).mean(axis=-1)) - 1.0
+
+
+def over_runs(values: np.ndarray, boot: int, level: float, rng: np.random.Generator):
+    """
+    Mean, std, bootstrap CI and count over the runs axis (0) of `values`, ignoring runs
+    that are NaN (no episodes in that bin). A resample is how often it draws every run,
+    so all of them are one [boot, R] @ [R, ...] product.
+    """
+    num_runs, shape = values.shape[0], values.shape[1:]
+    valid = ~np.isnan(values)
+    n = valid.sum(axis=0)
+    flat = np.where(valid, values, 0.0).reshape(num_runs, -1)
+    valid = valid.reshape(num_runs, -1).astype(np.float64)
+    counts = rng.multinomial(num_runs, np.full(num_runs, 1.0 / num_runs), size=boot).astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = flat.sum(axis=0) / n.ravel()
+        std = np.sqrt(((flat - mean) ** 2 * valid).sum(axis=0) / (n.ravel() - 1))
+        means = (counts @ flat) / (counts @ valid)  # [boot, ...], NaN if a resample has no valid run
+    low, high = np.nanquantile(means, [0.5 * (1 - level), 0.5 * (1 + level)], axis=0)
+    std[n.ravel() == 1] = 0.0
+    return mean.reshape(shape), std.reshape(shape), low.reshape(shape), high.reshape(shape), n
+
+
+def analyse(
+    logdir, bin_steps: int, boot: int = 2000, level: float = 0.95, seed: int = 0, rebuild: bool = False
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    cache = EpisodeCache(logdir)
+    if rebuild:
+        cache.rebuild()
+    cache.update()
+    run, step, unlocked = cache.episodes()
+    if len(run) == 0:
+        raise FileNotFoundError(f"No stats.jsonl found under {logdir}")
+    names = [n[len("achievement_") :] for n in cache.achievements]
+    num_runs = int(run.max()) + 1
+
+    num_bins = int((step.max() - 1) // bin_steps) + 1
+    bins = (step - 1) // bin_steps
+    episodes, hits = unlock_counts(run, bins, unlocked, num_runs, num_bins)
+    # one more bin for the whole run
+    episodes = np.concatenate([episodes, episodes.sum(axis=1, keepdims=True)], axis=1)
+    hits = np.concatenate([hits, hits.sum(axis=1, keepdims=True)], axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rates = hits / episodes[..., None]  # [R, B + 1, A], NaN without episodes
+    labels = [str((b + 1) * bin_steps) for b in range(num_bins)] + ["all"]
+
+    rng = np.random.default_rng(seed)
+    mean, std, low, high, n = over_runs(crafter_score(rates), boot, level, rng)
+    score = pd.DataFrame({"step": labels, "mean": mean, "std": std, "ci_low": low, "ci_high": high, "n": n})
+    mean, std, low, high, n = over_runs(rates * 100.0, boot, level, rng)  # [B, A], in %
+    per_achievement = pd.DataFrame(
+        {
+            "step": np.repeat(labels, len(names)),
+            "achievement": np.tile(names, len(labels)),
+            "mean": mean.ravel(),
+            "std": std.ravel(),
+            "ci_low": low.ravel(),
+            "ci_high": high.ravel(),
+            "n": n.ravel(),
+        }
+    )
+    return score, per_achievement
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logdir", nargs="+", required=True, help="One or more agent folders with seed subfolders.")
+    parser.add_argument("--outdir", default="report/figures", help="Where to save the CSVs.")
+    parser.add_argument("--bin-steps", type=int, default=100_000, help="Training steps per bin.")
+    parser.add_argument("--bootstrap", type=int, default=2000, help="Bootstrap resamples of the runs for the CI.")
+    parser.add_argument("--level", type=float, default=0.95, help="Confidence level.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rebuild-cache", action="store_true", help="Re-read every stats.jsonl from scratch.")
+    args = parser.parse_args()
+
+    outdir = pathlib.Path(args.outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    for ld in args.logdir:
+        t0 = time.perf_counter()
+        label = pathlib.Path(ld).name
+        score, per_achievement = analyse(ld, args.bin_steps, args.bootstrap, args.level, args.seed, args.rebuild_cache)
+        score.to_csv(outdir / f"{label}_score.csv", index=False)
+        per_achievement.to_csv(outdir / f"{label}_achievements.csv", index=False)
+        final = score.iloc[-1]
+        print(
+            f"[{label}] Crafter score {final['mean']:.2f} (CI {final['ci_low']:.2f}-{final['ci_high']:.2f}, "
+            f"{int(final['n'])} runs) in {time.perf_counter() - t0:.2f}s"
+        )
+        rates = per_achievement[per_achievement["step"] == "all"].sort_values("mean", ascending=False)
+        for row in rates.itertuples():
+            print(f"  {row.achievement:<20} {row.mean:6.2f}%  [{row.ci_low:6.2f}, {row.ci_high:6.2f}]")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,42 +6,24 @@ with last-point scores for LaTeX \\input.
 """
 import argparse
 import pathlib
-import pickle
 
 import pandas as pd
 
-
-def read_pkl(path):
-    events = []
-    with open(path, "rb") as f:
-        while True:
-            try:
-                events.append(pickle.load(f))
-            except EOFError:
-                break
-    return events
+from results_cache import clip_runs, load_eval_frame
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--logdir", required=True, help="Folder with seed subfolders.")
     parser.add_argument("--out", default="report/figures/agent_agg.csv")
+    parser.add_argument("--rebuild-cache", action="store_true", help="Re-read every eval_stats.pkl from scratch.")
     args = parser.parse_args()
 
-    indir = pathlib.Path(args.logdir)
-    fns = sorted(indir.glob("**/*/eval_stats.pkl"))
-    runs = []
-    for i, fn in enumerate(fns):
-        df = pd.DataFrame(read_pkl(fn))
-        df["run"] = i
-        runs.append(df)
-    if not runs:
-        raise FileNotFoundError(f"No eval_stats.pkl found under {indir}")
+    # records come from <logdir>/.results_cache, which only ingests what was appended since the last call
+    df = load_eval_frame(pathlib.Path(args.logdir), rebuild=args.rebuild_cache)
 
     # Clip to min length
-    min_len = min(len(r) for r in runs)
-    runs = [r.iloc[:min_len].copy() for r in runs]
-    df = pd.concat(runs, ignore_index=True)
+    df, _ = clip_runs(df)
 
     g = df.groupby("step")["avg_return"]
     agg = pd.DataFrame({"step": g.mean().index.values, "mean": g.mean().values, "std": g.std().values, "n": g.count().values})
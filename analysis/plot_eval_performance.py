@@ -9,39 +9,21 @@ Extended plotting:
 """
 import argparse
 import pathlib
-import pickle
 from typing import Dict, List
 
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 
+from results_cache import clip_runs, load_eval_frame
 
-def read_pkl(path):
-    events = []
-    with open(path, "rb") as f:
-        while True:
-            try:
-                events.append(pickle.load(f))
-            except EOFError:
-                break
-    return events
 
-
-def runs_from_logdir(indir: pathlib.Path, clip: bool = True) -> pd.DataFrame:
-    fns = sorted(list(indir.glob("**/*/eval_stats.pkl")))
-    runs = []
-    for idx, fn in enumerate(fns):
-        df = pd.DataFrame(read_pkl(fn))
-        df["run"] = idx
-        runs.append(df)
-    if not runs:
-        raise FileNotFoundError(f"No eval_stats.pkl found under {indir}")
+def runs_from_logdir(indir: pathlib.Path, clip: bool = True, rebuild_cache: bool = False) -> pd.DataFrame:
+    # incremental: <indir>/.results_cache only ingests the records appended since the last call
+    df = load_eval_frame(indir, rebuild=rebuild_cache)
     if clip:
-        min_len = min(len(r) for r in runs)
-        runs = [r.iloc[:min_len].copy() for r in runs]
+        df, min_len = clip_runs(df)
         print(f"[{indir.name}] Clipped all runs to {min_len} points.")
-    df = pd.concat(runs, ignore_index=True)
     return df
 
 
@@ -63,6 +45,7 @@ def main():
     parser.add_argument("--logdir", nargs="+", required=True, help="One or more folders to overlay.")
     parser.add_argument("--outdir", default="report/figures", help="Where to save figures and CSVs.")
     parser.add_argument("--no-clip", action="store_true", help="Do not clip runs to the shortest.")
+    parser.add_argument("--rebuild-cache", action="store_true", help="Re-read every eval_stats.pkl from scratch.")
     args = parser.parse_args()
 
     outdir = pathlib.Path(args.outdir)
@@ -71,7 +54,7 @@ def main():
     plt.figure(figsize=(6, 4))
     for ld in args.logdir:
         p = pathlib.Path(ld)
-        df = runs_from_logdir(p, clip=(not args.no-clip))
+        df = runs_from_logdir(p, clip=(not args.no_clip), rebuild_cache=args.rebuild_cache)
         agg = aggregate(df)
         label = p.name
         # Plot mean with shaded std
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental, columnar caches of the per-run logs under a logdir, used by aggregate.py,
+plot_eval_performance.py and achievements.py instead of re-reading every file each time.
+
+Two tables, each in <logdir>/.results_cache/<table>/:
+- eval:     eval_stats.pkl records (file_id, step, avg_return)
+- episodes: stats.jsonl episodes (file_id, length, reward, unlocked[achievement])
+Records are stored as columns in append-only .npz chunks; index.json lists the chunks and
+how many bytes of every source file have been ingested (plus its inode, to notice
+rewrites). An update only stats the files and parses what was appended since, into one
+new chunk. A file that shrank or was replaced is re-read from the start, a file that is
+gone drops its rows; both compact the table into one chunk, as does piling up more than
+MAX_CHUNKS. A record still being written is left for the next update. Chunks are written
+before index.json is replaced, so the index never points at missing data.
+
+    python analysis/results_cache.py --logdir logdir            # update, print a summary
+    python analysis/results_cache.py --logdir logdir --rebuild  # start over
+"""
+import argparse
+import json
+import os
+import pathlib
+import pickle
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = ".results_cache"
+MAX_CHUNKS = 32
+READ_BYTES = 1 << 26  # stats.jsonl is parsed this many bytes at a time
+
+
+def read_pkl(path, offset: int = 0) -> Tuple[List[dict], int]:
+    """Records of an append-only pickle stream from byte `offset` on, and the offset after the last complete one."""
+    events = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            try:
+                event = pickle.load(f)
+            except (EOFError, pickle.UnpicklingError):
+                break  # end of stream, or a record that is still being appended
+            events.append(event)
+            offset = f.tell()
+    return events, offset
+
+
+def _concat(parts: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    parts = [p for p in parts if p]
+    return {name: np.concatenate([p[name] for p in parts]) for name in parts[0]} if parts else {}
+
+
+class IncrementalCache(ABC):
+    """One table: every FILENAME under the logdir, ingested through read()."""
+
+    NAME = ""
+    FILENAME = ""
+
+    def __init__(self, logdir):
+        self.logdir = pathlib.Path(logdir)
+        self.dir = self.logdir / CACHE_DIR / self.NAME
+        # paths[file_id] = source path relative to the logdir
+        self.index = {"paths": [], "files": {}, "chunks": [], "meta": {}}
+        if (self.dir / "index.json").exists():
+            with open(self.dir / "index.json") as f:
+                self.index = json.load(f)
+        self._columns: Optional[Dict[str, np.ndarray]] = None
+
+    @abstractmethod
+    def read(self, path: pathlib.Path, offset: int) -> Tuple[Dict[str, np.ndarray], int]:
+        """Columns of the complete records of `path` from byte `offset` on, and the offset after them."""
+
+    def rebuild(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self.__init__(self.logdir)
+
+    def update(self) -> int:
+        """Ingest whatever was appended since the last update; returns the number of new records."""
+        found = {str(fn.relative_to(self.logdir)) for fn in self.logdir.glob(f"**/*/{self.FILENAME}")}
+        files, paths = self.index["files"], self.index["paths"]
+        ids = {rel: i for i, rel in enumerate(paths)}
+        drop = [rel for rel in files if rel not in found]
+        new, touched = [], False
+        for rel in sorted(found):
+            st = os.stat(self.logdir / rel)
+            entry = files.get(rel)
+            if entry is not None and (entry["ino"] != st.st_ino or st.st_size < entry["offset"]):
+                drop.append(rel)  # rewritten or truncated: read again from the start
+                entry = None
+            if entry is not None and st.st_size == entry["offset"]:
+                continue  # nothing appended
+            columns, offset = self.read(self.logdir / rel, entry["offset"] if entry is not None else 0)
+            if rel not in ids:
+                ids[rel] = len(paths)
+                paths.append(rel)
+            files[rel] = {"offset": offset, "ino": st.st_ino}
+            touched = True
+            rows = len(next(iter(columns.values())))
+            if rows:
+                columns["file_id"] = np.full(rows, ids[rel], dtype=np.int32)
+                new.append(columns)
+        for rel in drop:
+            if rel not in found:
+                del files[rel]
+
+        if drop or len(self.index["chunks"]) + bool(new) > MAX_CHUNKS:
+            columns = self.columns()
+            if drop and columns:
+                keep = ~np.isin(columns["file_id"], [ids[rel] for rel in drop])
+                columns = {name: col[keep] for name, col in columns.items()}
+            self._save(_concat([columns] + new), replace=True)
+        elif touched:
+            self._save(_concat(new), replace=False)
+        return sum(len(c["file_id"]) for c in new)
+
+    def _save(self, columns: Dict[str, np.ndarray], replace: bool) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        old = list(self.index["chunks"])
+        chunks = [] if replace else list(old)
+        if columns and len(columns["file_id"]):
+            name = f"chunk_{uuid.uuid4().hex[:12]}.npz"
+            np.savez(self.dir / name, **columns)
+            chunks.append(name)
+        self.index["chunks"] = chunks
+        with open(self.dir / "index.json.tmp", "w") as f:
+            json.dump(self.index, f)
+        os.replace(self.dir / "index.json.tmp", self.dir / "index.json")
+        for name in set(old) - set(chunks):
+            (self.dir / name).unlink(missing_ok=True)
+        self._columns = None
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """All cached records (with file_id), per source file in append order; {} when empty."""
+        if self._columns is None:
+            parts = []
+            for name in self.index["chunks"]:
+                with np.load(self.dir / name) as data:
+                    parts.append({key: data[key] for key in data.files})
+            self._columns = _concat(parts)
+        return self._columns
+
+    def runs(self) -> np.ndarray:
+        """Run number of every row: the source files numbered in sorted path order, as the scripts always did."""
+        ids = {rel: i for i, rel in enumerate(self.index["paths"])}
+        run_of = np.full(len(ids), -1, dtype=np.int64)
+        run_of[[ids[rel] for rel in sorted(self.index["files"])]] = np.arange(len(self.index["files"]))
+        return run_of[self.columns().get("file_id", np.zeros(0, dtype=np.int32))]
+
+
+class EvalCache(IncrementalCache):
+    NAME = "eval"
+    FILENAME = "eval_stats.pkl"
+
+    def read(self, path, offset):
+        events, offset = read_pkl(path, offset)
+        return {
+            "step": np.fromiter((e["step"] for e in events), dtype=np.int64, count=len(events)),
+            "avg_return": np.fromiter((e["avg_return"] for e in events), dtype=np.float64, count=len(events)),
+        }, offset
+
+    def eval_frame(self) -> pd.DataFrame:
+        """All cached records as columns run, step, avg_return; per run in append order."""
+        columns = self.columns()
+        if not columns:
+            return pd.DataFrame({"run": [], "step": [], "avg_return": []})
+        run = self.runs()
+        order = np.argsort(run, kind="stable")
+        return pd.DataFrame(
+            {"run": run[order], "step": columns["step"][order], "avg_return": columns["avg_return"][order]}
+        )
+
+
+class EpisodeCache(IncrementalCache):
+    """
+    Episodes of crafter.Recorder's stats.jsonl: length, reward and, per achievement, whether
+    it was unlocked at least once. The achievement columns are fixed by the first file
+    ingested (index meta "achievements"); later files are matched by name.
+    """
+
+    NAME = "episodes"
+    FILENAME = "stats.jsonl"
+
+    @property
+    def achievements(self) -> List[str]:
+        return self.index["meta"].get("achievements", [])
+
+    def read(self, path, offset):
+        parts = []
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while True:
+                buf = f.read(READ_BYTES)
+                end = buf.rfind(b"\n") + 1
+                if end == 0:
+                    break  # EOF, or a line still being written
+                f.seek(end - len(buf), os.SEEK_CUR)
+                offset += end
+                parts.append(self._parse(buf[:end]))
+        columns = _concat(parts)
+        if not columns:
+            columns = {
+                "length": np.zeros(0, np.int32),
+                "reward": np.zeros(0, np.float32),
+                "unlocked": np.zeros((0, len(self.achievements)), bool),
+            }
+        return columns, offset
+
+    def _parse(self, buf: bytes) -> Dict[str, np.ndarray]:
+        keys = list(json.loads(buf[: buf.index(b"\n")]))
+        if not self.achievements:
+            self.index["meta"]["achievements"] = [k for k in keys if k.startswith("achievement_")]
+        names = self.achievements
+        try:
+            fields = parse_jsonl_numbers(buf, len(keys))
+        except ValueError:  # lines that differ from the first one: the slow way
+            rows = [json.loads(line) for line in buf.splitlines() if line.strip()]
+            unlocked = np.array([[r.get(n, 0) > 0 for n in names] for r in rows], dtype=bool)
+            return {
+                "length": np.array([r["length"] for r in rows], dtype=np.int32),
+                "reward": np.array([r["reward"] for r in rows], dtype=np.float32),
+                "unlocked": unlocked.reshape(len(rows), len(names)),
+            }
+        unlocked = np.zeros((fields.rows, len(names)), dtype=bool)
+        for j, key in enumerate(keys):
+            if key in names:
+                unlocked[:, names.index(key)] = fields.nonzero(j)
+        return {
+            "length": fields.integers(keys.index("length")).astype(np.int32),
+            "reward": fields.floats(keys.index("reward")).astype(np.float32),
+            "unlocked": unlocked,
+        }
+
+    def episodes(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (run [E], env step at the end of each episode [E], unlocked [E, A]), sorted by run.
+        The step is the running sum of the run's episode lengths, i.e. its env steps so far.
+        """
+        columns = self.columns()
+        if not columns:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros((0, len(self.achievements)), bool)
+        run = self.runs()
+        order = np.argsort(run, kind="stable")
+        run, length = run[order], columns["length"][order]
+        total = np.cumsum(length, dtype=np.int64)
+        first = np.flatnonzero(np.r_[True, run[1:] != run[:-1]])  # first row of every run
+        before = np.repeat(total[first] - length[first], np.diff(np.r_[first, len(run)]))
+        return run, total - before, columns["unlocked"][order]
+
+
+class JsonlFields:
+    """Where the values of parse_jsonl_numbers() lines are: field j of row i is chars[starts[i, j]:ends[i, j]]."""
+
+    def __init__(self, chars: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+        self.chars, self.starts, self.ends = chars, starts, ends
+        self.rows = len(starts)
+
+    def nonzero(self, j: int) -> np.ndarray:
+        """Field j is not the literal 0."""
+        width = self.ends[:, j] - self.starts[:, j]
+        return ~((width == 1) & (self.chars[self.starts[:, j]] == ord("0")))
+
+    def integers(self, j: int) -> np.ndarray:
+        """Field j as a non-negative integer, accumulated digit by digit across all rows."""
+        starts, width = self.starts[:, j], self.ends[:, j] - self.starts[:, j]
+        out = np.zeros(self.rows, dtype=np.int64)
+        for k in range(int(width.max(initial=0))):
+            has = k < width
+            digit = self.chars[np.where(has, starts + k, 0)].astype(np.int64) - ord("0")
+            out = np.where(has, out * 10 + digit, out)
+        return out
+
+    def floats(self, j: int) -> np.ndarray:
+        """Field j as floats: the field texts gathered back to back and parsed in one call."""
+        starts, width = self.starts[:, j], self.ends[:, j] - self.starts[:, j] + 1  # with its separator
+        gather = np.repeat(starts - (np.cumsum(width) - width), width) + np.arange(int(width.sum()))
+        text = self.chars[gather]
+        text[text == ord("}")] = ord(",")
+        return np.array(text.tobytes().split(b",")[:-1], dtype=np.float64)  # every field ends in its comma
+
+
+def parse_jsonl_numbers(buf: bytes, num_fields: int) -> JsonlFields:
+    """
+    Locate the values of complete JSON lines of `num_fields` plain numbers each, like
+    {"length": 165, "reward": 2.1, ...}, without decoding them line by line: every value
+    runs from after a colon (and its blank) to the next comma or closing brace.
+    Raises ValueError when some line does not have num_fields values.
+    """
+    chars = np.frombuffer(buf, dtype=np.uint8)
+    colons = np.flatnonzero(chars == ord(":"))
+    ends = np.flatnonzero((chars == ord(",")) | (chars == ord("}")))
+    rows = buf.count(b"\n")
+    if len(colons) != rows * num_fields or len(ends) != len(colons) or (ends < colons).any():
+        raise ValueError("lines with another number of fields")
+    ends = ends.reshape(rows, num_fields)
+    if not (chars[ends[:, -1]] == ord("}")).all():
+        raise ValueError("lines with another number of fields")
+    starts = colons.reshape(rows, num_fields) + 1
+    starts += chars[starts] == ord(" ")
+    return JsonlFields(chars, starts, ends)
+
+
+def load_eval_frame(logdir, rebuild: bool = False) -> pd.DataFrame:
+    """Every eval record under `logdir` as columns run, step, avg_return, updating the cache first."""
+    cache = EvalCache(logdir)
+    if rebuild:
+        cache.rebuild()
+    cache.update()
+    df = cache.eval_frame()
+    if df.empty:
+        raise FileNotFoundError(f"No eval_stats.pkl found under {logdir}")
+    return df
+
+
+def clip_runs(df: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
+    """Keep the first min-length records of every run; returns (clipped frame, that length)."""
+    min_len = int(df.groupby("run").size().min())
+    return df[df.groupby("run").cumcount().values < min_len].reset_index(drop=True), min_len
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logdir", required=True)
+    parser.add_argument("--rebuild", action="store_true", help="Drop the caches and ingest everything again.")
+    args = parser.parse_args()
+
+    for cache in (EvalCache(args.logdir), EpisodeCache(args.logdir)):
+        t0 = time.perf_counter()
+        if args.rebuild:
+            cache.rebuild()
+        added = cache.update()
+        rows = len(cache.columns().get("file_id", []))
+        print(
+            f"{cache.NAME}: {len(cache.index['files'])} files, {rows} records ({added} new) "
+            f"in {1e3 * (time.perf_counter() - t0):.1f} ms"
+        )
+    print(f"cache in {pathlib.Path(args.logdir) / CACHE_DIR}")
+
+
+if __name__ == "__main__":
+    main()
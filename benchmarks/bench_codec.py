@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Memory and throughput of --replay-storage compressed against raw stacks, on n-step
+transitions from real Crafter episodes (random policy). Per codec and number of codec
+threads: bytes per transition (payload, Python object overhead and scalars; the PER
+trees come on top for every variant), transitions per GB, add throughput with batches
+of --add-batch, and sample throughput at every --batch-size. "raw" is the plain
+PrioritizedReplayBuffer.
+
+    python -m benchmarks.bench_codec --transitions 2000 --batch-size 64 256 --threads 0 2
+    python -m benchmarks.bench_codec --codecs zlib delta+zlib lz4
+"""
+import argparse
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+from src.agent.obs_codec import CODECS, make_codec
+from src.agent.replay_buffer import CompressedPrioritizedReplayBuffer, PrioritizedReplayBuffer, VecNStepAdder
+from src.vec_env import VecEnv
+
+GB = 1 << 30
+SCALARS = 8 + 4 + 4 + 4  # action, reward, done, priority
+
+
+def collect(transitions, num_envs, n_step, history_length=4, seed=0):
+    """`transitions` n-step transitions (obs, actions, rewards, next_obs, dones) of random play."""
+    envs = VecEnv(
+        "eval",
+        SimpleNamespace(history_length=history_length, logdir=None),
+        num_envs,
+        num_workers=0,
+        seeds=[seed + i for i in range(num_envs)],
+    )
+    nstep = VecNStepAdder(num_envs, n_step, 0.99, (history_length, 84, 84))
+    rng = np.random.default_rng(seed)
+    parts = []
+    try:
+        obs = envs.reset()
+        nstep.reset(obs)
+        count = 0
+        while count < transitions:
+            actions = rng.integers(0, envs.action_space.n, num_envs)
+            next_obs, rewards, dones, infos = envs.step(actions)
+            last_obs = next_obs.copy()
+            for i in np.flatnonzero(dones):
+                last_obs[i] = infos[i]["final_obs"]
+            ready = nstep.add(actions, rewards, last_obs, dones)
+            nstep.reset(next_obs, mask=dones)
+            if ready is not None:
+                parts.append(ready[1:])
+                count += len(ready[2])
+    finally:
+        envs.close()
+    return [np.concatenate(p)[:transitions] for p in zip(*parts)]
+
+
+def build(codec, threads, capacity, obs_shape):
+    args = (capacity, obs_shape, 0.6, 0.4, 1_000_000, torch.device("cpu"))
+    if codec == "raw":
+        return PrioritizedReplayBuffer(*args)
+    return CompressedPrioritizedReplayBuffer(*args, codec=make_codec(codec), threads=threads)
+
+
+def slot_bytes(replay) -> float:
+    """Host bytes per stored transition, trees excluded."""
+    if not isinstance(replay, CompressedPrioritizedReplayBuffer):
+        return 2 * int(np.prod(replay.obs_shape)) + SCALARS
+    blobs = list(replay.obs[: replay.size]) + list(replay.next_obs[: replay.size])
+    objects = sum(sys.getsizeof(b) for b in blobs) + 8 * len(blobs)  # bytes objects + array pointers
+    return objects / replay.size + SCALARS
+
+
+def bench(codec, threads, data, batch_sizes, add_batch, seconds):
+    obs, actions, rewards, next_obs, dones = data
+    n = len(actions)
+    replay = build(codec, threads, n, obs.shape[1:])
+    t0 = time.perf_counter()
+    for lo in range(0, n, add_batch):
+        sl = slice(lo, lo + add_batch)
+        replay.add_batch(obs[sl], actions[sl], rewards[sl], next_obs[sl], dones[sl])
+    add_rate = n / (time.perf_counter() - t0)
+    check = replay.sample(8)
+    assert (check["obs"].numpy() == obs[check["indices"]]).all(), f"{codec} does not round-trip"
+    per_slot = slot_bytes(replay)
+    sample_rates = []
+    for batch_size in batch_sizes:
+        replay.sample(batch_size)
+        count, t0 = 0, time.perf_counter()
+        while time.perf_counter() - t0 < seconds:
+            replay.sample(batch_size)
+            count += 1
+        sample_rates.append(count * batch_size / (time.perf_counter() - t0))
+    return per_slot, add_rate, sample_rates
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codecs", nargs="+", choices=["raw"] + list(CODECS), default=["raw"] + list(CODECS))
+    parser.add_argument("--threads", type=int, nargs="+", default=[0, 2], help="--replay-codec-threads to time.")
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[64, 256])
+    parser.add_argument("--transitions", type=int, default=2000, help="Transitions collected and stored.")
+    parser.add_argument("--num-envs", type=int, default=4, help="Envs the transitions are collected from.")
+    parser.add_argument("--n-step", type=int, default=3)
+    parser.add_argument("--add-batch", type=int, default=16, help="Transitions per add_batch call.")
+    parser.add_argument("--seconds", type=float, default=2.0, help="Sampling time per batch size.")
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    data = collect(args.transitions, args.num_envs, args.n_step)
+    header = "".join(f"{f'sample/s @{b}':>15}" for b in args.batch_size)
+    print(f"{len(data[1])} transitions, stacks of {data[0].shape[1:]} uint8")
+    print(f"{'codec':>11} {'threads':>7} {'bytes/trans':>11} {'ratio':>6} {'M trans/GB':>10} {'add/s':>8}{header}")
+    raw = None
+    for codec in args.codecs:
+        for threads in args.threads if codec != "raw" else [0]:
+            per_slot, add_rate, sample_rates = bench(
+                codec, threads, data, args.batch_size, args.add_batch, args.seconds
+            )
+            raw = raw or (2 * int(np.prod(data[0].shape[1:])) + SCALARS)
+            rates = "".join(f"{r:>15.0f}" for r in sample_rates)
+            print(
+                f"{codec:>11} {threads:>7d} {per_slot:>11.0f} {raw / per_slot:>6.1f} {GB / per_slot / 1e6:>10.2f} "
+                f"{add_rate:>8.0f}{rates}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Action-selection latency: GreedyPolicy.act_batch on the full QRDuelingDQN against the
+InferenceEngine variants (expected-value head; eager / traced / compiled; float / int8,
+and with --bf16 bfloat16 weights next to the full network under bfloat16 autocast),
+at batch 1 (one env per actor) and batch 16 (a VecEnv), plus what a refresh() costs and
+how often the greedy action agrees with the full network's.
+
+    python -m benchmarks.bench_inference --batch-sizes 1 16 --threads 1
+    python -m benchmarks.bench_inference --compile     # adds the compiled variant (slow first call)
+    python -m benchmarks.bench_inference --bf16        # adds the bfloat16 variants
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from src.agent.dqn_model import QRDuelingDQN
+from src.agent.inference import InferenceEngine
+from src.agent.learner import MixedPrecision
+from src.agent.policy import GreedyPolicy
+
+
+def latency(fn, calls):
+    """Mean and p99 per call in microseconds."""
+    for _ in range(5):
+        fn()  # warm caches / lazy init
+    times = np.empty(calls)
+    for i in range(calls):
+        t0 = time.perf_counter()
+        fn()
+        times[i] = time.perf_counter() - t0
+    return 1e6 * times.mean(), 1e6 * np.percentile(times, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--compile", action="store_true")
+    parser.add_argument("--bf16", action="store_true", help="Also time bfloat16 acting.")
+    parser.add_argument("--cpu", action="store_true")
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads (default: torch's choice).")
+    parser.add_argument("--history-length", type=int, default=4)
+    parser.add_argument("--num-actions", type=int, default=17)
+    parser.add_argument("--quantiles", type=int, default=51)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    device = torch.device("cuda" if (torch.cuda.is_available() and not args.cpu) else "cpu")
+    net = QRDuelingDQN(args.history_length, args.num_actions, args.quantiles).to(device).eval()
+    full = GreedyPolicy(net, args.num_actions, args.quantiles, device)
+    max_batch = max(args.batch_sizes)
+
+    variants = [("eager", False, None), ("trace", False, None)]
+    if device.type == "cpu":
+        variants += [("eager", True, None), ("trace", True, None)]
+    if args.compile:
+        variants.append(("compile", False, None))
+    if args.bf16:
+        variants += [("eager", False, torch.bfloat16), ("trace", False, torch.bfloat16)]
+    engines = {}
+    if args.bf16:
+        bf16 = MixedPrecision(device, torch.bfloat16)
+        engines["full+autocast"] = GreedyPolicy(net, args.num_actions, args.quantiles, device, precision=bf16)
+    for backend, quantize, dtype in variants:
+        name = backend + ("+int8" if quantize else "") + ("+bf16" if dtype is not None else "")
+        engines[name] = InferenceEngine(net, device, backend, quantize, max_batch=max_batch, dtype=dtype)
+
+    print(f"device={device} threads={torch.get_num_threads()} actions={args.num_actions} quantiles={args.quantiles}")
+    print(f"{'variant':<14} {'batch':>5} {'mean us':>9} {'p99 us':>9} {'speedup':>8} {'agree':>6} {'refresh us':>11}")
+    check = np.random.randint(0, 256, size=(256, args.history_length, 84, 84), dtype=np.uint8)
+    reference = np.concatenate([full.act_batch(check[i : i + max_batch]) for i in range(0, len(check), max_batch)])
+    for B in args.batch_sizes:
+        obs = np.random.randint(0, 256, size=(B, args.history_length, 84, 84), dtype=np.uint8)
+        base, p99 = latency(lambda: full.act_batch(obs), args.calls)
+        print(f"{'full':<14} {B:>5d} {base:>9.1f} {p99:>9.1f} {1.0:>7.2f}x {1.0:>6.3f} {'-':>11}")
+        for name, engine in engines.items():
+            act = engine.act_batch if isinstance(engine, GreedyPolicy) else engine.act
+            mean, p99 = latency(lambda: act(obs), args.calls)
+            actions = np.concatenate([act(check[i : i + max_batch]) for i in range(0, len(check), max_batch)])
+            agree = (actions == reference).mean()
+            refresh = latency(lambda: engine.refresh(net), 20)[0] if hasattr(engine, "refresh") else float("nan")
+            print(
+                f"{name:<14} {B:>5d} {mean:>9.1f} {p99:>9.1f} {base / mean:>7.2f}x {agree:>6.3f} {refresh:>11.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Learner updates per second: train.learn_qr_dqn against the fused, sync-free
+learn_qr_dqn_fused (optionally with the loss torch.compile'd).
+Every update includes its priority write-back to a replay, as in train.py; batches are
+pre-generated on the device so the timing isolates the learn step.
+Before timing, both steps are run once from the same weights to check they agree, and
+every --precision is checked against float32. Each variant is timed per --precision.
+
+    python -m benchmarks.bench_learn --updates 200
+    python -m benchmarks.bench_learn --compile        # adds the compiled variant (slow first call)
+    python -m benchmarks.bench_learn --precision fp32 bf16
+"""
+import argparse
+import copy
+import time
+
+import numpy as np
+import torch
+
+from src.agent.dqn_model import QRDuelingDQN
+from src.agent.learner import LossMeter, MixedPrecision, PriorityTransfer, fused_qr_dqn_loss
+from src.agent.replay_buffer import PrioritizedReplayBuffer
+from train import build_optimizer, learn_qr_dqn, learn_qr_dqn_fused
+
+GAMMA, KAPPA, LR = 0.99**3, 1.0, 2.5e-4
+
+
+def make_batches(n, batch_size, history, num_actions, capacity, device):
+    batches = []
+    for _ in range(n):
+        batches.append(
+            {
+                "obs": torch.randint(0, 256, (batch_size, history, 84, 84), dtype=torch.uint8, device=device),
+                "next_obs": torch.randint(0, 256, (batch_size, history, 84, 84), dtype=torch.uint8, device=device),
+                "actions": torch.randint(0, num_actions, (batch_size,), device=device),
+                "rewards": torch.randn(batch_size, device=device),
+                "dones": (torch.rand(batch_size, device=device) < 0.05).float(),
+                "weights": torch.rand(batch_size, device=device),
+                "indices": np.random.randint(0, capacity, size=batch_size),
+            }
+        )
+    return batches
+
+
+def make_nets(args, device):
+    online = QRDuelingDQN(args.history_length, args.num_actions, args.quantiles).to(device)
+    target = QRDuelingDQN(args.history_length, args.num_actions, args.quantiles).to(device)
+    target.load_state_dict(online.state_dict())
+    return online, target
+
+
+def check_equal(args, device, batch):
+    online, target = make_nets(args, device)
+    online2 = copy.deepcopy(online)
+    loss, td = learn_qr_dqn(batch, online, target, build_optimizer(online, LR), GAMMA, args.quantiles, KAPPA)
+    loss2, prios = learn_qr_dqn_fused(batch, online2, target, build_optimizer(online2, LR), GAMMA, KAPPA)
+    print(
+        "check: |loss diff|={:.2e}  max |prio diff|={:.2e}  max |weight diff|={:.2e}".format(
+            abs(loss - loss2.item()),
+            np.abs(np.abs(td).mean(1) - prios.cpu().numpy()).max(),
+            max((p - q).abs().max().item() for p, q in zip(online.parameters(), online2.parameters())),
+        )
+    )
+
+
+def check_precision(args, device, batch, precision):
+    """One classic update in `precision` against float32 from the same weights."""
+    online, target = make_nets(args, device)
+    online2 = copy.deepcopy(online)
+    loss, td = learn_qr_dqn(batch, online, target, build_optimizer(online, LR), GAMMA, args.quantiles, KAPPA)
+    loss2, td2 = learn_qr_dqn(
+        batch, online2, target, build_optimizer(online2, LR), GAMMA, args.quantiles, KAPPA, precision=precision
+    )
+    print(
+        "check {}: |loss diff|={:.2e}  max |prio diff|={:.2e}  max |weight diff|={:.2e}".format(
+            precision.dtype,
+            abs(loss - loss2),
+            np.abs(np.abs(td).mean(1) - np.abs(td2).mean(1)).max(),
+            max((p - q).abs().max().item() for p, q in zip(online.parameters(), online2.parameters())),
+        )
+    )
+
+
+def bench(variant, args, device, batches, replay, precision):
+    online, target = make_nets(args, device)
+    optimizer = build_optimizer(online, LR)
+    losses = LossMeter(device)
+    priorities = PriorityTransfer(replay.update_priorities, device)
+    loss_fn = torch.compile(fused_qr_dqn_loss) if variant == "fused+compile" else fused_qr_dqn_loss
+
+    def update(batch):
+        if variant == "classic":
+            loss, td_errors = learn_qr_dqn(
+                batch, online, target, optimizer, GAMMA, args.quantiles, KAPPA, precision=precision
+            )
+            replay.update_priorities(batch["indices"], td_errors)
+        else:
+            loss, prios = learn_qr_dqn_fused(
+                batch, online, target, optimizer, GAMMA, KAPPA, loss_fn=loss_fn, precision=precision
+            )
+            priorities.push(batch["indices"], prios)
+        losses.add(loss)
+
+    for i in range(args.warmup):
+        update(batches[i % len(batches)])
+    priorities.flush()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    t0 = time.perf_counter()
+    for i in range(args.updates):
+        update(batches[i % len(batches)])
+    priorities.flush()
+    losses.pop()  # the one host sync a logging interval would add
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return args.updates / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--history-length", type=int, default=4)
+    parser.add_argument("--num-actions", type=int, default=17)
+    parser.add_argument("--quantiles", type=int, default=51)
+    parser.add_argument("--compile", action="store_true", help="Also time the torch.compile'd fused loss.")
+    parser.add_argument(
+        "--precision", choices=list(MixedPrecision.DTYPES), nargs="+", default=["fp32"], help="Autocast dtypes to time."
+    )
+    parser.add_argument("--cpu", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    device = torch.device("cuda" if (torch.cuda.is_available() and not args.cpu) else "cpu")
+    capacity = 10_000
+    replay = PrioritizedReplayBuffer(capacity, (1,), 0.6, 0.4, 1_000_000, device)
+    for i in range(capacity):
+        replay.add(np.zeros(1, dtype=np.uint8), 0, 0.0, np.zeros(1, dtype=np.uint8), 0.0)
+    batches = make_batches(8, args.batch_size, args.history_length, args.num_actions, capacity, device)
+
+    check_equal(args, device, batches[0])
+    precisions = {name: MixedPrecision.from_name(name, device) for name in args.precision}
+    for name, precision in precisions.items():
+        if precision.dtype is not None:
+            check_precision(args, device, batches[0], precision)
+    variants = ["classic", "fused"] + (["fused+compile"] if args.compile else [])
+    print(f"device={device.type} batch={args.batch_size}")
+    print(f"{'variant':>14} {'precision':>9} {'updates/s':>10}")
+    for variant in variants:
+        for name, precision in precisions.items():
+            print(f"{variant:>14} {name:>9} {bench(variant, args, device, batches, replay, precision):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
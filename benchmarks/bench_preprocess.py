@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-step observation preprocessing cost, without the Crafter simulation itself.
+A stub env replays real 64x64 RGB Crafter frames through
+  before: ResizeImage (PIL) + GrayScale (float mean) + float32 tensor /255 + torch.stack
+  after:  GrayResize (uint8 index map) + FrameStack (uint8 ring) + one stack copy
+
+    python -m benchmarks.bench_preprocess
+"""
+import argparse
+import time
+from collections import deque
+
+import crafter
+import numpy as np
+import torch
+
+from src.crafter_wrapper import FrameStack, GrayResize, GrayScale, ResizeImage
+
+
+class _ReplayFrames:
+    """Stand-in for crafter.Env that cycles through prerecorded frames."""
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.observation_space = crafter.Env().observation_space
+        self.t = 0
+
+    def reset(self):
+        return self.step(0)[0]
+
+    def step(self, action):
+        self.t += 1
+        return self.frames[self.t % len(self.frames)], 0.0, False, {}
+
+
+def before(frames, steps, history):
+    env = GrayScale(ResizeImage(_ReplayFrames(frames)))
+    state = deque([torch.zeros(84, 84)] * history, maxlen=history)
+    t0 = time.perf_counter()
+    for i in range(steps):
+        obs, _, _, _ = env.step(i)
+        state.append(torch.tensor(obs, dtype=torch.float32).div_(255))
+        torch.stack(list(state), 0)
+    return (time.perf_counter() - t0) / steps
+
+
+def after(frames, steps, history):
+    env = GrayResize(_ReplayFrames(frames))
+    state = FrameStack(history)
+    state.reset(env.reset())
+    t0 = time.perf_counter()
+    for i in range(steps):
+        obs, _, _, _ = env.step(i)
+        state.push(obs)
+        state.stack().copy()
+    return (time.perf_counter() - t0) / steps
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=20_000)
+    parser.add_argument("--history-length", type=int, default=4)
+    args = parser.parse_args()
+
+    env = crafter.Env(seed=0)
+    frames = [env.reset()] + [env.step(i % 17)[0] for i in range(255)]
+    torch.set_num_threads(1)
+    t_before = before(frames, args.steps, args.history_length)
+    t_after = after(frames, args.steps, args.history_length)
+    print(f"before: {1e6 * t_before:7.1f} us/step")
+    print(f"after:  {1e6 * t_after:7.1f} us/step  ({t_before / t_after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
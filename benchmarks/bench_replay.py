@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-step cost of the prioritized replay as a function of capacity.
+One "step" = add() + sample(batch) + update_priorities(), i.e. what train.py does
+per environment step with --train-every 1. The buffer is filled to capacity first,
+so the numbers reflect the steady state of a long run.
+
+Observations default to a tiny shape so that 1M capacities fit in RAM and the timing
+isolates the priority structure; pass --obs-shape 4 84 84 to include the frame copies.
+--backend torch times TorchPrioritizedReplayBuffer on --device instead (synchronized
+per op on CUDA, TD errors already on the device as the fused learner produces them).
+
+    python -m benchmarks.bench_replay --capacities 10000 100000 1000000
+    python -m benchmarks.bench_replay --backend torch --device cuda --obs-shape 4 84 84 --capacities 100000
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from src.agent.replay_buffer import PrioritizedReplayBuffer, TorchPrioritizedReplayBuffer
+
+
+def bench_capacity(capacity, obs_shape, batch_size, steps, quantiles=51, backend="numpy", device="cpu"):
+    cls = TorchPrioritizedReplayBuffer if backend == "torch" else PrioritizedReplayBuffer
+    device = torch.device(device)
+    replay = cls(
+        capacity=capacity,
+        obs_shape=obs_shape,
+        alpha=0.6,
+        beta_start=0.4,
+        beta_frames=1_000_000,
+        device=device,
+    )
+    obs = np.random.rand(*obs_shape).astype(np.float32)
+    chunk = np.repeat(obs[None], min(4096, capacity), axis=0)
+    for lo in range(0, capacity, len(chunk)):
+        k = min(len(chunk), capacity - lo)
+        replay.add_batch(chunk[:k], np.arange(k) % 17, np.ones(k), chunk[:k], np.zeros(k))
+    # spread the priorities so the trees are not degenerate
+    for lo in range(0, capacity, 4096):
+        idx = np.arange(lo, min(lo + 4096, capacity))
+        replay.update_priorities(idx, np.random.rand(len(idx), quantiles))
+
+    td = np.random.rand(batch_size, quantiles)
+    sync = torch.cuda.synchronize if device.type == "cuda" else (lambda: None)
+    if backend == "torch":
+        td = torch.as_tensor(td, device=device)
+    timings = {"add": 0.0, "sample": 0.0, "update": 0.0}
+    for i in range(steps):
+        t0 = time.perf_counter()
+        replay.add(obs, i % 17, 1.0, obs, 0.0)
+        sync()
+        t1 = time.perf_counter()
+        batch = replay.sample(batch_size)
+        sync()
+        t2 = time.perf_counter()
+        replay.update_priorities(batch["indices"], td)
+        sync()
+        t3 = time.perf_counter()
+        timings["add"] += t1 - t0
+        timings["sample"] += t2 - t1
+        timings["update"] += t3 - t2
+    return {k: 1e6 * v / steps for k, v in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--capacities", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--obs-shape", type=int, nargs="+", default=[1])
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=2_000)
+    parser.add_argument("--backend", choices=["numpy", "torch"], default="numpy")
+    parser.add_argument("--device", default="cpu", help="Device of the torch backend.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    print(f"{'capacity':>10} {'add us':>9} {'sample us':>10} {'update us':>10} {'step us':>9}")
+    for capacity in args.capacities:
+        r = bench_capacity(
+            capacity, tuple(args.obs_shape), args.batch_size, args.steps, backend=args.backend, device=args.device
+        )
+        total = sum(r.values())
+        print(f"{capacity:>10d} {r['add']:>9.1f} {r['sample']:>10.1f} {r['update']:>10.1f} {total:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
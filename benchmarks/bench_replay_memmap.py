@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sample latency of an in-RAM replay against the same replay memory-mapped from disk
+(--replay-dir in train.py). One sample = sample_indices() + gather() into a preallocated
+batch, i.e. what the prefetch thread does per batch.
+
+The buffer is filled to capacity first; the memmap numbers are therefore mostly served by
+the page cache, except for the part of the buffer that does not fit in RAM. In-RAM runs
+are skipped when the arrays would not fit in the memory currently available.
+
+    python -m benchmarks.bench_replay_memmap --capacities 250000 1000000 --dir /scratch/replay
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from src.agent.replay_buffer import FramePrioritizedReplayBuffer, PrioritizedReplayBuffer
+
+
+def make_replay(storage, capacity, obs_shape, storage_dir):
+    kwargs = dict(
+        capacity=capacity,
+        obs_shape=obs_shape,
+        alpha=0.6,
+        beta_start=0.4,
+        beta_frames=1_000_000,
+        device=torch.device("cpu"),
+        storage_dir=storage_dir,
+    )
+    if storage == "frames":
+        return FramePrioritizedReplayBuffer(n_step=3, **kwargs)
+    return PrioritizedReplayBuffer(**kwargs)
+
+
+def nbytes(storage, capacity, obs_shape):
+    frame = int(np.prod(obs_shape[1:]))
+    per_slot = frame + 8 * obs_shape[0] + 14 if storage == "frames" else 2 * int(np.prod(obs_shape)) + 20
+    return capacity * per_slot
+
+
+def fill(replay, capacity, obs_shape, chunk=1024):
+    pool = np.random.randint(0, 256, size=(257,) + obs_shape, dtype=np.uint8)
+    done = np.zeros(chunk)
+    done[-1] = 1.0  # episodes of `chunk` steps
+    for lo in range(0, capacity, chunk):
+        k = min(chunk, capacity - lo)
+        rows = (lo + np.arange(k)) % 256
+        replay.add_batch(pool[rows], rows % 17, np.ones(k), pool[rows + 1], done[-k:])
+    for lo in range(0, capacity, 4096):  # spread the priorities
+        idx = np.arange(lo, min(lo + 4096, capacity))
+        replay.update_priorities(idx, np.random.rand(len(idx)))
+
+
+def available_ram():
+    """MemAvailable (free + reclaimable cache) where /proc/meminfo exists, else free pages."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def bench(replay, batch_size, samples):
+    out = {
+        "obs": np.empty((batch_size,) + replay.obs_shape, dtype=replay.obs_dtype),
+        "next_obs": np.empty((batch_size,) + replay.obs_shape, dtype=replay.obs_dtype),
+        "actions": np.empty(batch_size, dtype=np.int64),
+        "rewards": np.empty(batch_size, dtype=np.float32),
+        "dones": np.empty(batch_size, dtype=np.float32),
+    }
+    times = np.empty(samples)
+    for i in range(samples):
+        t0 = time.perf_counter()
+        indices, _ = replay.sample_indices(batch_size)
+        replay.gather(indices, out)
+        times[i] = time.perf_counter() - t0
+    return 1e6 * times.mean(), 1e6 * np.percentile(times, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--capacities", type=int, nargs="+", default=[250_000, 1_000_000])
+    parser.add_argument("--storage", choices=["stack", "frames"], default="frames")
+    parser.add_argument("--obs-shape", type=int, nargs="+", default=[4, 84, 84])
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--samples", type=int, default=2_000)
+    parser.add_argument("--dir", default=None, help="Where to put the memmaps (default: a temp dir).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    obs_shape = tuple(args.obs_shape)
+    available = available_ram()
+    print(f"storage={args.storage} obs={obs_shape} batch={args.batch_size} available RAM={available / 2**30:.1f} GiB")
+    print(f"{'capacity':>10} {'backend':>8} {'GiB':>6} {'fill s':>7} {'mean us':>9} {'p99 us':>9}")
+    for capacity in args.capacities:
+        size = nbytes(args.storage, capacity, obs_shape)
+        for backend in ["ram", "memmap"]:
+            if backend == "ram" and size > 0.8 * available:
+                print(f"{capacity:>10d} {backend:>8} {size / 2**30:>6.1f}   skipped, does not fit in RAM")
+                continue
+            root = tempfile.mkdtemp(dir=args.dir) if backend == "memmap" else None
+            try:
+                t0 = time.perf_counter()
+                replay = make_replay(args.storage, capacity, obs_shape, root)
+                fill(replay, capacity, obs_shape)
+                replay.flush()
+                fill_s = time.perf_counter() - t0
+                mean, p99 = bench(replay, args.batch_size, args.samples)
+                print(f"{capacity:>10d} {backend:>8} {size / 2**30:>6.1f} {fill_s:>7.1f} {mean:>9.1f} {p99:>9.1f}")
+                del replay
+            finally:
+                if root is not None:
+                    shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
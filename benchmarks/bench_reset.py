@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reset latency and episodes/sec of VecEnv with and without the WorldPool (--reset-workers),
+for short episodes: every env runs --episode-steps random steps and is then reset onto
+its next episode (episodes that end earlier auto-reset). "0" generates every world on
+reset, as train.py does by default. --learn-ms sleeps that long per tick, standing in for
+the learner the envs wait on in train.py; the pool's processes work during that time.
+
+    python -m benchmarks.bench_reset --reset-workers 0 1 2 --num-envs 1 --episode-steps 50
+    python -m benchmarks.bench_reset --reset-workers 0 4 --num-envs 4 --learn-ms 20
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from src.vec_env import VecEnv
+
+
+def bench_reset(reset_workers, num_envs, episodes, episode_steps, learn_ms, depth, history_length=4):
+    args = SimpleNamespace(history_length=history_length, logdir=None)
+    envs = VecEnv(
+        "eval",
+        args,
+        num_envs,
+        num_workers=num_envs if num_envs > 1 else 0,
+        seeds=list(range(num_envs)),
+        reset_workers=reset_workers,
+        reset_depth=depth,
+    )
+    try:
+        envs.reset()
+        rng = np.random.default_rng(0)
+        n = envs.action_space.n
+        resets, steps, done_episodes = [], 0, 0
+        t0 = time.perf_counter()
+        while done_episodes < episodes:
+            for _ in range(episode_steps):
+                _, _, dones, _ = envs.step(rng.integers(0, n, num_envs))
+                steps += num_envs
+                done_episodes += int(dones.sum())
+                if learn_ms > 0:
+                    time.sleep(learn_ms / 1e3)
+            t1 = time.perf_counter()
+            envs.reset()  # every env moves on to its next episode
+            resets.append(time.perf_counter() - t1)
+            done_episodes += num_envs
+        elapsed = time.perf_counter() - t0
+    finally:
+        envs.close()
+    resets = 1e3 * np.array(resets)
+    return {
+        "reset_ms": resets.mean(),
+        "reset_p99_ms": np.percentile(resets, 99),
+        "episodes_s": done_episodes / elapsed,
+        "steps_s": steps / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reset-workers", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--num-envs", type=int, default=1)
+    parser.add_argument("--episodes", type=int, default=20, help="Episodes timed per setting.")
+    parser.add_argument("--episode-steps", type=int, default=50)
+    parser.add_argument("--learn-ms", type=float, default=0.0, help="Simulated learner time per tick.")
+    parser.add_argument("--depth", type=int, default=2, help="--reset-depth")
+    args = parser.parse_args()
+
+    print(f"envs={args.num_envs} episode_steps={args.episode_steps} learn_ms={args.learn_ms}")
+    print(f"{'reset workers':>13} {'reset ms':>9} {'p99 ms':>9} {'episodes/s':>11} {'env-steps/s':>12}")
+    for workers in args.reset_workers:
+        r = bench_reset(workers, args.num_envs, args.episodes, args.episode_steps, args.learn_ms, args.depth)
+        print(
+            f"{workers:>13d} {r['reset_ms']:>9.1f} {r['reset_p99_ms']:>9.1f} {r['episodes_s']:>11.2f} "
+            f"{r['steps_s']:>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
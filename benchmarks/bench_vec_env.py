@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Throughput of VecEnv in env-steps/sec for a growing number of worker processes,
+with uniformly random actions (i.e. the warmup regime). "0" is the in-process
+single env that train.py uses with --num-envs 1.
+
+    python -m benchmarks.bench_vec_env --workers 0 1 2 4 8 16 32
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from src.vec_env import VecEnv
+
+
+def bench_workers(workers, ticks, warmup_ticks, history_length=4):
+    args = SimpleNamespace(history_length=history_length, logdir=None)
+    num_envs = max(1, workers)
+    envs = VecEnv("eval", args, num_envs, num_workers=workers, seeds=list(range(num_envs)))
+    try:
+        envs.reset()
+        rng = np.random.default_rng(0)
+        n = envs.action_space.n
+        for _ in range(warmup_ticks):
+            envs.step(rng.integers(0, n, num_envs))
+        t0 = time.perf_counter()
+        for _ in range(ticks):
+            envs.step(rng.integers(0, n, num_envs))
+        elapsed = time.perf_counter() - t0
+    finally:
+        envs.close()
+    return num_envs * ticks / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4, 8, 16, 32])
+    parser.add_argument("--ticks", type=int, default=500, help="Batched steps timed per setting.")
+    parser.add_argument("--warmup-ticks", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'env-steps/s':>12}")
+    for workers in args.workers:
+        sps = bench_workers(workers, args.ticks, args.warmup_ticks)
+        print(f"{workers:>8d} {sps:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
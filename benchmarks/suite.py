@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CPU benchmark suite over the training hot paths, with JSON results and a regression check.
+
+Micro: Env.step/reset, replay add/sample/update_priorities per capacity, NStepAdder.add and
+VecNStepAdder.add, QRDuelingDQN forward/backward, quantile_huber_loss, GreedyPolicy.act at
+batch 1. Macro: a short train.main run in env-steps/sec (evaluation stubbed out).
+Every timing is the best of --repeats runs, which keeps the numbers stable enough to compare.
+
+    python -m benchmarks.suite --out bench.json                       # run and save
+    python -m benchmarks.suite --out new.json --compare bench.json    # flag regressions (exit 1)
+    python -m benchmarks.suite --only replay model                    # subset of the cases in CASES
+
+The deeper sweeps stay in the bench_*.py scripts next to this one.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+from benchmarks.bench_replay import bench_capacity
+from src.agent import evaluator
+from src.agent.dqn_model import QRDuelingDQN
+from src.agent.learner import quantile_huber_loss
+from src.agent.policy import GreedyPolicy
+from src.agent.replay_buffer import NStepAdder, VecNStepAdder
+from src.crafter_wrapper import Env
+
+LOWER, HIGHER = "lower", "higher"  # which direction is better
+
+
+def _best_us(fn, calls, repeats):
+    """Best mean wall time of `fn` in microseconds over `repeats` runs of `calls` calls."""
+    fn()  # warm caches / lazy init
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        best = min(best, (time.perf_counter() - t0) / calls)
+    return 1e6 * best
+
+
+def bench_env(args):
+    env = Env("eval", SimpleNamespace(logdir=None, history_length=4))
+    env.reset()
+    rng = np.random.default_rng(0)
+    actions = rng.integers(0, env.action_space.n, size=100_000)
+    t = iter(actions)
+
+    def step():
+        _, _, done, _ = env.step(int(next(t)))
+        if done:
+            env.reset()
+
+    return {
+        "env.step": (_best_us(step, args.scale * 200, args.repeats), "us", LOWER),
+        "env.reset": (_best_us(env.reset, 2, 1) / 1e3, "ms", LOWER),
+    }
+
+
+def bench_replay(args):
+    results = {}
+    for capacity in args.capacities:
+        r = min(
+            (bench_capacity(capacity, (1,), 64, args.scale * 500) for _ in range(args.repeats)),
+            key=lambda r: sum(r.values()),
+        )
+        for op, us in r.items():
+            results[f"replay.{op}@{capacity}"] = (us, "us", LOWER)
+    return results
+
+
+def bench_nstep(args):
+    obs = np.zeros((4, 84, 84), dtype=np.uint8)
+    adder = NStepAdder(n=3, gamma=0.99)
+    adder.reset(obs)
+    n = 8
+    vec = VecNStepAdder(n, 3, 0.99, (4, 84, 84))
+    vec.reset(np.zeros((n, 4, 84, 84), dtype=np.uint8))
+    actions, rewards = np.ones(n, dtype=np.int64), np.ones(n)
+    next_obs, dones = np.zeros((n, 4, 84, 84), dtype=np.uint8), np.zeros(n, dtype=bool)
+    return {
+        "nstep.add": (_best_us(lambda: adder.add(1, 1.0, obs, False), args.scale * 2000, args.repeats), "us", LOWER),
+        f"nstep.vec_add@{n}": (
+            _best_us(lambda: vec.add(actions, rewards, next_obs, dones), args.scale * 1000, args.repeats),
+            "us",
+            LOWER,
+        ),
+    }
+
+
+def bench_model(args):
+    net = QRDuelingDQN(4, 17, 51)
+    x = torch.randint(0, 256, (64, 4, 84, 84), dtype=torch.uint8)
+
+    def forward():
+        with torch.no_grad():
+            net(x)
+
+    def forward_backward():
+        net.zero_grad(set_to_none=True)
+        net(x).mean().backward()
+
+    pred = torch.randn(64, 51, requires_grad=True)
+    target = torch.randn(64, 51)
+    return {
+        "model.forward@64": (_best_us(forward, args.scale * 5, args.repeats) / 1e3, "ms", LOWER),
+        "model.forward_backward@64": (_best_us(forward_backward, args.scale * 3, args.repeats) / 1e3, "ms", LOWER),
+        "loss.quantile_huber@64": (
+            _best_us(lambda: quantile_huber_loss(pred, target), args.scale * 200, args.repeats),
+            "us",
+            LOWER,
+        ),
+    }
+
+
+def bench_policy(args):
+    net = QRDuelingDQN(4, 17, 51)
+    greedy = GreedyPolicy(net, 17, 51, device=torch.device("cpu"))
+    obs = np.zeros((4, 84, 84), dtype=np.uint8)
+    return {"policy.greedy_act@1": (_best_us(lambda: greedy.act(obs), args.scale * 100, args.repeats), "us", LOWER)}
+
+
+def bench_train(args):
+    import train
+
+    steps, warmup = args.scale * 100, args.scale * 200
+    with tempfile.TemporaryDirectory() as logdir:
+        opt = train.get_options(
+            [
+                "--cpu",
+                "--logdir", os.path.join(logdir, "0"),
+                "--steps", str(steps),
+                "--warmup-steps", str(warmup),
+                "--replay-size", "5000",
+                "--eval-interval", str(10**9),
+            ]
+        )  # fmt: skip
+        evaluate, evaluator.eval = evaluator.eval, lambda *a, **k: None  # only time the training loop
+        try:
+            t0 = time.perf_counter()
+            train.main(opt)
+            elapsed = time.perf_counter() - t0
+        finally:
+            evaluator.eval = evaluate
+    # warmup steps included: they are env steps the loop pays for too
+    return {"train.main": ((steps + warmup) / elapsed, "env-steps/s", HIGHER)}
+
+
+CASES = {
+    "env": bench_env,
+    "replay": bench_replay,
+    "nstep": bench_nstep,
+    "model": bench_model,
+    "policy": bench_policy,
+    "train": bench_train,
+}
+
+
+def _metadata():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "numpy": np.__version__,
+        "cpus": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "machine": platform.machine(),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print the change of every metric against `baseline`; returns the regressed names."""
+    regressions = []
+    print(f"\n{'metric':<32} {'baseline':>12} {'now':>12} {'change':>8}")
+    for name, now in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]["value"]
+        change = (now["value"] - old) / old if old else 0.0
+        worse = change > threshold if now["better"] == LOWER else change < -threshold
+        flag = "  REGRESSION" if worse else ""
+        print(f"{name:<32} {old:>12.2f} {now['value']:>12.2f} {100 * change:>+7.1f}%{flag}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--only", nargs="+", choices=list(CASES), default=list(CASES), help="Run just these cases (default: all)."
+    )
+    parser.add_argument("--capacities", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--scale", type=int, default=1, help="Multiplies the iterations of every case.")
+    parser.add_argument("--out", default=None, help="Write the results as JSON here.")
+    parser.add_argument("--compare", default=None, metavar="BASELINE", help="JSON of an earlier run to compare with.")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown that counts as a regression.")
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads (default: torch's choice).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    results = {}
+    for case in args.only:
+        t0 = time.perf_counter()
+        for name, (value, unit, better) in CASES[case](args).items():
+            results[name] = {"value": value, "unit": unit, "better": better}
+            print(f"{name:<32} {value:>12.2f} {unit}")
+        print(f"  ({case}: {time.perf_counter() - t0:.0f}s)", file=sys.stderr)
+
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump({"meta": _metadata(), "results": results}, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {100 * args.threshold:.0f}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+import threading
+from contextlib import nullcontext
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+
+from src.agent.policy import EpsGreedyPolicy
+from src.agent.replay_buffer import PrioritizedReplayBuffer, VecNStepAdder
+from src.utils.perf import perf
+
+
+def collect_step(
+    envs,
+    actions: np.ndarray,
+    nstep: VecNStepAdder,
+    replay: PrioritizedReplayBuffer,
+    lock: Optional[threading.Lock] = None,
+    stream_offset: int = 0,
+) -> Tuple[np.ndarray, int]:
+    """
+    Step every env of a VecEnv once and push the ready n-step transitions into the replay
+    (under `lock` if given) with one add_batch. Returns (next obs, finished episodes).
+    """
+    with perf.phase("env"):
+        next_obs, rewards, dones, infos = envs.step(actions)
+    perf.count("env_steps", len(actions))
+    perf.count("episodes", int(dones.sum()))
+    last_obs = next_obs
+    if dones.any():
+        # finished envs were auto-reset, their last stack is in the info
+        last_obs = next_obs.copy()
+        for i in np.flatnonzero(dones):
+            last_obs[i] = infos[i]["final_obs"]
+    with perf.phase("nstep"):
+        ready = nstep.add(actions, rewards, last_obs, dones)
+        nstep.reset(next_obs, mask=dones)
+    if ready is not None:
+        streams, o0, a0, Rn, on, dn = ready
+        with lock if lock is not None else nullcontext(), perf.phase("replay_add"):
+            replay.add_batch(o0, a0, Rn, on, dn, streams=stream_offset + streams)
+    return next_obs, int(dones.sum())
+
+
+class WeightStore:
+    """
+    Latest learner weights plus a version number. The learner publishes a detached clone
+    every few updates; actors reload only when the version moved.
+    """
+
+    def __init__(self, net: torch.nn.Module):
+        self._lock = threading.Lock()
+        self._state = None
+        self.version = 0
+        self.publish(net)
+
+    def publish(self, net: torch.nn.Module) -> int:
+        state = {k: v.detach().clone() for k, v in net.state_dict().items()}
+        with self._lock:
+            self._state = state
+            self.version += 1
+            return self.version
+
+    def sync(self, net: torch.nn.Module, version: int) -> int:
+        """Load the latest weights into `net` if newer than `version`; returns the loaded version."""
+        if self.version == version:
+            return version
+        with self._lock:
+            state, version = self._state, self.version
+        net.load_state_dict(state)
+        return version
+
+
+class ReplayRatio:
+    """
+    Keeps the learner at `ratio` updates per (post-warmup) env step. The learner blocks
+    until an update is due; actors block once they are more than `slack` env steps
+    ahead of the learner, and stop after `total_steps` env steps.
+    """
+
+    def __init__(self, ratio: float, total_steps: int, slack: int):
+        self.ratio = ratio
+        self.total_steps = total_steps
+        self.slack = slack
+        self.env_steps = 0
+        self.updates = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def acquire_env_steps(self, n: int) -> bool:
+        """Reserve n env steps for an actor; False once the run is over."""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.closed
+                or self.env_steps >= self.total_steps
+                or (self.env_steps - self.slack) * self.ratio <= self.updates
+            )
+            if self.closed or self.env_steps >= self.total_steps:
+                return False
+            self.env_steps += n
+            self._cond.notify_all()
+            return True
+
+    def acquire_update(self) -> bool:
+        """Wait until the next update is due; False once all due updates are done."""
+        with self._cond:
+            due = lambda: self.updates + 1 <= self.env_steps * self.ratio  # noqa: E731
+            self._cond.wait_for(lambda: due() or self.closed or self.env_steps >= self.total_steps)
+            if not due():
+                return False
+            self.updates += 1
+            self._cond.notify_all()
+            return True
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class ActorThread(threading.Thread):
+    """
+    Steps its own VecEnv with an epsilon-greedy copy of the online network and pushes
+    n-step transitions into the shared replay (under `lock`). Acts uniformly at random
+    until the replay holds `warmup_steps` transitions, then follows the ReplayRatio gate.
+    """
+
+    def __init__(
+        self,
+        envs,
+        net: torch.nn.Module,
+        policy: EpsGreedyPolicy,
+        weights: WeightStore,
+        replay: PrioritizedReplayBuffer,
+        lock: threading.Lock,
+        nstep: VecNStepAdder,
+        gate: ReplayRatio,
+        warmup_steps: int,
+        stream_offset: int = 0,
+    ):
+        super().__init__(daemon=True)
+        self.envs = envs
+        self.net = net
+        self.policy = policy
+        self.weights = weights
+        self.replay = replay
+        self.lock = lock
+        self.nstep = nstep
+        self.gate = gate
+        self.warmup_steps = warmup_steps
+        self.stream_offset = stream_offset
+        self.version = 0
+        self.episodes = 0
+        self.error: Optional[BaseException] = None
+
+    def run(self) -> None:
+        try:
+            self._run()
+        except BaseException as e:  # surfaced by the learner
+            self.error = e
+            self.gate.close()
+
+    def _run(self) -> None:
+        obs = self.envs.reset()
+        self.nstep.reset(obs)
+        while not self.gate.closed:
+            warmup = self.replay.size < self.warmup_steps
+            if not warmup:
+                if not self.gate.acquire_env_steps(self.envs.num_envs):
+                    break
+                # follow the global step count, as the single-loop schedule does
+                self.policy.t = self.warmup_steps + self.gate.env_steps
+            version = self.weights.sync(self.net, self.version)
+            if version != self.version and self.policy.engine is not None:
+                self.policy.engine.refresh(self.net)
+            self.version = version
+            with perf.phase("act"):
+                actions = self.policy.act_batch(obs, force_random=warmup)
+            obs, finished = collect_step(
+                self.envs, actions, self.nstep, self.replay, self.lock, self.stream_offset
+            )
+            self.episodes += finished
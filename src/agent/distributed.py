@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+import multiprocessing as mp
+import queue
+import signal
+import sys
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from src.agent.actor import collect_step
+from src.agent.dqn_model import QRDuelingDQN
+from src.agent.inference import InferenceEngine
+from src.agent.learner import MixedPrecision, compute_targets
+from src.agent.policy import EpsGreedyPolicy
+from src.agent.replay_buffer import PrioritizedReplayBuffer, VecNStepAdder
+from src.utils import log_sink
+from src.utils.schedule import ConstantSchedule
+from src.utils.seed import set_seed_everywhere
+from src.vec_env import VecEnv
+
+
+def apex_epsilons(num_actors: int, eps: float = 0.4, alpha: float = 7.0) -> List[float]:
+    """Ape-X exploration ladder: actor i of N acts with eps ** (1 + alpha * i / (N - 1))."""
+    if num_actors == 1:
+        return [eps]
+    return [eps ** (1 + alpha * i / (num_actors - 1)) for i in range(num_actors)]
+
+
+def _shared_array(ctx, shape: Tuple[int, ...], dtype) -> np.ndarray:
+    """Zeroed numpy array in shared memory; processes forked afterwards see the same buffer."""
+    dtype = np.dtype(dtype)
+    buf = ctx.RawArray("b", int(np.prod(shape)) * dtype.itemsize)
+    return np.frombuffer(buf, dtype=dtype).reshape(shape)
+
+
+class SharedWeights:
+    """
+    WeightStore across processes: the learner's state_dict flattened into one float32
+    shared-memory buffer plus a version number. Actors forked after construction reload
+    only when the version moved.
+    """
+
+    def __init__(self, net: torch.nn.Module, ctx):
+        self._layout = [(k, v.shape, v.numel()) for k, v in net.state_dict().items()]
+        self._flat = torch.from_numpy(_shared_array(ctx, (sum(n for _, _, n in self._layout),), np.float32))
+        self._version = ctx.RawValue("q", 0)
+        self._lock = ctx.Lock()
+        self.publish(net)
+
+    @property
+    def version(self) -> int:
+        return self._version.value
+
+    def publish(self, net: torch.nn.Module) -> int:
+        with torch.no_grad(), self._lock:
+            offset = 0
+            for (_, _, n), v in zip(self._layout, net.state_dict().values()):
+                self._flat[offset : offset + n].copy_(v.reshape(-1))
+                offset += n
+            self._version.value += 1
+            return self._version.value
+
+    def sync(self, net: torch.nn.Module, version: int) -> int:
+        """Load the latest weights into `net` if newer than `version`; returns the loaded version."""
+        if self._version.value == version:
+            return version
+        with self._lock:
+            state, offset = {}, 0
+            for k, shape, n in self._layout:
+                state[k] = self._flat[offset : offset + n].view(shape)
+                offset += n
+            net.load_state_dict(state)  # copies, so the buffer may change right after
+            return self._version.value
+
+
+class TransitionChannel:
+    """
+    Shared-memory batches of n-step transitions from actor processes to the replay server.
+    Each actor owns `slots` preallocated batches of up to `batch` transitions and fills them
+    round-robin; a filled batch is announced on the one `ready` queue as (actor, slot, count)
+    and handed back with release() once the server has copied it into the replay, so an
+    actor only waits when the server is `slots` batches behind it. Needs fork-started actors.
+    """
+
+    def __init__(self, ctx, num_actors: int, slots: int, batch: int, obs_shape: Tuple[int, ...]):
+        shape = (num_actors, slots, batch)
+        self.slots = slots
+        self.batch = batch
+        self.obs = _shared_array(ctx, shape + obs_shape, np.uint8)
+        self.next_obs = _shared_array(ctx, shape + obs_shape, np.uint8)
+        self.actions = _shared_array(ctx, shape, np.int64)
+        self.rewards = _shared_array(ctx, shape, np.float32)
+        self.dones = _shared_array(ctx, shape, np.float32)
+        self.priorities = _shared_array(ctx, shape, np.float32)
+        self.ready = ctx.Queue()
+        self._free = [ctx.Semaphore(slots) for _ in range(num_actors)]
+
+    def acquire(self, actor: int, timeout: float) -> bool:
+        """Wait for a free slot of `actor` (its next one in round-robin order)."""
+        return self._free[actor].acquire(timeout=timeout)
+
+    def release(self, actor: int) -> None:
+        self._free[actor].release()
+
+
+def initial_priorities(
+    net: torch.nn.Module,
+    obs: np.ndarray,
+    actions: np.ndarray,
+    rewards: np.ndarray,
+    next_obs: np.ndarray,
+    dones: np.ndarray,
+    gamma_n: float,
+    precision: MixedPrecision,
+) -> np.ndarray:
+    """
+    Ape-X actor priorities: |TD error| of n-step transitions under `net` as online and
+    target network at once (Double DQN action selection), averaged over the quantiles as
+    the learner's priority updates are. [K] float32.
+    """
+    k = len(actions)
+    rows = torch.arange(k)
+    with torch.no_grad(), precision.autocast():
+        dist_all = net(torch.from_numpy(np.concatenate([obs, next_obs]))).float()  # [2K, A, N]
+    dist = dist_all[rows, torch.from_numpy(actions)]  # [K, N]
+    next_all = dist_all[k:]
+    next_dist = next_all[rows, next_all.mean(2).argmax(1)]
+    target = compute_targets(torch.from_numpy(rewards), torch.from_numpy(dones), gamma_n, next_dist)
+    return (target - dist).abs().mean(1).numpy()
+
+
+class _SlotWriter:
+    """
+    collect_step's replay inside an actor process: writes transitions into the actor's
+    channel slots and sends each full batch, with its initial priorities, to the server.
+    """
+
+    def __init__(self, channel: TransitionChannel, actor: int, net, gamma_n: float, precision, stop):
+        self.channel = channel
+        self.actor = actor
+        self.net = net
+        self.gamma_n = gamma_n
+        self.precision = precision
+        self.stop = stop
+        self.slot = 0
+        self.count = 0
+        self.held = False
+
+    def add_batch(self, obs, actions, rewards, next_obs, dones, streams=None) -> None:
+        ch, k = self.channel, len(actions)
+        if self.count + k > ch.batch:
+            self.send()
+        if not self.held:
+            while not ch.acquire(self.actor, timeout=0.1):
+                if self.stop.is_set():
+                    return
+            self.held = True
+        at = (self.actor, self.slot, slice(self.count, self.count + k))
+        ch.obs[at] = obs
+        ch.next_obs[at] = next_obs
+        ch.actions[at] = actions
+        ch.rewards[at] = rewards
+        ch.dones[at] = dones
+        self.count += k
+
+    def send(self) -> None:
+        if self.count == 0:
+            return
+        ch, at = self.channel, (self.actor, self.slot, slice(0, self.count))
+        ch.priorities[at] = initial_priorities(
+            self.net,
+            ch.obs[at],
+            ch.actions[at],
+            ch.rewards[at],
+            ch.next_obs[at],
+            ch.dones[at],
+            self.gamma_n,
+            self.precision,
+        )
+        ch.ready.put((self.actor, self.slot, self.count))
+        self.slot = (self.slot + 1) % ch.slots
+        self.count = 0
+        self.held = False
+
+
+def run_actor(index: int, opt, epsilon: float, channel: TransitionChannel, weights: SharedWeights, env_steps, stop):
+    """
+    Process target of actor `index` (train.py --actor-processes). Steps an in-process
+    VecEnv of opt.num_envs envs on CPU, acting uniformly at random until `env_steps` (a
+    shared counter over all actors) passes opt.warmup_steps and then epsilon-greedy at a
+    fixed `epsilon` with the latest published weights, and streams n-step transitions to
+    the replay server in batches of channel.batch. Stops after opt.warmup_steps +
+    opt.steps env steps overall or once `stop` is set.
+    """
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # still flush the stats below
+    torch.set_num_threads(1)
+    # a seed of its own per actor, derived from --seed
+    set_seed_everywhere(int(np.random.SeedSequence([opt.seed, index]).generate_state(1)[0] >> 1))
+    device = torch.device("cpu")
+    precision = MixedPrecision.from_name(opt.precision, device)
+    net = QRDuelingDQN(opt.history_length, opt.num_actions, opt.quantiles)
+    version = weights.sync(net, 0)
+    engine = None
+    if opt.inference is not None:
+        engine = InferenceEngine(
+            net, device, opt.inference, opt.inference_quantize, max_batch=opt.num_envs, dtype=precision.dtype
+        )
+    policy = EpsGreedyPolicy(net, opt.num_actions, opt.quantiles, ConstantSchedule(epsilon), device, engine, precision)
+    envs = VecEnv(
+        "train", opt, opt.num_envs, num_workers=0, log_interval=opt.log_interval, stats_binary=opt.stats_binary
+    )
+    nstep = VecNStepAdder(opt.num_envs, opt.n_step, opt.gamma, (opt.history_length, 84, 84))
+    writer = _SlotWriter(channel, index, net, opt.gamma**opt.n_step, precision, stop)
+    total = opt.warmup_steps + opt.steps
+    try:
+        obs = envs.reset()
+        nstep.reset(obs)
+        while not stop.is_set() and env_steps.value < total:
+            warmup = env_steps.value < opt.warmup_steps
+            if not warmup:
+                new = weights.sync(net, version)
+                if new != version and engine is not None:
+                    engine.refresh(net)
+                version = new
+            actions = policy.act_batch(obs, force_random=warmup)
+            obs, _ = collect_step(envs, actions, nstep, writer)
+            with env_steps.get_lock():
+                env_steps.value += envs.num_envs
+        writer.send()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        envs.close()
+        log_sink.close_all()  # the process leaves through os._exit
+
+
+class ReplayServer(threading.Thread):
+    """
+    Owns the writes to the learner's replay: copies every batch the actors announce on
+    channel.ready into it with their initial priorities (under `lock`, which the learner
+    takes to sample and update priorities) and hands the slot back to its actor.
+    """
+
+    def __init__(self, channel: TransitionChannel, replay: PrioritizedReplayBuffer, lock: threading.Lock):
+        super().__init__(daemon=True)
+        self.channel = channel
+        self.replay = replay
+        self.lock = lock
+        self.transitions = 0
+        self._closed = threading.Event()
+        self.error: Optional[BaseException] = None
+
+    def run(self) -> None:
+        try:
+            while not self._closed.is_set():
+                self.drain(timeout=0.1)
+        except BaseException as e:  # surfaced by the learner
+            self.error = e
+
+    def drain(self, timeout: float) -> None:
+        """Copy in the next announced batch, if one arrives within `timeout` seconds."""
+        ch = self.channel
+        try:
+            actor, slot, count = ch.ready.get(timeout=timeout)
+        except queue.Empty:
+            return
+        at = (actor, slot, slice(0, count))
+        with self.lock:
+            self.replay.add_batch(
+                ch.obs[at], ch.actions[at], ch.rewards[at], ch.next_obs[at], ch.dones[at], priorities=ch.priorities[at]
+            )
+        ch.release(actor)
+        self.transitions += count
+
+    def close(self) -> None:
+        self._closed.set()
+        self.join()
+
+
+class ActorPool:
+    """
+    The actor side of Ape-X in one node: opt.actor_processes forked run_actor processes
+    at the apex_epsilons ladder, the ReplayServer thread feeding `replay`, and the
+    published weights. It is also the learner's gate, like ReplayRatio: acquire_update()
+    waits until an update is due at `ratio` updates per post-warmup env step, but the
+    actors never wait for the learner; once they are done it returns False, dropping the
+    updates the learner did not keep up with.
+    """
+
+    def __init__(
+        self, opt, online: torch.nn.Module, replay: PrioritizedReplayBuffer, lock: threading.Lock, ratio: float
+    ):
+        assert opt.actor_batch >= opt.num_envs, "an actor sends at least one step of its envs at a time"
+        ctx = mp.get_context("fork")  # the channel and weights are shared by inheritance
+        self.opt = opt
+        self.ratio = ratio
+        self.total_steps = opt.steps
+        self.replay = replay
+        self.channel = TransitionChannel(
+            ctx, opt.actor_processes, opt.actor_slots, opt.actor_batch, (opt.history_length, 84, 84)
+        )
+        self.weights = SharedWeights(online, ctx)
+        self.server = ReplayServer(self.channel, replay, lock)
+        self.epsilons = apex_epsilons(opt.actor_processes, opt.apex_eps, opt.apex_alpha)
+        self._counter = ctx.Value("q", 0)  # env steps of all actors, warmup included
+        self._stop = ctx.Event()
+        self.processes = [
+            ctx.Process(
+                target=run_actor,
+                args=(i, opt, eps, self.channel, self.weights, self._counter, self._stop),
+                name=f"actor-{i}",
+                daemon=True,
+            )
+            for i, eps in enumerate(self.epsilons)
+        ]
+        self.updates = 0
+        self.closed = False
+        self.started = self.learn_started = self.stopped = None
+
+    @property
+    def total_env_steps(self) -> int:
+        return self._counter.value
+
+    @property
+    def env_steps(self) -> int:
+        """Post-warmup env steps of all actors (up to opt.steps; the last actors to stop may overshoot)."""
+        return min(self.total_steps, max(0, self._counter.value - self.opt.warmup_steps))
+
+    def start(self) -> None:
+        # fork the actors before the server thread exists, so none inherits a lock it holds
+        for proc in self.processes:
+            proc.start()
+        self.server.start()
+        self.started = time.perf_counter()
+
+    def check(self) -> None:
+        """Raise if the replay server or an actor failed."""
+        if self.server.error is not None:
+            raise self.server.error
+        for proc in self.processes:
+            if proc.exitcode not in (None, 0):
+                raise RuntimeError(f"{proc.name} exited with code {proc.exitcode}")
+
+    def acquire_update(self) -> bool:
+        """Wait until the next update is due; False once the actors are done."""
+        while not self.closed and self.env_steps < self.total_steps:
+            if self.updates + 1 <= self.env_steps * self.ratio and self.replay.size >= self.opt.batch_size:
+                if self.learn_started is None:
+                    self.learn_started = time.perf_counter()
+                self.updates += 1
+                return True
+            self.check()
+            time.sleep(0.001)
+        return False
+
+    def close(self) -> None:
+        """Stop the actors (their last batches still reach the replay) and the server."""
+        if self.closed:
+            return
+        self.closed = True
+        self.stopped = time.perf_counter()
+        self._stop.set()
+        for proc in self.processes:
+            proc.join(timeout=30)  # the server keeps draining meanwhile
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+        self.server.close()
+
+    def report(self) -> str:
+        """Throughput of the run so far: env steps/s of all actors and learner updates/s since learning began."""
+        end = self.stopped or time.perf_counter()
+        env_rate = self.total_env_steps / max(end - self.started, 1e-9)
+        update_rate = self.updates / max(end - self.learn_started, 1e-9) if self.learn_started else 0.0
+        return (
+            f"{len(self.processes)} actor processes: {env_rate:.0f} env-steps/s, {update_rate:.1f} updates/s, "
+            f"{self.updates / max(self.env_steps, 1):.3f} updates per env step"
+        )
@@ -11,6 +11,8 @@ class QRDuelingDQN(nn.Module):
     Dueling CNN torso with Quantile heads.
     Outputs a distribution over returns for each action: [B, A, Ntau]
     Combine as V_tau + (A_tau - mean_a A_tau)
+    Under autocast the layers run in the lower precision; the heads are combined and
+    returned in float32.
     """
 
     def __init__(self, in_channels: int, num_actions: int, num_quantiles: int = 51):
@@ -43,13 +45,14 @@ class QRDuelingDQN(nn.Module):
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         """
-        x: [B, C, 84, 84] float in [0,1]
+        x: [B, C, 84, 84] uint8 in [0,255] (scaled here, on the device) or float in [0,1]
         returns: [B, A, N]
         """
-        x = x / 1.0  # already normalized
+        if x.dtype == torch.uint8:
+            x = x.float().div_(255)
         feats = self.fc(self.conv(x))
-        V = self.value_head(feats).unsqueeze(1)  # [B,1,N]
-        A = self.adv_head(feats).view(-1, self.num_actions, self.num_quantiles)  # [B,A,N]
+        V = self.value_head(feats).float().unsqueeze(1)  # [B,1,N]
+        A = self.adv_head(feats).float().view(-1, self.num_actions, self.num_quantiles)  # [B,A,N]
         A = A - A.mean(dim=1, keepdim=True)
         Z = V + A  # [B, A, N]
         return Z
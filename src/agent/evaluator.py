@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+import multiprocessing as mp
+import os
+import time
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from src.crafter_wrapper import Env
+from src.vec_env import VecEnv
+from src.agent.dqn_model import QRDuelingDQN
+from src.agent.inference import InferenceEngine
+from src.agent.policy import GreedyPolicy
+from src.utils import log_sink
+
+
+def _save_stats(episodic_returns, crt_step, path, interval: float = log_sink.FLUSH_INTERVAL):
+    """Print mean/std of the returns and queue the eval_stats.pkl record (appended by a LogSink thread)."""
+    episodic_returns = np.asarray(episodic_returns, dtype=np.float64)
+    avg_return = float(episodic_returns.mean())
+    std = float(episodic_returns.std(ddof=1)) if len(episodic_returns) > 1 else float("nan")
+    print("[{:06d}] eval results: R/ep={:03.2f}, std={:03.2f}.".format(crt_step, avg_return, std))
+    sink = log_sink.shared_sink(path + "/eval_stats.pkl", log_sink.encode_pickle, interval=interval)
+    sink.write({"step": crt_step, "avg_return": avg_return})
+
+
+@torch.no_grad()
+def eval(agent: torch.nn.Module, env: Env, crt_step: int, opt) -> None:
+    """Greedy evaluation; no epsilon."""
+    agent.eval()
+    episodic_returns = []
+    engine = build_eval_engine(agent, opt)
+    greedy = GreedyPolicy(agent, opt.num_actions, opt.quantiles, device=opt.device, engine=engine)
+    for _ in range(opt.eval_episodes):
+        obs, done = env.reset(), False
+        episodic_returns.append(0.0)
+        while not done:
+            action = greedy.act(obs)
+            obs, reward, done, info = env.step(action)
+            episodic_returns[-1] += reward
+    _save_stats(episodic_returns, crt_step, opt.logdir, opt.log_interval)
+    agent.train()
+
+
+def eval_seeds(opt) -> np.ndarray:
+    """World seed of every eval episode; fixed for a run so each eval sees the same worlds."""
+    return np.random.SeedSequence(opt.seed).generate_state(opt.eval_episodes).astype(np.int64)
+
+
+@torch.no_grad()
+def eval_batched(agent: torch.nn.Module, pool: VecEnv, crt_step: int, opt) -> None:
+    """
+    Greedy evaluation of all --eval-episodes at once on a pool of envs: one batched
+    forward per tick over the running episodes, finished ones are masked out and
+    their env starts the next pending episode. Same eval_stats.pkl record as eval().
+    """
+    agent.eval()
+    engine = build_eval_engine(agent, opt)
+    greedy = GreedyPolicy(agent, opt.num_actions, opt.quantiles, device=opt.device, engine=engine)
+    seeds = eval_seeds(opt)
+    episodic_returns = np.zeros(opt.eval_episodes, dtype=np.float64)
+    episode = np.full(pool.num_envs, -1)  # episode run by each env, -1 when idle
+    first = min(pool.num_envs, opt.eval_episodes)
+    episode[:first] = np.arange(first)
+    obs = pool.reset(range(first), seeds[:first])
+    next_episode = first
+    while (episode >= 0).any():
+        active = episode >= 0
+        actions = np.zeros(pool.num_envs, dtype=np.int64)
+        actions[active] = greedy.act_batch(obs[active])
+        obs, rewards, dones, _ = pool.step(actions, mask=active)
+        episodic_returns[episode[active]] += rewards[active]
+        for i in np.flatnonzero(dones):
+            if next_episode < opt.eval_episodes:
+                episode[i] = next_episode
+                obs[i] = pool.reset([i], [seeds[next_episode]])[i]
+                next_episode += 1
+            else:
+                episode[i] = -1
+    _save_stats(episodic_returns, crt_step, opt.logdir, opt.log_interval)
+    agent.train()
+
+
+def build_eval_engine(net: QRDuelingDQN, opt) -> Optional[InferenceEngine]:
+    # evaluation scores the learned network: float weights, and no compile for a one-off engine
+    if opt.inference is None:
+        return None
+    return InferenceEngine(net, opt.device, max_batch=max(1, opt.eval_envs))
+
+
+def make_eval_env(opt) -> Tuple[object, Callable]:
+    """(eval env, matching eval function): a pool of --eval-envs envs for eval_batched, else one Env."""
+    if opt.eval_envs > 0:
+        pool = VecEnv(
+            "eval", opt, opt.eval_envs, num_workers=opt.eval_envs if opt.eval_envs > 1 else 0, auto_reset=False
+        )
+        return pool, eval_batched
+    return Env("eval", opt), eval
+
+
+class SnapshotQueue:
+    """
+    Weight snapshots handed from training to an evaluator process through a directory.
+
+    publish() writes `snapshot_<step>.pt` (the online state dict and the step) and renames
+    it into place; the evaluator claims the oldest one by renaming it to `.claimed`, so
+    neither side sees a half-written or half-deleted file. Backpressure: when more than
+    `max_pending` unclaimed snapshots pile up, the oldest are deleted, i.e. a slow
+    evaluator skips stale steps instead of holding up training or lagging ever further
+    behind. The newest snapshot, and so the final one, is never dropped.
+    close() tells the evaluator to stop once the queue is empty.
+    """
+
+    DONE = "DONE"
+
+    def __init__(self, directory, max_pending: int = 1):
+        if max_pending < 1:
+            raise ValueError(f"max_pending must be at least 1 (the newest snapshot is kept), got {max_pending}")
+        self.directory = Path(directory)
+        self.max_pending = max_pending
+        self.dropped: List[int] = []
+
+    def reset(self) -> None:
+        """Remove snapshots and the stop marker left over from an earlier run."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for path in self.directory.glob("snapshot_*"):
+            path.unlink()
+        (self.directory / self.DONE).unlink(missing_ok=True)
+
+    def pending(self) -> List[Path]:
+        return sorted(self.directory.glob("snapshot_*.pt"))
+
+    def publish(self, net: torch.nn.Module, step: int) -> None:
+        state = {"step": step, "online": {k: v.detach().cpu() for k, v in net.state_dict().items()}}
+        name = f"snapshot_{step:012d}.pt"
+        tmp = self.directory / (name + ".tmp")
+        torch.save(state, tmp)
+        os.replace(tmp, self.directory / name)
+        pending = self.pending()
+        for stale in pending[: len(pending) - self.max_pending]:
+            try:
+                stale.unlink()
+            except FileNotFoundError:  # claimed meanwhile
+                continue
+            self.dropped.append(int(stale.stem.split("_")[1]))
+            print(f"Eval of step {self.dropped[-1]} dropped: the evaluator is behind.")
+
+    def claim(self) -> Optional[Path]:
+        """Oldest pending snapshot, renamed to .claimed for the caller to delete; None if empty."""
+        for path in self.pending():
+            claimed = path.with_suffix(".claimed")
+            try:
+                os.replace(path, claimed)
+            except FileNotFoundError:  # dropped meanwhile
+                continue
+            return claimed
+        return None
+
+    def close(self) -> None:
+        (self.directory / self.DONE).touch()
+
+    @property
+    def closed(self) -> bool:
+        return (self.directory / self.DONE).exists()
+
+
+def run_evaluator(opt, directory, cores: Optional[List[int]] = None, poll: float = 0.5) -> None:
+    """
+    Evaluator loop: greedy-evaluate every snapshot in `directory`, oldest first, with
+    eval/eval_batched as training would in-process (same eval_stats.pkl records), until
+    the queue is closed and empty. `cores` pins this process (and its torch threads).
+    """
+    if cores:
+        os.sched_setaffinity(0, cores)
+        torch.set_num_threads(len(cores))
+    queue = SnapshotQueue(directory)
+    env, evaluate = make_eval_env(opt)
+    agent = QRDuelingDQN(opt.history_length, opt.num_actions, opt.quantiles).to(opt.device)
+    try:
+        while True:
+            path = queue.claim()
+            if path is None:
+                if queue.closed and not queue.pending():
+                    break
+                time.sleep(poll)
+                continue
+            state = torch.load(path, map_location=opt.device)
+            agent.load_state_dict(state["online"])
+            evaluate(agent, env, state["step"], opt)
+            path.unlink()
+    finally:
+        if opt.eval_envs > 0:
+            env.close()
+        log_sink.close_all()  # eval_stats.pkl is complete once the process is gone
+
+
+class EvalProcess:
+    """
+    run_evaluator in a spawned process, fed through a SnapshotQueue in `directory`.
+    An instance is a drop-in for eval/eval_batched in the training loop: calling it only
+    publishes a snapshot of `agent` for that step and returns.
+    """
+
+    def __init__(self, opt, directory, max_pending: int = 1, cores: Optional[List[int]] = None):
+        self.queue = SnapshotQueue(directory, max_pending)
+        self.queue.reset()
+        # spawn: no forked copy of the trainer's threads, CUDA context or replay
+        self.process = mp.get_context("spawn").Process(target=run_evaluator, args=(opt, directory, cores), daemon=True)
+        self.process.start()
+
+    def __call__(self, agent: torch.nn.Module, env, crt_step: int, opt) -> None:
+        if not self.process.is_alive():
+            raise RuntimeError(f"evaluator process died (exit code {self.process.exitcode})")
+        self.queue.publish(agent, crt_step)
+
+    def close(self) -> None:
+        """Wait for the evaluator to work off the pending snapshots."""
+        self.queue.close()
+        self.process.join()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import copy
+from typing import Optional, Union
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from src.agent.dqn_model import QRDuelingDQN
+
+
+class ExpectedValueNet(nn.Module):
+    """
+    QRDuelingDQN for acting only: the value and advantage quantile heads collapsed into
+    one Linear(512, A) that outputs E[Z] = Q directly. The mean over quantiles and the
+    dueling combination are linear, so
+        Q_a = mean_n V_n + mean_n A_an - mean_a' mean_n A_a'n
+    is exact up to float rounding, and greedy actions match the full network's.
+    forward: x [B, C, 84, 84] uint8 or float -> Q [B, A]
+    """
+
+    def __init__(self, conv: nn.Module, fc: nn.Module, num_actions: int):
+        super().__init__()
+        self.num_actions = num_actions
+        self.conv, self.fc = conv, fc
+        # no init: refresh() writes the weights, and the global RNG stays untouched
+        self.q_head = nn.Linear(512, num_actions, device="meta").to_empty(device=next(fc.parameters()).device)
+
+    @classmethod
+    def from_model(cls, net: QRDuelingDQN) -> "ExpectedValueNet":
+        return cls(copy.deepcopy(net.conv), copy.deepcopy(net.fc), net.num_actions).refresh(net)
+
+    @torch.no_grad()
+    def refresh(self, net: QRDuelingDQN) -> "ExpectedValueNet":
+        """Copy the torso of `net` in place and recompute the collapsed head."""
+        for dst, src in zip(self.conv.parameters(), net.conv.parameters()):
+            dst.copy_(src)
+        for dst, src in zip(self.fc.parameters(), net.fc.parameters()):
+            dst.copy_(src)
+        A, N = net.num_actions, net.num_quantiles
+        w_adv = net.adv_head.weight.view(A, N, -1).mean(dim=1)  # [A, 512]
+        b_adv = net.adv_head.bias.view(A, N).mean(dim=1)  # [A]
+        self.q_head.weight.copy_(w_adv - w_adv.mean(dim=0) + net.value_head.weight.mean(dim=0))
+        self.q_head.bias.copy_(b_adv - b_adv.mean() + net.value_head.bias.mean())
+        return self
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        dtype = self.conv[0].weight.dtype  # float32, or bfloat16 / float16 for a reduced-precision copy
+        if x.dtype == torch.uint8:
+            x = x.to(dtype).div_(255)
+        return self.q_head(self.fc(self.conv(x.to(dtype))))
+
+
+class InferenceEngine:
+    """
+    Greedy actions from an ExpectedValueNet copy of a QRDuelingDQN, for acting.
+
+    backend: "eager" runs the module as is, "trace" a torch.jit.trace'd graph, "compile"
+    torch.compile (dynamic=False; batch sizes up to max_batch are padded to a few buckets so
+    it compiles once per bucket). quantize=True replaces the Linear layers with int8 dynamic
+    quantized ones (CPU only); they hold a packed copy of the weights, so refresh() rebuilds
+    them (and re-traces), while without quantization refresh() is an in-place copy that
+    every backend sees. `dtype` (e.g. torch.bfloat16) keeps the copy's weights in that
+    precision, so unlike autocast no weight is cast per call; refresh() converts them.
+    Observations are copied into a preallocated uint8 buffer (pinned on CUDA); only the
+    action indices come back to the host.
+    """
+
+    BUCKETS = (1, 4, 16, 64)
+
+    def __init__(
+        self,
+        net: QRDuelingDQN,
+        device: torch.device,
+        backend: str = "eager",
+        quantize: bool = False,
+        max_batch: int = 16,
+        dtype: Optional[torch.dtype] = None,
+    ):
+        assert backend in ("eager", "trace", "compile")
+        if quantize and dtype is not None:
+            raise ValueError("int8 dynamic quantization needs float32 weights")
+        if quantize and device.type != "cpu":
+            raise ValueError("int8 dynamic quantization is CPU only")
+        if quantize and backend == "compile":
+            raise ValueError("quantize=True rebuilds the module on refresh(), which would recompile it every time")
+        self.device = device
+        self.backend = backend
+        self.quantize = quantize
+        self.max_batch = max_batch
+        self.ev = ExpectedValueNet.from_model(net).to(device, dtype).eval()
+        self.obs_shape = (net.conv[0].in_channels, 84, 84)
+        host = torch.zeros((max_batch,) + self.obs_shape, dtype=torch.uint8)
+        self._host = host.pin_memory() if device.type == "cuda" else host
+        self._input = self._host if device.type == "cpu" else self._host.to(device)
+        self._build()
+
+    def _build(self) -> None:
+        module = self.ev
+        if self.quantize:
+            module = torch.ao.quantization.quantize_dynamic(copy.deepcopy(self.ev), {nn.Linear}, dtype=torch.qint8)
+        if self.backend == "trace":
+            with torch.inference_mode():
+                module = torch.jit.trace(module, self._input[:1], check_trace=False)
+        elif self.backend == "compile":
+            module = torch.compile(module, dynamic=False)
+        self._forward = module
+
+    def refresh(self, net: QRDuelingDQN) -> None:
+        """Follow new `net` weights."""
+        self.ev.refresh(net)
+        if self.quantize:
+            self._build()
+
+    def _bucket(self, B: int) -> int:
+        if self.backend != "compile":
+            return B
+        return next((b for b in self.BUCKETS if b >= B), B)
+
+    @torch.inference_mode()
+    def q_values(self, obs: Union[torch.Tensor, np.ndarray]) -> torch.Tensor:
+        """obs [B, C, 84, 84] (or one [C, 84, 84]) -> Q [B, A] on the device."""
+        if isinstance(obs, np.ndarray):
+            obs = torch.from_numpy(obs)
+        if obs.dim() == 3:
+            obs = obs.unsqueeze(0)
+        B = obs.shape[0]
+        if B > self.max_batch or obs.dtype != torch.uint8:
+            return self._forward(obs.to(self.device))
+        self._host[:B].copy_(obs)
+        if self._input is not self._host:
+            self._input[:B].copy_(self._host[:B], non_blocking=True)
+        return self._forward(self._input[: self._bucket(B)])[:B]
+
+    def act(self, obs: Union[torch.Tensor, np.ndarray]) -> np.ndarray:
+        """Greedy actions [B]."""
+        return self.q_values(obs).argmax(dim=1).cpu().numpy()
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
-from typing import Tuple
+from contextlib import nullcontext
+from typing import Callable, Optional, Tuple
 
+import numpy as np
 import torch
 import torch.nn.functional as F
 
@@ -35,3 +37,145 @@ def quantile_huber_loss(
 
     loss_per_item = (quantile_weight * huber).sum(dim=1, keepdim=True) / N  # [B,1]
     return loss_per_item, u.abs()
+
+
+def compute_targets(
+    rewards: torch.Tensor,
+    dones: torch.Tensor,
+    gamma: float,
+    next_dist: torch.Tensor,
+) -> torch.Tensor:
+    """
+    n-step bootstrapped targets for QR-DQN.
+    rewards: [B]
+    dones:   [B] (1 if terminal at n-step boundary)
+    next_dist: [B, Ntau] distribution (already gathered w.r.t. argmax_a Q_online)
+    returns target_z: [B, Ntau]
+    """
+    # When done, we should not bootstrap
+    not_done = (1.0 - dones.float()).unsqueeze(1)  # [B,1]
+    target = rewards.unsqueeze(1) + gamma * not_done * next_dist
+    return target
+
+
+def fused_qr_dqn_loss(
+    online: torch.nn.Module,
+    target: torch.nn.Module,
+    obs: torch.Tensor,
+    actions: torch.Tensor,
+    rewards: torch.Tensor,
+    next_obs: torch.Tensor,
+    dones: torch.Tensor,
+    weights: torch.Tensor,
+    gamma: float,
+    kappa: float,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Double-DQN QR loss with a single online forward over cat([obs, next_obs]).
+    Pure tensor code with no host syncs, so it can be wrapped in torch.compile.
+    Returns the IS-weighted loss and the per-sample mean |TD error| [B] (PER priorities),
+    both still on the device.
+    """
+    B = obs.size(0)
+    dist_all = online(torch.cat([obs, next_obs]))  # [2B, A, N]
+    N = dist_all.size(2)
+    dist = dist_all[:B].gather(1, actions.long().view(B, 1, 1).expand(B, 1, N)).squeeze(1)  # [B, N]
+
+    with torch.no_grad():
+        next_actions = dist_all[B:].detach().mean(dim=2).argmax(dim=1)  # [B]
+        next_dist = target(next_obs).gather(1, next_actions.view(B, 1, 1).expand(B, 1, N)).squeeze(1)
+        target_dist = compute_targets(rewards, dones, gamma, next_dist)
+
+    loss_per_item, td_abs = quantile_huber_loss(dist, target_dist, kappa=kappa)
+    loss = (loss_per_item.squeeze(1) * weights).mean()
+    return loss, td_abs.detach().mean(dim=1)
+
+
+class MixedPrecision:
+    """
+    Opt-in bfloat16 autocast for the network forwards (CPU or CUDA); dtype None is plain
+    float32 and autocast() a no-op. QRDuelingDQN returns its quantiles in float32
+    either way, so the TD targets, the quantile Huber loss and the PER priorities are
+    always computed in float32. bfloat16 has float32's exponent range, so unlike float16
+    it needs no loss scaling.
+    """
+
+    DTYPES = {"fp32": None, "bf16": torch.bfloat16}
+
+    def __init__(self, device="cpu", dtype: Optional[torch.dtype] = None):
+        if dtype not in self.DTYPES.values():
+            raise ValueError(f"unsupported autocast dtype {dtype}, use one of {list(self.DTYPES)}")
+        self.device_type = torch.device(device).type
+        self.dtype = dtype
+
+    @classmethod
+    def from_name(cls, name: str, device) -> "MixedPrecision":
+        return cls(device, cls.DTYPES[name])
+
+    def autocast(self):
+        if self.dtype is None:
+            return nullcontext()
+        return torch.autocast(self.device_type, dtype=self.dtype)
+
+
+class PriorityTransfer:
+    """
+    Moves per-sample priorities [B] from the device to the replay without stalling the
+    learner. On CUDA each batch is copied into a pinned host buffer behind an event and
+    handed to `apply` one step later, when the copy has long finished; on CPU `apply`
+    runs right away. Call flush() before the replay is read for anything else.
+    With `on_device` the replay keeps its priorities on the device too (TorchPrioritizedReplayBuffer)
+    and `apply` gets the device tensor right away.
+    """
+
+    def __init__(self, apply: Callable[[np.ndarray, np.ndarray], None], device, on_device: bool = False):
+        self.apply = apply
+        self.cuda = torch.device(device).type == "cuda"
+        self.on_device = on_device
+        self._buffers = []
+        self._next = 0
+        self._pending: Optional[Tuple[np.ndarray, torch.Tensor, "torch.cuda.Event"]] = None
+
+    def push(self, indices: np.ndarray, priorities: torch.Tensor) -> None:
+        if self.on_device:
+            self.apply(indices, priorities)
+            return
+        if not self.cuda:
+            self.apply(indices, priorities.numpy())
+            return
+        if not self._buffers:
+            self._buffers = [torch.empty(priorities.shape, pin_memory=True) for _ in range(2)]
+        self.flush()
+        host = self._buffers[self._next]
+        self._next ^= 1
+        host.copy_(priorities, non_blocking=True)
+        event = torch.cuda.Event()
+        event.record()
+        self._pending = (indices, host, event)
+
+    def flush(self) -> None:
+        if self._pending is None:
+            return
+        indices, host, event = self._pending
+        self._pending = None
+        event.synchronize()
+        self.apply(indices, host.numpy())
+
+
+class LossMeter:
+    """Running mean of the training loss, summed on the device and synced only in pop()."""
+
+    def __init__(self, device):
+        self.total = torch.zeros((), device=device)
+        self.count = 0
+
+    def add(self, loss) -> None:
+        self.total += loss
+        self.count += 1
+
+    def pop(self) -> Tuple[float, int]:
+        """(mean loss, number of updates) since the last pop."""
+        mean, count = self.total.item() / max(self.count, 1), self.count
+        self.total.zero_()
+        self.count = 0
+        return mean, count
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import warnings
+import zlib
+from typing import Callable, Dict
+
+import numpy as np
+
+try:
+    import lz4.block as _lz4
+except ImportError:  # optional, zlib stands in
+    _lz4 = None
+
+
+class ObsCodec:
+    """
+    Lossless bytes encoding of one uint8 observation stack [C, 84, 84]. decode_into()
+    writes the stack back into a preallocated array of that shape. Implementations must
+    be thread-safe; the compressed replay calls them from a thread pool.
+    """
+
+    name = "raw"
+
+    def encode(self, stack: np.ndarray) -> bytes:
+        return np.ascontiguousarray(stack).tobytes()
+
+    def decode_into(self, blob: bytes, out: np.ndarray) -> None:
+        out.reshape(-1)[:] = np.frombuffer(blob, dtype=np.uint8)
+
+
+class ZlibCodec(ObsCodec):
+    """
+    zlib over the whole stack. Its 32 KB window spans the four 7 KB frames, so frames
+    repeated within the stack cost a few bytes on top of the flat tiles.
+    """
+
+    name = "zlib"
+
+    def __init__(self, level: int = 1):
+        self.level = level
+
+    def encode(self, stack: np.ndarray) -> bytes:
+        return zlib.compress(np.ascontiguousarray(stack), self.level)
+
+    def decode_into(self, blob: bytes, out: np.ndarray) -> None:
+        out.reshape(-1)[:] = np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+
+
+class LZ4Codec(ObsCodec):
+    """LZ4 block compression of the whole stack: larger than zlib, several times faster to decode."""
+
+    name = "lz4"
+
+    def encode(self, stack: np.ndarray) -> bytes:
+        return _lz4.compress(np.ascontiguousarray(stack), store_size=True)
+
+    def decode_into(self, blob: bytes, out: np.ndarray) -> None:
+        out.reshape(-1)[:] = np.frombuffer(_lz4.decompress(blob), dtype=np.uint8)
+
+
+class DeltaCodec(ObsCodec):
+    """
+    Keeps the first frame of the stack and every later one as its difference to the
+    previous frame (mod 256), then compresses with `inner`: frames where only the
+    status bar or a few tiles changed become mostly zeros.
+    """
+
+    def __init__(self, inner: ObsCodec):
+        self.inner = inner
+        self.name = f"delta+{inner.name}"
+
+    def encode(self, stack: np.ndarray) -> bytes:
+        delta = stack.copy()
+        np.subtract(stack[1:], stack[:-1], out=delta[1:])  # uint8, wraps around
+        return self.inner.encode(delta)
+
+    def decode_into(self, blob: bytes, out: np.ndarray) -> None:
+        self.inner.decode_into(blob, out)
+        for k in range(1, len(out)):
+            np.add(out[k], out[k - 1], out=out[k])
+
+
+CODECS: Dict[str, Callable[[], ObsCodec]] = {
+    "zlib": ZlibCodec,
+    "lz4": LZ4Codec,
+    "delta+zlib": lambda: DeltaCodec(ZlibCodec()),
+    "delta+lz4": lambda: DeltaCodec(LZ4Codec()),
+}
+
+
+def make_codec(name: str) -> ObsCodec:
+    """The codec `name` (see CODECS); the lz4 ones fall back to zlib if the lz4 package is missing."""
+    if "lz4" in name and _lz4 is None:
+        warnings.warn(f"lz4 is not installed, replay codec {name} uses zlib instead (pip install lz4)")
+        name = name.replace("lz4", "zlib")
+    return CODECS[name]()
@@ -1,27 +1,65 @@
 # -*- coding: utf-8 -*-
-from typing import Optional
+from typing import Optional, Tuple, Union
 
+import numpy as np
 import torch
 
+from src.agent.inference import InferenceEngine
+from src.agent.learner import MixedPrecision
 from src.utils.schedule import Schedule
 
 
 class GreedyPolicy:
-    def __init__(self, net: torch.nn.Module, num_actions: int, num_quantiles: int, device: torch.device):
+    """
+    Greedy actions of `net`. With an `engine` (src/agent/inference.py) the actions come
+    from its expected-value copy of the network instead; whoever updates `net` then has
+    to call engine.refresh(net). `precision` autocasts the forwards of `net`.
+    """
+
+    def __init__(
+        self,
+        net: torch.nn.Module,
+        num_actions: int,
+        num_quantiles: int,
+        device: torch.device,
+        engine: Optional[InferenceEngine] = None,
+        precision: Optional[MixedPrecision] = None,
+    ):
         self.net = net
         self.num_actions = num_actions
         self.num_quantiles = num_quantiles
         self.device = device
+        self.engine = engine
+        self.precision = precision or MixedPrecision()
+
+    def _to_input(self, obs: Union[torch.Tensor, np.ndarray]) -> torch.Tensor:
+        # uint8 stacks go to the device as they are, the network scales them
+        if isinstance(obs, np.ndarray):
+            obs = torch.from_numpy(obs)
+        return obs.to(self.device)
 
     @torch.no_grad()
-    def act(self, obs: torch.Tensor) -> int:
+    def act(self, obs: Union[torch.Tensor, np.ndarray]) -> int:
+        if self.engine is not None:
+            return int(self.engine.act(obs)[0])
+        obs = self._to_input(obs)
         if obs.dim() == 3:
             obs = obs.unsqueeze(0)
-        z = self.net(obs.to(self.device))  # [1, A, N]
+        with self.precision.autocast():
+            z = self.net(obs)  # [1, A, N]
         q = z.mean(dim=2)  # expectation over quantiles -> [1,A]
         action = int(q.argmax(dim=1).item())
         return action
 
+    @torch.no_grad()
+    def act_batch(self, obs: Union[torch.Tensor, np.ndarray]) -> np.ndarray:
+        """obs: [B, C, 84, 84] -> actions [B]"""
+        if self.engine is not None:
+            return self.engine.act(obs)
+        with self.precision.autocast():
+            z = self.net(self._to_input(obs))  # [B, A, N]
+        return z.mean(dim=2).argmax(dim=1).cpu().numpy()
+
 
 class EpsGreedyPolicy(GreedyPolicy):
     def __init__(
@@ -31,14 +69,35 @@ class EpsGreedyPolicy(GreedyPolicy):
         num_quantiles: int,
         schedule: Schedule,
         device: torch.device,
+        engine: Optional[InferenceEngine] = None,
+        precision: Optional[MixedPrecision] = None,
     ):
-        super().__init__(net, num_actions, num_quantiles, device)
+        super().__init__(net, num_actions, num_quantiles, device, engine, precision)
         self.schedule = schedule
         self.t = 0
 
-    def act(self, obs: torch.Tensor, force_random: bool = False) -> int:
+    def act(self, obs: Union[torch.Tensor, np.ndarray], force_random: bool = False) -> int:
         eps = self.schedule.value(self.t)
         self.t += 1
         if force_random or torch.rand(()) < eps:
             return int(torch.randint(0, self.num_actions, ()).item())
         return super().act(obs)
+
+    def explore_batch(self, B: int, force_random: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The random half of act_batch: (random actions [B], explore mask [B]); the greedy
+        action is used where the mask is False. The schedule advances by B.
+        """
+        eps = self.schedule.value(self.t)
+        self.t += B
+        actions = torch.randint(0, self.num_actions, (B,)).numpy()
+        if force_random:
+            return actions, np.ones(B, dtype=bool)
+        return actions, (torch.rand(B) < eps).numpy()
+
+    def act_batch(self, obs: Union[torch.Tensor, np.ndarray], force_random: bool = False) -> np.ndarray:
+        """One epsilon draw per env; the schedule advances by the batch size."""
+        actions, explore = self.explore_batch(obs.shape[0], force_random)
+        if not explore.all():
+            actions = np.where(explore, actions, super().act_batch(obs))
+        return actions
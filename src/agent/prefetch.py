@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+import torch
+
+from src.agent.replay_buffer import PrioritizedReplayBuffer
+
+
+class _Slot:
+    """One preallocated batch: host tensors (pinned on CUDA) plus numpy views of them."""
+
+    def __init__(self, replay: PrioritizedReplayBuffer, batch_size: int, pin: bool):
+        obs_dtype = torch.from_numpy(np.zeros(0, dtype=replay.obs_dtype)).dtype
+        shape = (batch_size,) + replay.obs_shape
+        self.host = {
+            "obs": torch.empty(shape, dtype=obs_dtype, pin_memory=pin),
+            "next_obs": torch.empty(shape, dtype=obs_dtype, pin_memory=pin),
+            "actions": torch.empty((batch_size,), dtype=torch.int64, pin_memory=pin),
+            "rewards": torch.empty((batch_size,), dtype=torch.float32, pin_memory=pin),
+            "dones": torch.empty((batch_size,), dtype=torch.float32, pin_memory=pin),
+            "weights": torch.empty((batch_size,), dtype=torch.float32, pin_memory=pin),
+        }
+        self.out = {k: v.numpy() for k, v in self.host.items()}
+        self.indices: Optional[np.ndarray] = None
+        self.copied: Optional[torch.cuda.Event] = None  # host -> device copy still reading the slot
+
+
+class PrefetchSampler:
+    """
+    Samples the next `depth` batches on a background thread into reused, preallocated host
+    buffers (pinned when the replay's device is CUDA) and hands them out with
+    non-blocking device copies, so the learner never waits on indexing or transfers.
+
+    Staleness: a batch is drawn up to `depth` learner steps before it is used, so its
+    indices and IS weights ignore at most the last `depth` priority updates, and a slot it
+    points to may have been overwritten by then (the update then lands on the new
+    transition, as it would with a plain sample() racing an add()). All replay access must
+    go through `lock`: the sampler takes it while drawing a batch, `update_priorities`
+    takes it, and writers (collect_step, actor threads) must take it too.
+    On CPU the returned tensors alias the slot buffers and stay valid until the next sample().
+    """
+
+    def __init__(
+        self,
+        replay: PrioritizedReplayBuffer,
+        batch_size: int,
+        depth: int = 2,
+        lock: Optional[threading.Lock] = None,
+    ):
+        assert depth >= 1
+        self.replay = replay
+        self.batch_size = batch_size
+        self.device = replay.device
+        self.lock = lock if lock is not None else threading.Lock()
+        self.cuda = torch.device(self.device).type == "cuda"
+        self._free: "queue.Queue[_Slot]" = queue.Queue()
+        self._ready: "queue.Queue[_Slot]" = queue.Queue()
+        for _ in range(depth + 1):  # depth in flight + the one the learner holds
+            self._free.put(_Slot(replay, batch_size, pin=self.cuda))
+        self._in_use: Optional[_Slot] = None
+        self._closed = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            while not self._closed.is_set():
+                try:
+                    slot = self._free.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if slot.copied is not None:
+                    slot.copied.synchronize()
+                if self.replay.size == 0:  # started before the warmup filled anything
+                    self._free.put(slot)
+                    self._closed.wait(0.01)
+                    continue
+                with self.lock:
+                    indices, weights = self.replay.sample_indices(self.batch_size)
+                    self.replay.gather(indices, slot.out)
+                slot.out["weights"][:] = weights
+                slot.indices = indices
+                self._ready.put(slot)
+        except BaseException as e:  # re-raised in sample()
+            self._error = e
+
+    def sample(self, batch_size: Optional[int] = None) -> Dict[str, torch.Tensor]:
+        """Next batch, same keys as PrioritizedReplayBuffer.sample; obs stay uint8."""
+        assert batch_size in (None, self.batch_size), "batch size is fixed at construction"
+        if self._in_use is not None:
+            self._free.put(self._in_use)
+        while True:
+            if self._error is not None:
+                raise self._error
+            try:
+                slot = self._ready.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        self._in_use = slot
+        batch = {k: v.to(self.device, non_blocking=True) for k, v in slot.host.items()}
+        if self.cuda:
+            slot.copied = torch.cuda.Event()
+            slot.copied.record()
+        batch["indices"] = slot.indices
+        return batch
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray) -> None:
+        with self.lock:
+            self.replay.update_priorities(indices, td_errors)
+
+    def close(self) -> None:
+        self._closed.set()
+        self._thread.join()
@@ -1,12 +1,20 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import json
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from pathlib import Path
 from typing import Dict, Optional, Tuple
 
 import numpy as np
 import torch
 
+from src.agent.obs_codec import ObsCodec
+from src.agent.segment_tree import MaxSegmentTree, SumSegmentTree, TorchMaxSegmentTree, TorchSumSegmentTree
+
 
 @dataclass
 class Transition:
@@ -29,12 +37,18 @@ class NStepAdder:
         self.buf = deque(maxlen=n)
         self.obs0 = None
 
+    @staticmethod
+    def _to_numpy(x) -> np.ndarray:
+        if isinstance(x, torch.Tensor):
+            return x.detach().cpu().numpy()
+        return np.asarray(x)
+
     def reset(self, first_obs: torch.Tensor):
         self.buf.clear()
-        self.obs0 = first_obs.detach().cpu().numpy()
+        self.obs0 = self._to_numpy(first_obs)
 
     def add(self, action: int, reward: float, next_obs: torch.Tensor, done: bool):
-        self.buf.append((action, reward, next_obs.detach().cpu().numpy(), done))
+        self.buf.append((action, reward, self._to_numpy(next_obs), done))
         if len(self.buf) == self.n:
             Rn = 0.0
             done_n = False
@@ -55,12 +69,78 @@ class NStepAdder:
         return None
 
 
+class VecNStepAdder:
+    """
+    NStepAdder for N parallel streams on preallocated arrays. Each stream keeps a ring of
+    its last n+1 stacks and n (action, reward) pairs; every add() emits the ready
+    transitions of all streams as one batch, with returns from a precomputed discount
+    vector. Same semantics as NStepAdder per stream: a transition is emitted once n steps
+    followed it, and the partial window of a finished episode is dropped on reset.
+    """
+
+    def __init__(self, num_envs: int, n: int, gamma: float, obs_shape: Tuple[int, ...], obs_dtype=np.uint8):
+        self.num_envs = num_envs
+        self.n = n
+        self.gamma = gamma
+        self.discounts = gamma ** np.arange(n, dtype=np.float64)  # [n]
+        self.obs = np.zeros((num_envs, n + 1) + tuple(obs_shape), dtype=obs_dtype)
+        self.actions = np.zeros((num_envs, n), dtype=np.int64)
+        self.rewards = np.zeros((num_envs, n), dtype=np.float64)
+        self.count = np.zeros(num_envs, dtype=np.int64)  # steps since the stream's reset
+        self._rows = np.arange(num_envs)
+
+    def reset(self, first_obs: np.ndarray, mask: Optional[np.ndarray] = None) -> None:
+        """Start new episodes from first_obs [N, ...] on every stream, or only where `mask`."""
+        rows = self._rows if mask is None else np.flatnonzero(mask)
+        self.count[rows] = 0
+        self.obs[rows, 0] = first_obs[rows]
+
+    def add(
+        self, actions: np.ndarray, rewards: np.ndarray, next_obs: np.ndarray, dones: np.ndarray
+    ) -> Optional[Tuple[np.ndarray, ...]]:
+        """
+        One step of every stream (next_obs [N, ...] is the last stack of finished episodes).
+        Returns (streams, obs0, actions0, Rn, obs_n, done_n) for the ready transitions, or None.
+        Finished streams must be reset() before their next add.
+        """
+        n, rows, c = self.n, self._rows, self.count
+        self.actions[rows, c % n] = actions
+        self.rewards[rows, c % n] = rewards
+        self.obs[rows, (c + 1) % (n + 1)] = next_obs
+        c += 1
+        ready = np.flatnonzero(c >= n)
+        if ready.size == 0:
+            return None
+        t0 = c[ready] - n
+        window = (t0[:, None] + np.arange(n)) % n  # rewards of steps t0 .. t0+n-1, oldest first
+        returns = (self.rewards[ready[:, None], window] * self.discounts).sum(axis=1)
+        return (
+            ready,
+            self.obs[ready, t0 % (n + 1)],
+            self.actions[ready, t0 % n],
+            returns,
+            self.obs[ready, c[ready] % (n + 1)],
+            np.asarray(dones, dtype=np.float64)[ready],  # a terminal can only be the newest step
+        )
+
+
 class PrioritizedReplayBuffer:
     """
-    Simple PER buffer with proportional priorities (sum-tree via arrays).
-    Observations stored as uint8 to save RAM; converted to float in [0,1] on sample.
+    PER buffer with proportional priorities.
+    A sum-tree over p^alpha drives stratified sampling in O(log N) and a max-tree over raw
+    priorities gives the insert priority in O(1). `priorities` keeps the raw values.
+    Observations stored as uint8 to save RAM and sampled as uint8 tensors; the network
+    scales them to [0,1] on the device.
+
+    With `storage_dir` every array is an np.memmap'ed .npy file in that directory, so the
+    capacity is bounded by disk rather than RAM and sampling reads through the page cache.
+    flush() writes the arrays back and records pos/full/frame in header.json; constructing
+    the buffer again on the same directory reopens it at that point and rebuilds the trees
+    from the stored priorities. Anything added after the last flush() may be lost.
     """
 
+    HEADER = "header.json"
+
     def __init__(
         self,
         capacity: int,
@@ -70,6 +150,7 @@ class PrioritizedReplayBuffer:
         beta_frames: int,
         device: torch.device,
         store_uint8: bool = True,
+        storage_dir: Optional[str] = None,
     ):
         self.capacity = int(capacity)
         self.alpha = alpha
@@ -80,19 +161,26 @@ class PrioritizedReplayBuffer:
 
         self.pos = 0
         self.full = False
+        self.frame = 1  # for beta anneal
+        self.added = 0  # slots written so far, tells snapshots which slots changed
 
-        obs_dtype = np.uint8 if store_uint8 else np.float32
-        self.obs = np.zeros((self.capacity,) + obs_shape, dtype=obs_dtype)
-        self.next_obs = np.zeros((self.capacity,) + obs_shape, dtype=obs_dtype)
-        self.actions = np.zeros((self.capacity,), dtype=np.int64)
-        self.rewards = np.zeros((self.capacity,), dtype=np.float32)
-        self.dones = np.zeros((self.capacity,), dtype=np.float32)
+        self.obs_shape = tuple(obs_shape)
+        self.obs_dtype = np.uint8 if store_uint8 else np.float32
+        self.storage_dir = Path(storage_dir) if storage_dir is not None else None
+        header = self._open_storage()
+        self._alloc_obs_storage(self.obs_shape, self.obs_dtype)
+        self.actions = self._alloc("actions", (self.capacity,), np.int64)
+        self.rewards = self._alloc("rewards", (self.capacity,), np.float32)
+        self.dones = self._alloc("dones", (self.capacity,), np.float32)
 
         # priorities
-        self.priorities = np.zeros((self.capacity,), dtype=np.float32)
+        self.priorities = self._alloc("priorities", (self.capacity,), np.float32)
+        self.sum_tree = SumSegmentTree(self.capacity)  # p^alpha, sampling mass
+        self.max_tree = MaxSegmentTree(self.capacity)  # raw p, insert priority
         self.eps = 1e-6  # small constant
 
-        self.frame = 1  # for beta anneal
+        if header is not None:
+            self._restore(header)
 
     @property
     def size(self) -> int:
@@ -101,7 +189,109 @@ class PrioritizedReplayBuffer:
     def beta_by_frame(self) -> float:
         return min(1.0, self.beta_start + (1.0 - self.beta_start) * (self.frame / self.beta_frames))
 
+    def _layout(self) -> dict:
+        return {
+            "type": type(self).__name__,
+            "capacity": self.capacity,
+            "obs_shape": list(self.obs_shape),
+            "obs_dtype": np.dtype(self.obs_dtype).name,
+        }
+
+    def _open_storage(self) -> Optional[dict]:
+        """Create `storage_dir`, or read the header of the buffer already in it."""
+        self._reopen = False
+        if self.storage_dir is None:
+            return None
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        path = self.storage_dir / self.HEADER
+        if not path.exists():
+            return None
+        header = json.loads(path.read_text())
+        if header["layout"] != self._layout():
+            raise ValueError(f"{self.storage_dir} holds a different replay: {header['layout']}")
+        self._reopen = True
+        return header
+
+    def _alloc(self, name: str, shape: Tuple[int, ...], dtype, fill=0) -> np.ndarray:
+        """A zero (or `fill`) array in RAM, or the memmap `name`.npy under storage_dir."""
+        if self.storage_dir is None:
+            return np.full(shape, fill, dtype=dtype)
+        path = self.storage_dir / f"{name}.npy"
+        if self._reopen:
+            array = np.lib.format.open_memmap(path, mode="r+")
+        else:
+            array = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)  # sparse zeros
+            if fill != 0:
+                array[:] = fill
+        # sampling reads scattered slots; readahead would only evict useful pages. np.memmap
+        # keeps its mmap in a private attribute: skip the hint if a numpy version lacks it
+        mapping = getattr(array, "_mmap", None)
+        if hasattr(mmap, "MADV_RANDOM") and isinstance(mapping, mmap.mmap):
+            mapping.madvise(mmap.MADV_RANDOM)
+        return array
+
+    def _restore(self, header: dict) -> None:
+        self.pos, self.full, self.frame = header["pos"], header["full"], header["frame"]
+        self.added = header.get("added", self.capacity if self.full else self.pos)
+        if not self.full:
+            self.priorities[self.pos :] = 0.0  # written after the last flush, not part of the buffer
+        self.sum_tree.rebuild(np.power(self.priorities, self.alpha))
+        self.max_tree.rebuild(self.priorities)
+
+    def flush(self) -> None:
+        """Persist a memmap'ed buffer: arrays first, then the header that makes them valid."""
+        if self.storage_dir is None:
+            return
+        for array in vars(self).values():
+            if isinstance(array, np.memmap):
+                array.flush()
+        header = dict(self._counters(), layout=self._layout())
+        tmp = self.storage_dir / (self.HEADER + ".tmp")
+        tmp.write_text(json.dumps(header))
+        os.replace(tmp, self.storage_dir / self.HEADER)
+
+    # arrays indexed by slot and only written when their slot is, vs. arrays also
+    # changed elsewhere (priority updates, evictions); see state_dict()
+    SLOT_ARRAYS = ("obs", "next_obs", "actions", "rewards", "dones")
+    STATE_ARRAYS = ("priorities",)
+
+    def _counters(self) -> dict:
+        return {"pos": self.pos, "full": self.full, "frame": self.frame, "added": self.added}
+
+    def slots_since(self, added: int) -> np.ndarray:
+        """Slots written after the buffer had written `added` slots, oldest first."""
+        count = min(self.added - added, self.capacity)
+        return (self.pos - count + np.arange(count)) % self.capacity
+
+    def state_dict(self) -> dict:
+        """
+        Counters plus copies of STATE_ARRAYS. Together with the SLOT_ARRAYS rows written
+        since an earlier snapshot (slots_since) this restores the buffer exactly.
+        """
+        return dict(self._counters(), arrays={name: getattr(self, name).copy() for name in self.STATE_ARRAYS})
+
+    def load_state_dict(self, state: dict) -> None:
+        """Counterpart of state_dict(); SLOT_ARRAYS must already hold the snapshot's rows."""
+        for name, array in state["arrays"].items():
+            getattr(self, name)[:] = array
+        self._restore(state)
+
+    def _alloc_obs_storage(self, obs_shape: Tuple[int, ...], obs_dtype: type) -> None:
+        self.obs = self._alloc("obs", (self.capacity,) + obs_shape, obs_dtype)
+        self.next_obs = self._alloc("next_obs", (self.capacity,) + obs_shape, obs_dtype)
+
+    def _gather_obs(self, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return self.obs[indices], self.next_obs[indices]
+
+    def _gather_obs_into(self, indices: np.ndarray, obs: np.ndarray, next_obs: np.ndarray) -> None:
+        # mode="clip" lets numpy write straight into `out` instead of buffering
+        np.take(self.obs, indices, axis=0, out=obs, mode="clip")
+        np.take(self.next_obs, indices, axis=0, out=next_obs, mode="clip")
+
     def _encode_obs(self, x: np.ndarray) -> np.ndarray:
+        if x.dtype == np.uint8:
+            # already quantized by the env
+            return x if self.store_uint8 else x.astype(np.float32) / 255.0
         if not self.store_uint8:
             return x.astype(np.float32, copy=False)
         # expect float [0,1] -> uint8
@@ -110,9 +300,10 @@ class PrioritizedReplayBuffer:
     def _decode_obs(self, x: np.ndarray) -> torch.Tensor:
         if not self.store_uint8:
             return torch.from_numpy(x).float().to(self.device)
-        return torch.from_numpy(x.astype(np.float32) / 255.0).to(self.device)
+        return torch.from_numpy(x).to(self.device)
 
-    def add(self, obs: np.ndarray, action: int, reward: float, next_obs: np.ndarray, done: float):
+    def add(self, obs: np.ndarray, action: int, reward: float, next_obs: np.ndarray, done: float, stream: int = 0):
+        # `stream` only matters for layouts that share frames between transitions
         idx = self.pos
         self.obs[idx] = self._encode_obs(obs)
         self.next_obs[idx] = self._encode_obs(next_obs)
@@ -120,39 +311,471 @@ class PrioritizedReplayBuffer:
         self.rewards[idx] = reward
         self.dones[idx] = done
 
-        # max priority for newly added
-        max_prio = self.priorities.max() if self.pos > 0 or self.full else 1.0
-        self.priorities[idx] = max_prio
+        self._set_priorities(idx, self._insert_priority())
 
         self.pos = (self.pos + 1) % self.capacity
+        self.added += 1
         if self.pos == 0:
             self.full = True
 
-    def sample(self, batch_size: int) -> Dict[str, torch.Tensor]:
-        assert self.size > 0, "Replay is empty"
-        prios = self.priorities[: self.size]
-        probs = prios ** self.alpha
-        probs /= probs.sum()
+    def add_batch(
+        self,
+        obs: np.ndarray,
+        actions: np.ndarray,
+        rewards: np.ndarray,
+        next_obs: np.ndarray,
+        dones: np.ndarray,
+        streams: Optional[np.ndarray] = None,
+        priorities: Optional[np.ndarray] = None,
+    ) -> None:
+        """
+        add() for K transitions at once, in order; one vectorized write and tree update.
+        `priorities` (|TD error| per transition, e.g. computed by the actor) replace the
+        max-priority default.
+        """
+        k = len(actions)
+        if k == 0:
+            return
+        assert k <= self.capacity
+        idx = (self.pos + np.arange(k)) % self.capacity
+        self.obs[idx] = self._encode_obs(obs)
+        self.next_obs[idx] = self._encode_obs(next_obs)
+        self.actions[idx] = actions
+        self.rewards[idx] = rewards
+        self.dones[idx] = dones
 
-        indices = np.random.choice(self.size, batch_size, p=probs)
-        beta = self.beta_by_frame()
-        self.frame += 1
+        if priorities is None:
+            self._set_priorities(idx, self._insert_priority())
+        else:
+            self._set_priorities(idx, np.abs(priorities) + self.eps)
 
-        weights = (self.size * probs[indices]) ** (-beta)
-        weights /= weights.max() + 1e-6
+        if self.pos + k >= self.capacity:
+            self.full = True
+        self.pos = (self.pos + k) % self.capacity
+        self.added += k
 
+    def sample(self, batch_size: int) -> Dict[str, torch.Tensor]:
+        indices, weights = self.sample_indices(batch_size)
+        obs, next_obs = self._gather_obs(indices)
         batch = {
-            "obs": self._decode_obs(self.obs[indices]),
+            "obs": self._decode_obs(obs),
             "actions": torch.from_numpy(self.actions[indices]).long().to(self.device),
             "rewards": torch.from_numpy(self.rewards[indices]).float().to(self.device),
-            "next_obs": self._decode_obs(self.next_obs[indices]),
+            "next_obs": self._decode_obs(next_obs),
             "dones": torch.from_numpy(self.dones[indices]).float().to(self.device),
             "weights": torch.from_numpy(weights).float().to(self.device),
             "indices": indices,
         }
         return batch
 
+    def sample_indices(self, batch_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Draw a batch of indices and their normalized IS weights; advances the beta anneal."""
+        assert self.size > 0, "Replay is empty"
+        indices, probs = self._sample_indices(batch_size)
+        beta = self.beta_by_frame()
+        self.frame += 1
+
+        weights = (self.size * probs) ** (-beta)
+        weights /= weights.max() + 1e-6
+        return indices, weights
+
+    def gather(self, indices: np.ndarray, out: Dict[str, np.ndarray]) -> None:
+        """Copy the transitions at `indices` into preallocated arrays keyed like sample()'s batch."""
+        self._gather_obs_into(indices, out["obs"], out["next_obs"])
+        np.take(self.actions, indices, out=out["actions"], mode="clip")
+        np.take(self.rewards, indices, out=out["rewards"], mode="clip")
+        np.take(self.dones, indices, out=out["dones"], mode="clip")
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray):
+        # Use mean per-sample quantile error as TD error magnitude; [B] errors are already reduced
+        td = np.abs(td_errors)
+        if td.ndim == 2:
+            td = td.mean(axis=1)
+        td = td + self.eps
+        self._set_priorities(indices, td)
+
+    def _insert_priority(self) -> float:
+        # max priority for newly added, 1.0 while nothing is sampleable yet
+        max_prio = self.max_tree.max()
+        return max_prio if max_prio > 0.0 else 1.0
+
+    def _set_priorities(self, indices, prios) -> None:
+        # trees built from the stored float32 values, so _restore() can rebuild them exactly
+        prios = np.asarray(prios, dtype=np.float32)
+        self.priorities[indices] = prios
+        self.sum_tree[indices] = np.power(prios, self.alpha)
+        self.max_tree[indices] = prios
+
+    def _sample_indices(self, batch_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Stratified proportional sampling: one draw per equal slice of the total mass."""
+        total = self.sum_tree.sum()
+        segment = total / batch_size
+        mass = (np.arange(batch_size) + np.random.random_sample(batch_size)) * segment
+        mass = np.minimum(mass, np.nextafter(total, 0.0))
+        indices = self.sum_tree.find_prefixsum_idx(mass)
+        indices = np.minimum(indices, self.size - 1)
+        probs = self.sum_tree[indices] / total
+        return indices, probs
+
+
+class FramePrioritizedReplayBuffer(PrioritizedReplayBuffer):
+    """
+    PER buffer that keeps every 84x84 frame once instead of two full stacks per transition.
+
+    Slots form one circular store of frames. Each n-step transition lives in the slot of
+    its last next_obs frame and keeps, per stack, the `history_length` slot indices it is
+    made of, so `sample()` rebuilds obs/next_obs with a single fancy index. Frames before
+    the episode start point at an all-zero frame, matching the padding of `Env.reset`.
+    Slots that only hold frames (the first n of every episode) have priority 0.
+
+    Transitions of one stream must arrive in order and episodes must end with done=True,
+    which is what NStepAdder produces. Parallel envs pass their index as `stream`.
+    Needs n_step <= history_length: the first transition of an episode has to carry
+    every frame its next_obs is made of.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        obs_shape: Tuple[int, ...],
+        alpha: float,
+        beta_start: float,
+        beta_frames: int,
+        device: torch.device,
+        n_step: int,
+        num_streams: int = 1,
+        store_uint8: bool = True,
+        storage_dir: Optional[str] = None,
+    ):
+        self.history = obs_shape[0]
+        self.n_step = n_step
+        self.num_streams = num_streams
+        assert 1 <= n_step <= self.history, "frame storage needs 1 <= n_step <= history_length"
+        assert capacity > (self.history + n_step) * num_streams, "capacity too small for frame storage"
+        super().__init__(capacity, obs_shape, alpha, beta_start, beta_frames, device, store_uint8, storage_dir)
+
+    def _alloc_obs_storage(self, obs_shape: Tuple[int, ...], obs_dtype: type) -> None:
+        h, n = self.history, self.n_step
+        self.zero_idx = self.capacity  # extra all-zero frame used as padding
+        self.frames = self._alloc("frames", (self.capacity + 1,) + obs_shape[1:], obs_dtype)
+        self.obs_idx = self._alloc("obs_idx", (self.capacity, h), np.int32, fill=self.zero_idx)
+        self.next_idx = self._alloc("next_idx", (self.capacity, h), np.int32, fill=self.zero_idx)
+        self.succ = self._alloc("succ", (self.capacity,), np.int32, fill=-1)  # next frame of the same episode
+        self.has_transition = self._alloc("has_transition", (self.capacity,), bool)
+        # per stream: slots of the last h + n frames of the running episode, oldest first;
+        # not persisted, a reopened buffer starts every stream on a new episode
+        self.recent = np.full((self.num_streams, h + n), self.zero_idx, dtype=np.int32)
+        self.episode_start = np.ones((self.num_streams,), dtype=bool)
+
+    SLOT_ARRAYS = ("frames", "obs_idx", "next_idx", "actions", "rewards", "dones")
+    STATE_ARRAYS = ("priorities", "succ", "has_transition")
+
+    def _layout(self) -> dict:
+        return dict(super()._layout(), n_step=self.n_step)
+
+    def _restore(self, header: dict) -> None:
+        if not header["full"]:
+            # drop frames written after the last flush and the links into them
+            self.has_transition[header["pos"] :] = False
+            self.succ[self.succ >= header["pos"]] = -1
+        # running episodes are not restored, every stream starts a new one
+        self.recent[:] = self.zero_idx
+        self.episode_start[:] = True
+        super()._restore(header)
+
+    def _gather_obs(self, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return self.frames[self.obs_idx[indices]], self.frames[self.next_idx[indices]]
+
+    def _gather_obs_into(self, indices: np.ndarray, obs: np.ndarray, next_obs: np.ndarray) -> None:
+        frame_shape = self.frames.shape[1:]
+        np.take(self.frames, self.obs_idx[indices].ravel(), axis=0, out=obs.reshape((-1,) + frame_shape), mode="clip")
+        np.take(
+            self.frames, self.next_idx[indices].ravel(), axis=0, out=next_obs.reshape((-1,) + frame_shape), mode="clip"
+        )
+
+    def add(
+        self, obs: np.ndarray, action: int, reward: float, next_obs: np.ndarray, done: float, stream: int = 0
+    ):
+        h, n = self.history, self.n_step
+        if self.episode_start[stream]:
+            # obs = [0.., f_0], next_obs = [.., f_1, .., f_n]
+            self.recent[stream] = self.zero_idx
+            self._write_frame(stream, obs[-1])
+            for k in range(h - n, h):
+                self._write_frame(stream, next_obs[k])
+        else:
+            self._write_frame(stream, next_obs[-1])
+
+        idx = self.recent[stream, -1]
+        self.obs_idx[idx] = self.recent[stream, -n - h : -n]
+        self.actions[idx] = action
+        self.rewards[idx] = reward
+        self.dones[idx] = done
+        self.has_transition[idx] = True
+        self._set_priorities(idx, self._insert_priority())
+        self.episode_start[stream] = bool(done)
+
+    def add_batch(
+        self,
+        obs: np.ndarray,
+        actions: np.ndarray,
+        rewards: np.ndarray,
+        next_obs: np.ndarray,
+        dones: np.ndarray,
+        streams: Optional[np.ndarray] = None,
+    ) -> None:
+        # frames are chained per stream, so transitions go in one at a time
+        streams = np.zeros(len(actions), dtype=np.int64) if streams is None else streams
+        for k in range(len(actions)):
+            self.add(obs[k], actions[k], rewards[k], next_obs[k], dones[k], stream=int(streams[k]))
+
     def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray):
-        # Use mean per-sample quantile error as TD error magnitude
-        td = np.mean(np.abs(td_errors), axis=1) + self.eps
-        self.priorities[indices] = td
+        # slots evicted since they were sampled must stay at priority 0
+        keep = self.has_transition[indices]
+        super().update_priorities(indices[keep], td_errors[keep])
+
+    def _write_frame(self, stream: int, frame: np.ndarray) -> None:
+        idx = self.pos
+        if self.full:
+            self._evict(idx)
+        self.frames[idx] = self._encode_obs(frame)
+        self.succ[idx] = -1
+        prev = self.recent[stream, -1]
+        if prev != self.zero_idx:
+            self.succ[prev] = idx
+        self.recent[stream, :-1] = self.recent[stream, 1:]
+        self.recent[stream, -1] = idx
+        self.next_idx[idx] = self.recent[stream, -self.history :]
+        self.has_transition[idx] = False
+        self._set_priorities(idx, 0.0)
+
+        self.pos = (self.pos + 1) % self.capacity
+        self.added += 1
+        if self.pos == 0:
+            self.full = True
+
+    def _evict(self, idx: int) -> None:
+        """Drop the transitions whose stacks still point at the frame about to be overwritten."""
+        for _ in range(self.history + self.n_step - 1):
+            idx = self.succ[idx]
+            if idx < 0:
+                break
+            if self.has_transition[idx]:
+                self.has_transition[idx] = False
+                self._set_priorities(int(idx), 0.0)
+
+
+class CompressedPrioritizedReplayBuffer(PrioritizedReplayBuffer):
+    """
+    PER buffer that keeps each obs/next_obs stack as one bytes object encoded by `codec`
+    (src/agent/obs_codec.py). Crafter stacks are mostly flat tiles and repeated frames, so
+    they shrink by an order of magnitude. Stacks are decoded at sample time on a pool of
+    `threads` threads (zlib and lz4 release the GIL), and batches added with add_batch()
+    are encoded on the same pool; threads=0 does both inline. In memory only: no
+    storage_dir and no checkpoints (the slots are Python objects).
+    """
+
+    SLOT_ARRAYS = ()
+
+    def __init__(
+        self,
+        capacity: int,
+        obs_shape: Tuple[int, ...],
+        alpha: float,
+        beta_start: float,
+        beta_frames: int,
+        device: torch.device,
+        codec: ObsCodec,
+        threads: int = 2,
+    ):
+        self.codec = codec
+        self.threads = threads
+        self._pool = ThreadPoolExecutor(threads, thread_name_prefix="replay-codec") if threads > 0 else None
+        super().__init__(capacity, obs_shape, alpha, beta_start, beta_frames, device)
+
+    def _alloc_obs_storage(self, obs_shape: Tuple[int, ...], obs_dtype: type) -> None:
+        self.obs = np.empty((self.capacity,), dtype=object)
+        self.next_obs = np.empty((self.capacity,), dtype=object)
+
+    @property
+    def obs_nbytes(self) -> int:
+        """Bytes of compressed stacks held (payload only, ~33 bytes of object header each come on top)."""
+        return sum(len(b) for b in self.obs[: self.size]) + sum(len(b) for b in self.next_obs[: self.size])
+
+    def _map(self, fn, chunks: list) -> None:
+        if self._pool is None or len(chunks) == 1:
+            for chunk in chunks:
+                fn(chunk)
+        else:
+            list(self._pool.map(fn, chunks))  # re-raises a worker's exception
+
+    def _chunks(self, n: int) -> list:
+        """At most one contiguous range of [0, n) per thread."""
+        bounds = np.linspace(0, n, min(n, max(1, self.threads)) + 1).astype(int)
+        return [range(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+    def _encode_obs(self, x: np.ndarray):
+        x = super()._encode_obs(x)
+        if x.ndim == len(self.obs_shape):
+            return self.codec.encode(x)
+        blobs = np.empty((len(x),), dtype=object)
+
+        def encode(rows):
+            for k in rows:
+                blobs[k] = self.codec.encode(x[k])
+
+        self._map(encode, self._chunks(len(x)))
+        return blobs
+
+    def _gather_obs(self, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        obs = np.empty((len(indices),) + self.obs_shape, dtype=self.obs_dtype)
+        next_obs = np.empty_like(obs)
+        self._gather_obs_into(indices, obs, next_obs)
+        return obs, next_obs
+
+    def _gather_obs_into(self, indices: np.ndarray, obs: np.ndarray, next_obs: np.ndarray) -> None:
+        blobs, next_blobs = self.obs[indices], self.next_obs[indices]
+
+        def decode(rows):
+            for k in rows:
+                self.codec.decode_into(blobs[k], obs[k])
+                self.codec.decode_into(next_blobs[k], next_obs[k])
+
+        self._map(decode, self._chunks(len(indices)))
+
+
+class TorchPrioritizedReplayBuffer:
+    """
+    PrioritizedReplayBuffer that lives in torch tensors on `device`: uint8 obs/next_obs
+    stacks, actions, rewards, dones, priorities and both segment trees. add_batch() makes
+    the one host -> device copy of the new transitions; sample() draws, gathers and weighs
+    a batch with tensor ops and update_priorities() takes the learner's device tensor as
+    is, so a training step never goes through numpy or waits for the host. The batch's
+    "indices" are a device tensor.
+
+    Same stratified proportional sampling as PrioritizedReplayBuffer, with the random
+    numbers from torch's generator. No memmap storage_dir, checkpoints or prefetching.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        obs_shape: Tuple[int, ...],
+        alpha: float,
+        beta_start: float,
+        beta_frames: int,
+        device: torch.device,
+    ):
+        self.capacity = int(capacity)
+        self.alpha = alpha
+        self.beta_start = beta_start
+        self.beta_frames = beta_frames
+        self.device = torch.device(device)
+
+        self.pos = 0
+        self.full = False
+        self.frame = 1  # for beta anneal
+        self.added = 0
+
+        self.obs_shape = tuple(obs_shape)
+        self.obs_dtype = np.uint8
+        self.obs = torch.zeros((self.capacity,) + self.obs_shape, dtype=torch.uint8, device=self.device)
+        self.next_obs = torch.zeros_like(self.obs)
+        self.actions = torch.zeros((self.capacity,), dtype=torch.int64, device=self.device)
+        self.rewards = torch.zeros((self.capacity,), dtype=torch.float32, device=self.device)
+        self.dones = torch.zeros((self.capacity,), dtype=torch.float32, device=self.device)
+
+        self.priorities = torch.zeros((self.capacity,), dtype=torch.float32, device=self.device)
+        self.sum_tree = TorchSumSegmentTree(self.capacity, self.device)  # p^alpha, sampling mass
+        self.max_tree = TorchMaxSegmentTree(self.capacity, self.device)  # raw p, insert priority
+        self.eps = 1e-6
+
+    @property
+    def size(self) -> int:
+        return self.capacity if self.full else self.pos
+
+    def beta_by_frame(self) -> float:
+        return min(1.0, self.beta_start + (1.0 - self.beta_start) * (self.frame / self.beta_frames))
+
+    def _to_device(self, x, dtype: torch.dtype) -> torch.Tensor:
+        return torch.as_tensor(x).to(self.device, dtype, non_blocking=True)
+
+    def _encode_obs(self, x) -> torch.Tensor:
+        x = torch.as_tensor(x)
+        if x.dtype != torch.uint8:
+            # expect float [0,1] -> uint8
+            x = (x.clamp(0.0, 1.0) * 255.0).to(torch.uint8)
+        return x.to(self.device, non_blocking=True)
+
+    def add(self, obs, action: int, reward: float, next_obs, done: float, stream: int = 0):
+        self.add_batch(
+            np.asarray(obs)[None], np.array([action]), np.array([reward]), np.asarray(next_obs)[None], np.array([done])
+        )
+
+    def add_batch(self, obs, actions, rewards, next_obs, dones, streams=None) -> None:
+        """add() for K transitions at once, in order."""
+        k = len(actions)
+        if k == 0:
+            return
+        assert k <= self.capacity
+        idx = (self.pos + torch.arange(k, device=self.device)) % self.capacity
+        self.obs.index_copy_(0, idx, self._encode_obs(obs))
+        self.next_obs.index_copy_(0, idx, self._encode_obs(next_obs))
+        self.actions.index_copy_(0, idx, self._to_device(actions, torch.int64))
+        self.rewards.index_copy_(0, idx, self._to_device(rewards, torch.float32))
+        self.dones.index_copy_(0, idx, self._to_device(dones, torch.float32))
+
+        self._set_priorities(idx, self._insert_priority().expand(k))
+
+        if self.pos + k >= self.capacity:
+            self.full = True
+        self.pos = (self.pos + k) % self.capacity
+        self.added += k
+
+    def sample(self, batch_size: int) -> Dict[str, torch.Tensor]:
+        indices, weights = self.sample_indices(batch_size)
+        return {
+            "obs": self.obs.index_select(0, indices),
+            "actions": self.actions.index_select(0, indices),
+            "rewards": self.rewards.index_select(0, indices),
+            "next_obs": self.next_obs.index_select(0, indices),
+            "dones": self.dones.index_select(0, indices),
+            "weights": weights,
+            "indices": indices,
+        }
+
+    def sample_indices(self, batch_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Stratified proportional draw of indices and normalized IS weights; advances the beta anneal."""
+        assert self.size > 0, "Replay is empty"
+        total = self.sum_tree.sum()
+        u = torch.rand(batch_size, dtype=torch.float64, device=self.device)
+        mass = (torch.arange(batch_size, dtype=torch.float64, device=self.device) + u) * (total / batch_size)
+        mass = torch.minimum(mass, torch.nextafter(total, torch.zeros_like(total)))
+        indices = self.sum_tree.find_prefixsum_idx(mass).clamp_(max=self.size - 1)
+        probs = self.sum_tree[indices] / total
+        beta = self.beta_by_frame()
+        self.frame += 1
+
+        weights = (self.size * probs) ** (-beta)
+        weights /= weights.max() + 1e-6
+        return indices, weights.float()
+
+    def update_priorities(self, indices, td_errors) -> None:
+        # [B, N] quantile errors are reduced to their mean, [B] errors are used as they are
+        td = self._to_device(td_errors, torch.float32).abs()
+        if td.ndim == 2:
+            td = td.mean(dim=1)
+        self._set_priorities(self._to_device(indices, torch.int64), td + self.eps)
+
+    def flush(self) -> None:
+        """Nothing to persist; here so train.py can treat every replay alike."""
+
+    def _insert_priority(self) -> torch.Tensor:
+        # max priority for newly added, 1.0 while nothing is sampleable yet
+        max_prio = self.max_tree.max()
+        return torch.where(max_prio > 0.0, max_prio, 1.0).float()
+
+    def _set_priorities(self, indices: torch.Tensor, prios: torch.Tensor) -> None:
+        self.priorities[indices] = prios
+        self.sum_tree[indices] = prios.pow(self.alpha).double()
+        self.max_tree[indices] = prios.double()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import operator
+from typing import Callable, Union
+
+import numpy as np
+import torch
+
+
+class SegmentTree:
+    """
+    Array-backed binary segment tree over `capacity` leaves.
+    Node 1 is the root, node i has children 2i and 2i+1, leaves live at [size, 2*size).
+    All updates and queries are vectorized over a batch of indices; the cost per call is
+    O(log N) numpy operations regardless of the batch size.
+    """
+
+    def __init__(self, capacity: int, op: np.ufunc, scalar_op: Callable[[float, float], float], neutral: float):
+        assert capacity > 0, "capacity must be positive"
+        self.capacity = int(capacity)
+        self.size = 1 << (self.capacity - 1).bit_length()  # leaves, power of two
+        self.depth = self.size.bit_length() - 1
+        self.op = op
+        self.scalar_op = scalar_op
+        self.neutral = neutral
+        self.tree = np.full(2 * self.size, neutral, dtype=np.float64)
+
+    def __getitem__(self, idx: Union[int, np.ndarray]) -> Union[float, np.ndarray]:
+        return self.tree[self.size + np.asarray(idx)]
+
+    def __setitem__(self, idx: Union[int, np.ndarray], value: Union[float, np.ndarray]) -> None:
+        if np.isscalar(idx):
+            # single leaf: plain python walk, cheaper than numpy dispatch
+            tree, op = self.tree, self.scalar_op
+            node = self.size + int(idx)
+            tree[node] = value
+            for _ in range(self.depth):
+                node //= 2
+                tree[node] = op(tree[2 * node], tree[2 * node + 1])
+            return
+        nodes = self.size + np.asarray(idx, dtype=np.int64).ravel()
+        if nodes.size == 0:
+            return
+        self.tree[nodes] = value  # duplicates: last write wins, as with plain arrays
+        for _ in range(self.depth):
+            # duplicate parents are harmless: every copy writes the same value
+            nodes //= 2
+            self.tree[nodes] = self.op(self.tree[2 * nodes], self.tree[2 * nodes + 1])
+
+    def rebuild(self, values: np.ndarray) -> None:
+        """Bulk-load all leaves from `values` (len <= capacity) in O(N)."""
+        self.tree[:] = self.neutral
+        self.tree[self.size : self.size + len(values)] = values
+        for level in range(self.depth - 1, -1, -1):
+            lo, hi = 1 << level, 1 << (level + 1)
+            self.tree[lo:hi] = self.op(self.tree[2 * lo : 2 * hi : 2], self.tree[2 * lo + 1 : 2 * hi : 2])
+
+    def reduce(self) -> float:
+        """Reduction over all leaves in O(1)."""
+        return float(self.tree[1])
+
+
+class SumSegmentTree(SegmentTree):
+    def __init__(self, capacity: int):
+        super().__init__(capacity, np.add, operator.add, 0.0)
+
+    def sum(self) -> float:
+        return self.reduce()
+
+    def find_prefixsum_idx(self, prefixsum: np.ndarray) -> np.ndarray:
+        """
+        For each value v in `prefixsum` return the highest leaf i such that
+        sum(leaves[:i]) <= v. Descends all queries one level at a time.
+        """
+        value = np.asarray(prefixsum, dtype=np.float64).copy()
+        nodes = np.ones(value.shape, dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sum = self.tree[left]
+            go_right = value >= left_sum
+            value -= np.where(go_right, left_sum, 0.0)
+            nodes = left + go_right
+        return nodes - self.size
+
+
+class MaxSegmentTree(SegmentTree):
+    def __init__(self, capacity: int):
+        super().__init__(capacity, np.maximum, max, 0.0)
+
+    def max(self) -> float:
+        return self.reduce()
+
+
+class TorchSegmentTree:
+    """
+    SegmentTree on a torch tensor of `device`, for replays that keep their priorities there.
+    Same layout; `reduce_pairs` combines the [K, 2] children of K nodes. All ancestors of
+    the written leaves are computed at once and each level is one gather and one write.
+    Indices are device tensors and queries return device tensors (reduce() a 0-d one), so
+    nothing waits for the host.
+    """
+
+    def __init__(self, capacity: int, reduce_pairs: Callable[[torch.Tensor], torch.Tensor], neutral: float, device):
+        assert capacity > 0, "capacity must be positive"
+        self.capacity = int(capacity)
+        self.size = 1 << (self.capacity - 1).bit_length()
+        self.depth = self.size.bit_length() - 1
+        self.reduce_pairs = reduce_pairs
+        self.tree = torch.full((2 * self.size,), neutral, dtype=torch.float64, device=device)
+        self.children = self.tree.view(-1, 2)  # row i: both children of node i
+        self._shifts = torch.arange(1, self.depth + 1, device=device)
+
+    def __getitem__(self, idx: torch.Tensor) -> torch.Tensor:
+        return self.tree.index_select(0, self.size + idx.reshape(-1)).view(idx.shape)
+
+    def __setitem__(self, idx: torch.Tensor, value: Union[float, torch.Tensor]) -> None:
+        nodes = self.size + idx.reshape(-1)
+        if nodes.numel() == 0:
+            return
+        self.tree.index_put_((nodes,), torch.as_tensor(value, dtype=torch.float64, device=self.tree.device))
+        # duplicates: last write wins on the leaves, parents are recomputed from them
+        for parents in (nodes[:, None] >> self._shifts).T.contiguous():
+            self.tree.index_put_((parents,), self.reduce_pairs(self.children.index_select(0, parents)))
+
+    def reduce(self) -> torch.Tensor:
+        return self.tree[1]
+
+
+class TorchSumSegmentTree(TorchSegmentTree):
+    def __init__(self, capacity: int, device):
+        super().__init__(capacity, lambda pairs: pairs.sum(dim=1), 0.0, device)
+
+    def sum(self) -> torch.Tensor:
+        return self.reduce()
+
+    def find_prefixsum_idx(self, prefixsum: torch.Tensor) -> torch.Tensor:
+        """SumSegmentTree.find_prefixsum_idx for a float64 device tensor."""
+        value = prefixsum.clone()
+        nodes = torch.ones(value.shape, dtype=torch.int64, device=value.device)
+        for _ in range(self.depth):
+            left_sum = self.children.index_select(0, nodes)[:, 0]
+            go_right = value >= left_sum
+            value -= left_sum * go_right
+            nodes = 2 * nodes + go_right
+        return nodes - self.size
+
+
+class TorchMaxSegmentTree(TorchSegmentTree):
+    def __init__(self, capacity: int, device):
+        super().__init__(capacity, lambda pairs: pairs.amax(dim=1), 0.0, device)
+
+    def max(self) -> torch.Tensor:
+        return self.reduce()
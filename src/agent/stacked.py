@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import copy
+from typing import Dict, List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+from torch.func import functional_call, stack_module_state, vmap
+
+from src.agent.dqn_model import QRDuelingDQN
+from src.agent.learner import MixedPrecision, compute_targets, quantile_huber_loss
+
+
+class StackedQRDuelingDQN(nn.Module):
+    """
+    K independent QRDuelingDQN members whose parameters are stacked along a leading
+    member dimension, so one optimizer and one call serve all of them.
+    forward: x [K, B, C, 84, 84] -> [K, B, A, N], member k only ever sees x[k].
+
+    mode="vmap" runs all members in one torch.func.vmap'ed call (grouped kernels, the fast
+    path on GPUs); mode="loop" calls the members one after another on slices of the
+    same stacked parameters, which is faster for CPU convolutions.
+    """
+
+    def __init__(self, members: List[QRDuelingDQN], mode: str = "vmap"):
+        super().__init__()
+        assert mode in ("vmap", "loop")
+        self.mode = mode
+        self.num_members = len(members)
+        self.num_actions = members[0].num_actions
+        self.num_quantiles = members[0].num_quantiles
+        params, _ = stack_module_state(members)
+        self.names = list(params)
+        self.stacked = nn.ParameterList([nn.Parameter(params[name]) for name in self.names])
+        # parameter-less template for functional_call, kept out of the module tree
+        self._template = [copy.deepcopy(members[0]).to("meta")]
+
+    def _params(self) -> Dict[str, torch.Tensor]:
+        return dict(zip(self.names, self.stacked))
+
+    def _call(self, params: Dict[str, torch.Tensor], x: torch.Tensor) -> torch.Tensor:
+        return functional_call(self._template[0], params, (x,))
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        params = self._params()
+        if self.mode == "vmap":
+            return vmap(self._call)(params, x)
+        return torch.stack(
+            [self._call({n: p[k] for n, p in params.items()}, x[k]) for k in range(self.num_members)]
+        )
+
+    def member(self, k: int, device=None) -> QRDuelingDQN:
+        """A standalone copy of member k, e.g. for evaluation. Draws nothing from the RNGs."""
+        template = self._template[0]
+        with torch.device("meta"):  # no weight init, which would advance the torch RNG
+            net = QRDuelingDQN(template.conv[0].in_channels, self.num_actions, self.num_quantiles)
+        net.to_empty(device=device if device is not None else self.stacked[0].device)
+        net.load_state_dict({n: p[k].detach() for n, p in self._params().items()})
+        return net
+
+
+def clip_grad_norm_per_member_(net: StackedQRDuelingDQN, max_norm: float) -> torch.Tensor:
+    """clip_grad_norm_ applied to every member on its own; returns the K pre-clip norms."""
+    grads = [p.grad for p in net.stacked if p.grad is not None]
+    sq = torch.stack([g.pow(2).flatten(1).sum(1) for g in grads]).sum(0)  # [K]
+    norms = sq.sqrt()
+    coef = (max_norm / (norms + 1e-6)).clamp(max=1.0)
+    for g in grads:
+        g.mul_(coef.view((-1,) + (1,) * (g.dim() - 1)))
+    return norms
+
+
+def learn_qr_dqn_stacked(
+    batch: Dict[str, torch.Tensor],
+    online: StackedQRDuelingDQN,
+    target: StackedQRDuelingDQN,
+    optimizer: torch.optim.Optimizer,
+    gamma: float,
+    kappa: float,
+    grad_norm_clip: float = 10.0,
+    precision: Optional[MixedPrecision] = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    learn_qr_dqn for K members at once; every tensor in `batch` has a leading [K] dim and
+    member k's loss only reaches member k's parameters. Returns the K losses and the
+    per-sample mean |TD error| [K, B], both detached on the device.
+    """
+    precision = precision or MixedPrecision()
+    obs, next_obs = batch["obs"], batch["next_obs"]
+    K, B = batch["actions"].shape
+    N = online.num_quantiles
+
+    with precision.autocast():
+        dist_all = online(obs)  # [K, B, A, N]
+    dist = dist_all.gather(2, batch["actions"].long().view(K, B, 1, 1).expand(K, B, 1, N)).squeeze(2)
+
+    with torch.no_grad(), precision.autocast():
+        next_actions = online(next_obs).mean(dim=3).argmax(dim=2)  # Double DQN selection, [K, B]
+        next_dist = target(next_obs).gather(2, next_actions.view(K, B, 1, 1).expand(K, B, 1, N)).squeeze(2)
+        target_dist = compute_targets(
+            batch["rewards"].view(-1), batch["dones"].view(-1), gamma, next_dist.view(K * B, N)
+        )
+
+    loss_per_item, td_abs = quantile_huber_loss(dist.view(K * B, N), target_dist, kappa=kappa)
+    losses = (loss_per_item.view(K, B) * batch["weights"]).mean(dim=1)  # [K]
+
+    # members share no parameters: each gets its own gradient
+    optimizer.zero_grad(set_to_none=True)
+    losses.sum().backward()
+    clip_grad_norm_per_member_(online, grad_norm_clip)
+    optimizer.step()
+    return losses.detach(), td_abs.detach().view(K, B, N).mean(dim=2)
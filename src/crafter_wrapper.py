@@ -1,48 +1,173 @@
 import pathlib
-from collections import deque
 
 import crafter
 import numpy as np
-import torch
 from PIL import Image
 
+from src.utils.log_sink import FLUSH_INTERVAL, BinaryEncoder, LogSink, encode_jsonl
+from src.utils.perf import perf
+from src.world_pool import PooledCrafter
+
+
+def make_crafter(mode, logdir, seed=None, worlds=None, log_interval=FLUSH_INTERVAL, stats_binary=False):
+    """
+    Crafter with the preprocessing chain; train mode also logs stats.jsonl to `logdir`
+    (buffered, see StatsRecorder; with `stats_binary` also stats.bin). With `worlds`
+    (a WorldStream) resets swap in worlds pre-generated by a WorldPool.
+    """
+    assert mode in (
+        "train",
+        "eval",
+    ), "`mode` argument can either be `train` or `eval`"
+    env = crafter.Env(seed=seed) if worlds is None else PooledCrafter(worlds, seed=seed)
+    if mode == "train":
+        env = StatsRecorder(env, logdir, log_interval, stats_binary)
+    env = GrayResize(env)
+    return env
+
+
+class StatsRecorder:
+    """
+    crafter.Recorder(save_stats=True) without the synchronous write per episode: the same
+    stats.jsonl lines go through a LogSink, which appends them in batches from a background
+    thread. `binary` also writes every episode as one fixed-width row of stats.bin
+    (src/utils/log_sink.py, about 7x smaller). close() flushes.
+    """
+
+    def __init__(self, env, directory, interval: float = FLUSH_INTERVAL, binary: bool = False):
+        self._env = env
+        directory = pathlib.Path(directory).expanduser()
+        self._sinks = [LogSink(directory / "stats.jsonl", encode_jsonl, interval)]
+        if binary:
+            self._sinks.append(LogSink(directory / "stats.bin", BinaryEncoder(directory / "stats.bin"), interval))
+        self._length = None
+        self._reward = None
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self._env, name)
+
+    def reset(self):
+        obs = self._env.reset()
+        self._length = 0
+        self._reward = 0
+        return obs
+
+    def step(self, action):
+        obs, reward, done, info = self._env.step(action)
+        self._length += 1
+        self._reward += info["reward"]
+        if done:
+            stats = {"length": self._length, "reward": round(self._reward, 1)}
+            for key, value in info["achievements"].items():
+                stats[f"achievement_{key}"] = value
+            for sink in self._sinks:
+                sink.write(stats)
+        return obs, reward, done, info
+
+    def flush(self):
+        for sink in self._sinks:
+            sink.flush()
+
+    def close(self):
+        for sink in self._sinks:
+            sink.close()
+
 
 class Env:
+    """
+    Preprocessed Crafter with frame stacking.
+    Observations are [history_length, 84, 84] uint8 stacks; the network scales them to [0,1].
+    """
+
     def __init__(self, mode, args):
-        assert mode in (
-            "train",
-            "eval",
-        ), "`mode` argument can either be `train` or `eval`"
-        self.device = args.device
-        env = crafter.Env()
-        if mode == "train":
-            env = crafter.Recorder(
-                env,
-                pathlib.Path(args.logdir),
-                save_stats=True,
-                save_video=False,
-                save_episode=False,
-            )
-        env = ResizeImage(env)
-        env = GrayScale(env)
+        env = make_crafter(mode, args.logdir)
         self.env = env
         self.action_space = env.action_space
         self.window = args.history_length  # Number of frames to concatenate
-        self.state_buffer = deque([], maxlen=args.history_length)
+        self.state_buffer = FrameStack(args.history_length)
 
     def reset(self):
-        for _ in range(self.window):
-            self.state_buffer.append(torch.zeros(84, 84, device=self.device))
         obs = self.env.reset()
-        obs = torch.tensor(obs, dtype=torch.float32, device=self.device).div_(255)
-        self.state_buffer.append(obs)
-        return torch.stack(list(self.state_buffer), 0)
+        self.state_buffer.reset(obs)
+        return self.state_buffer.stack().copy()
 
     def step(self, action):
         obs, reward, done, info = self.env.step(action)
-        obs = torch.tensor(obs, dtype=torch.float32, device=self.device).div_(255)
-        self.state_buffer.append(obs)
-        return torch.stack(list(self.state_buffer), 0), reward, done, info
+        self.state_buffer.push(obs)
+        return self.state_buffer.stack().copy(), reward, done, info
+
+
+class FrameStack:
+    """
+    Preallocated uint8 ring of the last `history` frames. Every frame is written twice,
+    at slot i and i + history, so the current stack is always one contiguous view and
+    pushing never shifts the older frames.
+    """
+
+    def __init__(self, history: int, shape=(84, 84)):
+        self.history = history
+        self.buffer = np.zeros((2 * history,) + tuple(shape), dtype=np.uint8)
+        self.i = history - 1  # slot of the newest frame
+
+    def reset(self, frame: np.ndarray) -> None:
+        self.buffer[:] = 0  # zero padding before the first frame
+        self.i = self.history - 1
+        self.push(frame)
+
+    def push(self, frame: np.ndarray) -> None:
+        self.i = (self.i + 1) % self.history
+        self.buffer[self.i] = frame
+        self.buffer[self.i + self.history] = frame
+
+    def stack(self) -> np.ndarray:
+        """View [history, 84, 84], oldest first; overwritten by the next push."""
+        return self.buffer[self.i + 1 : self.i + 1 + self.history]
+
+
+class GrayResize:
+    """
+    Fused, uint8-only replacement for ResizeImage + GrayScale.
+    Integer channel mean (identical to truncating GrayScale's float mean) on the 64x64
+    frame, then a nearest-neighbour gather through a precomputed index map that
+    reproduces PIL's NEAREST sampling exactly.
+    """
+
+    def __init__(self, env, size=(84, 84)):
+        self._env = env
+        h, w = env.observation_space.shape[:2]
+        self._rows = _pil_nearest_index(h, size[0])
+        self._cols = _pil_nearest_index(w, size[1])
+        self._index = (self._rows[:, None] * w + self._cols[None, :]).ravel()
+        self._size = tuple(size)
+        self._sum = np.empty((h, w), dtype=np.uint16)
+
+    def __getattr__(self, name):
+        return getattr(self._env, name)
+
+    def step(self, action):
+        obs, reward, done, info = self._env.step(action)
+        with perf.phase("preprocess"):
+            return self._process(obs), reward, done, info
+
+    def reset(self):
+        obs = self._env.reset()
+        with perf.phase("preprocess"):
+            return self._process(obs)
+
+    def _process(self, image: np.ndarray) -> np.ndarray:
+        # channel adds into a preallocated buffer beat a reduction over the short last axis
+        total = np.add(image[..., 0], image[..., 1], out=self._sum, dtype=np.uint16)
+        total += image[..., 2]
+        total //= 3
+        return total.astype(np.uint8).ravel().take(self._index).reshape(self._size)
+
+
+def _pil_nearest_index(in_size: int, out_size: int) -> np.ndarray:
+    # PIL's NEAREST uses fixed-point coordinates, so read its mapping off an index ramp
+    ramp = np.arange(in_size, dtype=np.int32)[None, :].repeat(2, 0)
+    return np.array(Image.fromarray(ramp).resize((out_size, 2), Image.NEAREST))[0].astype(np.int64)
 
 
 class GrayScale:
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import torch
+
+STATE = "state.pt"
+CHUNK = 4096  # slots copied per step, bounds the writer's extra memory
+
+
+def to_cpu(obj):
+    """Detached CPU copy of every tensor in a (nested) state dict; other values as is."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+
+class CheckpointWriter:
+    """
+    Periodic training snapshots written by a background thread.
+
+    A snapshot is `state.pt` (networks, optimizer, counters, RNGs, the replay's counters and
+    small arrays) plus the replay slots written since the previous snapshot, stored as a
+    delta directory `replay_<added>/`. state.pt lists the deltas to replay in order and only
+    keeps as many as cover the buffer once, so the disk holds about one replay plus one
+    interval and every slot is written once. Deltas and state.pt are renamed into place
+    when complete, state.pt last: a crash mid-write leaves the previous snapshot intact.
+
+    save() only copies the small state; the delta rows are read from the live replay by the
+    writer thread, oldest first, CHUNK slots at a time. The live loop overwrites the delta
+    oldest first too, row k after `capacity - len(delta) + k` more adds, so the writer only
+    has to stay ahead of it: the rows less than a CHUNK away from being overwritten are
+    copied by save(), the others are checked against replay.added after each chunk. A
+    snapshot that lost the race is dropped as soon as it does (its slots go into the next).
+    """
+
+    def __init__(self, directory, replay, deltas: Optional[List[Tuple[str, int]]] = None, added: int = 0):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.replay = replay
+        self.deltas = list(deltas or [])  # (dir name, slots) of the committed snapshot
+        self.added = added  # replay.added at the committed snapshot
+        self._thread: Optional[threading.Thread] = None
+        self.error: Optional[BaseException] = None
+
+    def save(self, train_state: dict) -> None:
+        """Snapshot now; waits for the previous snapshot to finish first. Call with replay writers paused."""
+        self.wait()
+        replay_state = self.replay.state_dict()
+        indices = self.replay.slots_since(self.added)
+        # at most CHUNK rows: those the next adds overwrite before the writer gets to them
+        early = int(np.clip(CHUNK - (self.replay.capacity - len(indices)), 0, len(indices)))
+        rows = {name: getattr(self.replay, name)[indices[:early]] for name in self.replay.SLOT_ARRAYS}
+        state = {"train": to_cpu(train_state), "replay": replay_state}
+        self._thread = threading.Thread(target=self._write, args=(state, indices, rows), daemon=True)
+        self._thread.start()
+
+    def wait(self) -> None:
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.error is not None:
+            raise self.error
+
+    def _write(self, state: dict, indices: np.ndarray, rows: dict) -> None:
+        try:
+            self._commit(state, indices, rows)
+        except BaseException as e:  # re-raised by the next save()/wait()
+            self.error = e
+
+    def _commit(self, state: dict, indices: np.ndarray, rows: dict) -> None:
+        replay, added = self.replay, state["replay"]["added"]
+        deltas = list(self.deltas)
+        if len(indices):
+            name = f"replay_{added:012d}"
+            tmp = self.directory / (name + ".tmp")
+            shutil.rmtree(tmp, ignore_errors=True)
+            tmp.mkdir()
+            np.save(tmp / "indices.npy", indices)
+            out = {
+                array_name: np.lib.format.open_memmap(
+                    tmp / f"{array_name}.npy",
+                    mode="w+",
+                    dtype=getattr(replay, array_name).dtype,
+                    shape=(len(indices),) + getattr(replay, array_name).shape[1:],
+                )
+                for array_name in replay.SLOT_ARRAYS
+            }
+            early = len(next(iter(rows.values()), ()))
+            for array_name, array in out.items():
+                array[:early] = rows[array_name]
+            headroom = replay.capacity - len(indices)  # adds after the snapshot before delta row 0 is overwritten
+            for lo in range(early, len(indices), CHUNK):
+                for array_name, array in out.items():
+                    array[lo : lo + CHUNK] = getattr(replay, array_name)[indices[lo : lo + CHUNK]]
+                # an add_batch still writing has not counted its slots yet, allow half a CHUNK of them
+                if replay.added - added + CHUNK // 2 > headroom + lo:
+                    del out
+                    shutil.rmtree(tmp, ignore_errors=True)
+                    print(f"Checkpoint at replay slot {added} skipped: the buffer wrapped onto it while writing.")
+                    return
+            for array in out.values():
+                array.flush()
+            del out
+            shutil.rmtree(self.directory / name, ignore_errors=True)
+            os.replace(tmp, self.directory / name)
+            deltas.append((name, len(indices)))
+            # older deltas are dead once the newer ones rewrote every slot
+            while len(deltas) > 1 and sum(n for _, n in deltas[1:]) >= replay.capacity:
+                deltas.pop(0)
+
+        state["deltas"] = deltas
+        tmp = self.directory / (STATE + ".tmp")
+        torch.save(state, tmp)
+        os.replace(tmp, self.directory / STATE)
+        for old, _ in self.deltas:
+            if old not in {name for name, _ in deltas}:
+                shutil.rmtree(self.directory / old, ignore_errors=True)
+        self.deltas, self.added = deltas, added
+
+
+def load_checkpoint(directory, replay) -> Optional[Tuple[dict, CheckpointWriter]]:
+    """
+    Restore `replay` from the snapshot in `directory` and return (train state, writer
+    that continues the snapshot chain), or None when there is no snapshot yet.
+    """
+    directory = Path(directory)
+    if not (directory / STATE).exists():
+        return None
+    state = torch.load(directory / STATE, map_location="cpu", weights_only=False)
+    for name, _ in state["deltas"]:
+        indices = np.load(directory / name / "indices.npy")
+        for array_name in replay.SLOT_ARRAYS:
+            rows = np.load(directory / name / f"{array_name}.npy", mmap_mode="r")
+            target = getattr(replay, array_name)
+            for lo in range(0, len(indices), CHUNK):
+                target[indices[lo : lo + CHUNK]] = rows[lo : lo + CHUNK]
+    replay.load_state_dict(state["replay"])
+    writer = CheckpointWriter(directory, replay, state["deltas"], state["replay"]["added"])
+    return state["train"], writer
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+import atexit
+import json
+import os
+import pickle
+import threading
+import weakref
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+FLUSH_INTERVAL = 10.0  # seconds a record may wait in memory
+FLUSH_RECORDS = 512  # records that trigger a flush right away
+BINARY_MAGIC = b"CRAFTER-RECORDS-1\n"
+
+
+def encode_jsonl(records: List[dict]) -> bytes:
+    """One JSON object per line, as crafter.Recorder writes stats.jsonl."""
+    return "".join(json.dumps(r) + "\n" for r in records).encode()
+
+
+def encode_pickle(records: List[dict]) -> bytes:
+    """Consecutive pickles, as pickle.dump(record, f) appends them one by one (eval_stats.pkl)."""
+    return b"".join(pickle.dumps(r) for r in records)
+
+
+class BinaryEncoder:
+    """
+    Compact fixed-width records: the file starts with BINARY_MAGIC and one JSON line of
+    [name, numpy dtype] fields, followed by little-endian rows of that structured dtype.
+    The fields are those of the first record (bool, int32, float32 by value type); writers
+    appending to an existing file must match its fields. Read it back with read_binary().
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.dtype: Optional[np.dtype] = None
+
+    def __call__(self, records: List[dict]) -> bytes:
+        if self.dtype is None:
+            fields = [[k, _binary_type(v)] for k, v in records[0].items()]
+            self.dtype = self._header(fields)
+        rows = np.array([tuple(r[name] for name in self.dtype.names) for r in records], dtype=self.dtype)
+        return rows.tobytes()
+
+    def _header(self, fields: List[List[str]]) -> np.dtype:
+        # the header is linked into place complete, so of several processes starting the file one wins
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.{threading.get_ident()}")
+        tmp.write_bytes(BINARY_MAGIC + json.dumps(fields).encode() + b"\n")
+        try:
+            os.link(tmp, self.path)
+        except FileExistsError:
+            pass
+        finally:
+            tmp.unlink()
+        dtype = read_binary_header(self.path)[0]
+        if dtype != np.dtype([tuple(f) for f in fields]):
+            raise ValueError(f"{self.path} holds records with other fields: {dtype}")
+        return dtype
+
+
+def _binary_type(value) -> str:
+    if isinstance(value, (bool, np.bool_)):
+        return "?"
+    return "<i4" if isinstance(value, (int, np.integer)) else "<f4"
+
+
+def read_binary_header(path) -> Tuple[np.dtype, int]:
+    """(row dtype, offset of the first row) of a BinaryEncoder file."""
+    with open(path, "rb") as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError(f"{path} is not a binary record file")
+        fields = f.readline()
+        return np.dtype([tuple(field) for field in json.loads(fields)]), len(BINARY_MAGIC) + len(fields)
+
+
+def read_binary(path, offset: int = 0) -> Tuple[np.ndarray, int]:
+    """Complete rows of a BinaryEncoder file from byte `offset` on (0 = the first row), and the offset after them."""
+    dtype, start = read_binary_header(path)
+    offset = max(offset, start)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        buf = f.read()
+    rows = len(buf) // dtype.itemsize
+    return np.frombuffer(buf[: rows * dtype.itemsize], dtype=dtype), offset + rows * dtype.itemsize
+
+
+class LogSink:
+    """
+    Append-only log file written from a background thread. write() only queues the record;
+    the thread appends everything queued once FLUSH_RECORDS are waiting or FLUSH_INTERVAL
+    seconds have passed, with one write() of the encoded batch. Records reach the disk in
+    write order and in exactly the bytes `encode` gives them. close() (also run at
+    interpreter exit) flushes whatever is left; processes that leave through os._exit, as
+    multiprocessing workers do, have to call it themselves.
+    """
+
+    def __init__(
+        self,
+        path,
+        encode: Callable[[List[dict]], bytes],
+        interval: float = FLUSH_INTERVAL,
+        max_records: int = FLUSH_RECORDS,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.encode = encode
+        self.interval = interval
+        self.max_records = max_records
+        self._records: List[dict] = []
+        self._lock = threading.Lock()  # guards _records
+        self._write_lock = threading.Lock()  # one batch at a time, in order
+        self._wake = threading.Event()
+        self._closed = False
+        self.error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name=f"log-{self.path.name}", daemon=True)
+        self._thread.start()
+        _open_sinks.add(self)
+
+    def write(self, record: dict) -> None:
+        if self.error is not None:
+            raise self.error
+        with self._lock:
+            self._records.append(record)
+            full = len(self._records) >= self.max_records
+        if full:
+            self._wake.set()
+
+    def flush(self) -> None:
+        """Write everything queued so far, now."""
+        with self._write_lock:
+            with self._lock:
+                records, self._records = self._records, []
+            if not records:
+                return
+            data = self.encode(records)
+            # one O_APPEND write per batch, so workers sharing the file never interleave within a line
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view) :]
+            finally:
+                os.close(fd)
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except BaseException as e:  # surfaced by the next write()
+                self.error = e
+                return
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        _open_sinks.discard(self)
+
+
+_open_sinks = weakref.WeakSet()
+_shared: Dict[Tuple[str, str], LogSink] = {}
+
+
+def shared_sink(path, encode: Callable[[List[dict]], bytes], **kwargs) -> LogSink:
+    """The process-wide sink of `path` (created on first use), for writers that do not keep one around."""
+    key = (os.path.abspath(path), getattr(encode, "__name__", type(encode).__name__))
+    sink = _shared.get(key)
+    if sink is None or sink._closed:
+        sink = _shared[key] = LogSink(path, encode, **kwargs)
+    return sink
+
+
+def log_size(path) -> int:
+    """Bytes in the log at `path` so far (0 if it does not exist yet)."""
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def truncate_log(path, size: int) -> None:
+    """Cut a log back to its first `size` bytes, e.g. to a size recorded earlier; size 0 removes it."""
+    path = Path(path)
+    if size == 0:
+        path.unlink(missing_ok=True)  # a binary log must restart with its header
+    elif path.exists():
+        os.truncate(path, size)
+
+
+def trim_pickles(path, keep: Callable[[dict], bool]) -> None:
+    """Rewrite a file of consecutive pickles (encode_pickle) with only the records `keep` accepts."""
+    path = Path(path)
+    if not path.exists():
+        return
+    records = []
+    with open(path, "rb") as f:
+        while True:
+            try:
+                records.append(pickle.load(f))
+            except EOFError:
+                break
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(encode_pickle([r for r in records if keep(r)]))
+    os.replace(tmp, path)
+
+
+def close_all() -> None:
+    """Flush and close every open sink of this process."""
+    for sink in list(_open_sinks):
+        sink.close()
+    _shared.clear()
+
+
+def _forget_after_fork() -> None:
+    # a forked child must not write what its parent had queued: the parent still will
+    for sink in list(_open_sinks):
+        sink._records = []
+        sink._closed = True
+    _open_sinks.clear()
+    _shared.clear()
+
+
+atexit.register(close_all)
+os.register_at_fork(after_in_child=_forget_after_fork)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import torch
+
+_NULL = nullcontext()
+
+
+class _Phase:
+    __slots__ = ("perf", "name", "t0", "record")
+
+    def __init__(self, perf: "Perf", name: str):
+        self.perf = perf
+        self.name = name
+        self.record = torch.profiler.record_function(name) if perf._profiler is not None else None
+
+    def __enter__(self):
+        if self.record is not None:
+            self.record.__enter__()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.perf._add(self.name, time.perf_counter() - self.t0)
+        if self.record is not None:
+            self.record.__exit__(*exc)
+        return False
+
+
+class Perf:
+    """
+    Per-phase wall-clock timers and counters for the training loop.
+
+    `with perf.phase("learn"): ...` adds the time spent in the block to that phase,
+    `perf.count("updates")` bumps a counter. Nothing is kept per event: totals are
+    aggregated in memory and every `every` steps step() appends one record to perf.jsonl
+    (time and calls per phase, counters, steps/s, replay fill level, process RSS) and
+    starts over. Phases nest, e.g. "preprocess" is part of "env"; they are timed in the
+    thread that runs them, and only for envs stepped in this process.
+    On CUDA the timers see kernel launches, not kernel time; use the profiler window
+    (configure(profile=(start, stop))) for a torch.profiler trace of that step range,
+    in which every phase also shows up as a labelled range.
+
+    Disabled (the default), phase() returns a shared no-op context and count()/step()
+    return right away.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._profiler = None
+
+    def configure(
+        self, logdir: str, every: int, profile: Optional[Tuple[int, int]] = None, start_step: int = 0
+    ) -> None:
+        self.path = Path(logdir) / "perf.jsonl"
+        self.every = every
+        self.profile = profile
+        self.profile_dir = Path(logdir) / "profile"
+        self._lock = threading.Lock()
+        self._reset(start_step)
+        self.enabled = True
+
+    def _reset(self, step: int) -> None:
+        self._times: Dict[str, float] = {}
+        self._calls: Dict[str, int] = {}
+        self._counters: Dict[str, int] = {}
+        self._last_step = step
+        self._last_time = time.perf_counter()
+        self._next_flush = step + self.every
+
+    def phase(self, name: str):
+        if not self.enabled:
+            return _NULL
+        return _Phase(self, name)
+
+    def _add(self, name: str, dt: float) -> None:
+        with self._lock:
+            self._times[name] = self._times.get(name, 0.0) + dt
+            self._calls[name] = self._calls.get(name, 0) + 1
+
+    def count(self, name: str, n: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def step(self, step: int, replay=None) -> None:
+        """Called once per loop iteration with the env step count; flushes and drives the profiler."""
+        if not self.enabled:
+            return
+        if self.profile is not None:
+            self._profile_step(step)
+        if step >= self._next_flush:
+            self.flush(step, replay)
+
+    def flush(self, step: int, replay=None) -> None:
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            if not self._times and not self._counters:
+                return  # nothing happened since the last record
+            times, calls, counters = self._times, self._calls, self._counters
+            elapsed, steps = now - self._last_time, step - self._last_step
+            self._reset(step)
+        record = {
+            "step": step,
+            "elapsed_s": elapsed,
+            "steps_per_s": steps / elapsed if elapsed > 0 else 0.0,
+            "phases": {
+                name: {"total_s": t, "calls": calls[name], "mean_ms": 1e3 * t / calls[name], "share": t / elapsed}
+                for name, t in sorted(times.items(), key=lambda kv: -kv[1])
+            },
+            "counters": counters,
+            "rss_mb": _rss_mb(),
+        }
+        if replay is not None:
+            record["replay_size"] = replay.size
+            record["replay_fill"] = replay.size / replay.capacity
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _profile_step(self, step: int) -> None:
+        start, stop = self.profile
+        if self._profiler is None and start <= step < stop:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._profiler = torch.profiler.profile(activities=activities, record_shapes=True)
+            self._profiler.__enter__()
+            self._profile_start = step
+        elif self._profiler is not None and step >= stop:
+            self.close_profiler(step)
+
+    def close_profiler(self, step: int) -> None:
+        if self._profiler is None:
+            return
+        profiler, self._profiler = self._profiler, None
+        profiler.__exit__(None, None, None)
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        trace = self.profile_dir / f"trace_{self._profile_start}_{step}.json"
+        profiler.export_chrome_trace(str(trace))
+        print(f"Profiler trace of steps {self._profile_start}-{step} written to {trace}.")
+        self.profile = None
+
+
+def _rss_mb() -> float:
+    """Current resident set size of this process (Linux), else the peak from getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+perf = Perf()  # process-wide; train.main configures it with --perf-every
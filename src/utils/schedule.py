@@ -9,6 +9,14 @@ class Schedule(ABC):
         ...
 
 
+class ConstantSchedule(Schedule):
+    def __init__(self, value: float):
+        self._value = value
+
+    def value(self, t: int) -> float:
+        return self._value
+
+
 class LinearSchedule(Schedule):
     def __init__(self, start: float, end: float, decay_steps: int):
         self.start = start
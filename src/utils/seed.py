@@ -13,4 +13,44 @@ def set_seed_everywhere(seed: int) -> None:
     torch.cuda.manual_seed_all(seed + 3)
     os.environ["PYTHONHASHSEED"] = str(seed)
     # Make CUDA deterministic where possible
-    torch.backends.cudnn.deterministic = False  # allow perf
\ No newline at end of file
+    torch.backends.cudnn.deterministic = False  # allow perf
+
+
+def get_rng_state() -> dict:
+    """State of every RNG set_seed_everywhere seeds, for checkpoints."""
+    state = {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state: dict) -> None:
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+class RNGStream:
+    """
+    A saved set of global RNG states to switch to and back: `with stream: ...` runs the
+    block on this stream's RNGs and remembers where it left off. Lets several seeds
+    share one process while each draws the same numbers as it would running alone.
+    Starts from the current global state.
+    """
+
+    def __init__(self):
+        self.state = get_rng_state()
+        self._outer = None
+
+    def __enter__(self):
+        self._outer = get_rng_state()
+        set_rng_state(self.state)
+        return self
+
+    def __exit__(self, *exc):
+        self.state = get_rng_state()
+        set_rng_state(self._outer)
+        self._outer = None
+        return False
@@ -0,0 +1,264 @@
+import multiprocessing as mp
+import signal
+import sys
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.crafter_wrapper import make_crafter
+from src.utils import log_sink
+from src.utils.perf import perf
+from src.world_pool import WorldPool, WorldStream
+
+
+class _EnvRunner:
+    """
+    One preprocessed Crafter instance that keeps its frame stack in `stack`, a
+    [C, 84, 84] uint8 view owned by the caller (a row of the shared observation array).
+    With auto_reset, the last stack of a finished episode is copied to `final` and a new
+    episode starts right away. With `worlds` the worlds come pre-generated from a WorldPool.
+    `stats` are make_crafter's logging options (log_interval, stats_binary).
+    """
+
+    def __init__(
+        self,
+        mode,
+        logdir,
+        seed,
+        stack: np.ndarray,
+        final: np.ndarray,
+        auto_reset: bool = True,
+        worlds: Optional[WorldStream] = None,
+        stats: Optional[dict] = None,
+    ):
+        self.mode = mode
+        self.logdir = logdir
+        self.worlds = worlds
+        self.stats = stats or {}
+        self.env = make_crafter(mode, logdir, seed, worlds, **self.stats)
+        self.stack = stack
+        self.final = final
+        self.auto_reset = auto_reset
+
+    def _push(self, frame: np.ndarray) -> None:
+        self.stack[:-1] = self.stack[1:]
+        self.stack[-1] = frame
+
+    def reset(self, seed: Optional[int] = None) -> None:
+        if seed is not None:
+            # fresh Crafter: its first episode is a pure function of `seed`
+            self.close()
+            self.env = make_crafter(self.mode, self.logdir, seed, self.worlds, **self.stats)
+        with perf.phase("env_reset"):
+            frame = self.env.reset()
+        self.stack[:] = 0  # same zero padding as Env.reset
+        self.stack[-1] = frame
+
+    def step(self, action: int) -> Tuple[float, bool, dict]:
+        frame, reward, done, info = self.env.step(action)
+        self._push(frame)
+        info.pop("semantic", None)  # 64x64 map, not worth sending back every step
+        if done and self.auto_reset:
+            self.final[:] = self.stack
+            self.reset()
+        return reward, done, info
+
+    def flush(self) -> None:
+        """Write the env's buffered stats now."""
+        if hasattr(self.env, "flush"):
+            self.env.flush()
+
+    def close(self) -> None:
+        """Flush the env's buffered stats."""
+        if hasattr(self.env, "close"):
+            self.env.close()
+
+
+def _worker(remote, parent_remote, runner_args, obs_buf, final_buf, shape):
+    parent_remote.close()
+    # terminate() (e.g. the parent exiting without close()) still goes through the finally below
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    index, mode, logdir, seed, auto_reset, worlds, stats = runner_args
+    obs = np.frombuffer(obs_buf, dtype=np.uint8).reshape(shape)
+    final = np.frombuffer(final_buf, dtype=np.uint8).reshape(shape)
+    runner = None
+    try:
+        runner = _EnvRunner(mode, logdir, seed, obs[index], final[index], auto_reset, worlds, stats)
+        while True:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                remote.send(runner.step(data))
+            elif cmd == "reset":
+                runner.reset(data)
+                remote.send(None)
+            elif cmd == "flush":
+                runner.flush()
+                remote.send(None)
+            elif cmd == "close":
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # workers leave through os._exit, which skips the sinks' atexit flush
+        if runner is not None:
+            runner.close()
+        log_sink.close_all()
+        remote.close()
+
+
+class VecEnv:
+    """
+    N Crafter environments stepped in lockstep.
+
+    With `num_workers > 0` every env runs in its own worker process and writes its uint8
+    frame stack straight into a shared-memory array, so only actions, rewards, dones and
+    infos cross the pipes. `num_workers=0` steps the envs in this process (no IPC), which is
+    what a single env should use.
+
+    step(actions) -> (obs[N, C, 84, 84] uint8, rewards[N], dones[N], infos)
+    Finished envs are reset automatically: obs holds the first stack of the new episode
+    and infos[i]["final_obs"] the last stack of the finished one.
+    Per-env seeds default to draws from np.random, i.e. follow the run seed.
+
+    With auto_reset=False finished envs keep their last stack until `reset(indices, seeds)`,
+    and `step(actions, mask)` only steps the envs selected by the mask (evaluation pools).
+
+    With `reset_workers > 0` a WorldPool of that many processes generates the worlds of the
+    next `reset_depth` episodes of every env in the background, so an auto-reset only swaps
+    a ready world in; episodes are the same as without it.
+    In train mode each env logs its episodes to stats.jsonl in `args.logdir` through a
+    LogSink flushed every `log_interval` seconds (and on close); `stats_binary` adds stats.bin.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        args,
+        num_envs: int,
+        num_workers: Optional[int] = None,
+        seeds: Optional[Sequence[int]] = None,
+        start_method: Optional[str] = None,
+        auto_reset: bool = True,
+        reset_workers: int = 0,
+        reset_depth: int = 2,
+        log_interval: float = log_sink.FLUSH_INTERVAL,
+        stats_binary: bool = False,
+    ):
+        self.num_envs = num_envs
+        self.num_workers = num_envs if num_workers is None else num_workers
+        assert self.num_workers in (0, num_envs), "one worker per env, or 0 for in-process"
+        if seeds is None:
+            seeds = np.random.randint(0, 2**31 - 1, size=num_envs)
+        assert len(seeds) == num_envs
+        self.seeds = [int(s) for s in seeds]
+        shape = (num_envs, args.history_length, 84, 84)
+        self.auto_reset = auto_reset
+        self.closed = False
+        self.pool = WorldPool(num_envs, reset_workers, reset_depth, start_method) if reset_workers > 0 else None
+        streams = [self.pool.stream(i) if self.pool is not None else None for i in range(num_envs)]
+        stats = {"log_interval": log_interval, "stats_binary": stats_binary}
+
+        if self.num_workers == 0:
+            self._obs = np.zeros(shape, dtype=np.uint8)
+            self._final = np.zeros(shape, dtype=np.uint8)
+            self.runners = [
+                _EnvRunner(mode, args.logdir, seed, self._obs[i], self._final[i], auto_reset, streams[i], stats)
+                for i, seed in enumerate(self.seeds)
+            ]
+            self.action_space = self.runners[0].env.action_space
+            return
+
+        ctx = mp.get_context(start_method)
+        size = int(np.prod(shape))
+        obs_buf, final_buf = ctx.RawArray("B", size), ctx.RawArray("B", size)
+        self._obs = np.frombuffer(obs_buf, dtype=np.uint8).reshape(shape)
+        self._final = np.frombuffer(final_buf, dtype=np.uint8).reshape(shape)
+        self.remotes, self.processes = [], []
+        for i, seed in enumerate(self.seeds):
+            remote, work_remote = ctx.Pipe()
+            proc = ctx.Process(
+                target=_worker,
+                args=(
+                    work_remote,
+                    remote,
+                    (i, mode, args.logdir, seed, auto_reset, streams[i], stats),
+                    obs_buf,
+                    final_buf,
+                    shape,
+                ),
+                daemon=True,
+            )
+            proc.start()
+            work_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(proc)
+        self.action_space = make_crafter("eval", None, 0).action_space
+
+    def reset(self, indices: Optional[Sequence[int]] = None, seeds: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Reset all envs, or only `indices`; `seeds` (one per index) restart them on new worlds."""
+        indices = range(self.num_envs) if indices is None else [int(i) for i in indices]
+        seeds = [None] * len(indices) if seeds is None else [int(s) for s in seeds]
+        if self.num_workers == 0:
+            for i, seed in zip(indices, seeds):
+                self.runners[i].reset(seed)
+        else:
+            for i, seed in zip(indices, seeds):
+                self.remotes[i].send(("reset", seed))
+            for i in indices:
+                self.remotes[i].recv()
+        return self._obs.copy()
+
+    def step(
+        self, actions: Sequence[int], mask: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[dict]]:
+        active = range(self.num_envs) if mask is None else np.flatnonzero(mask)
+        results = [(0.0, False, {}) for _ in range(self.num_envs)]
+        if self.num_workers == 0:
+            for i in active:
+                results[i] = self.runners[i].step(int(actions[i]))
+        else:
+            for i in active:
+                self.remotes[i].send(("step", int(actions[i])))
+            for i in active:
+                results[i] = self.remotes[i].recv()
+        # keep Crafter's float64 rewards so episode returns sum up as in Env
+        rewards = np.array([r[0] for r in results], dtype=np.float64)
+        dones = np.array([r[1] for r in results], dtype=bool)
+        infos = [r[2] for r in results]
+        if self.auto_reset:
+            for i in np.flatnonzero(dones):
+                infos[i]["final_obs"] = self._final[i].copy()
+        return self._obs.copy(), rewards, dones, infos
+
+    def flush_logs(self) -> None:
+        """Append every env's buffered episode stats now; returns once they are on disk."""
+        if self.num_workers == 0:
+            for runner in self.runners:
+                runner.flush()
+            return
+        for remote in self.remotes:
+            remote.send(("flush", None))
+        for remote in self.remotes:
+            remote.recv()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.num_workers == 0:
+            for runner in self.runners:
+                runner.close()
+            if self.pool is not None:
+                self.pool.close()
+            return
+        for remote in self.remotes:
+            try:
+                remote.send(("close", None))
+            except (BrokenPipeError, EOFError):
+                pass
+        for proc in self.processes:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        if self.pool is not None:
+            self.pool.close()
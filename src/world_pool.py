@@ -0,0 +1,142 @@
+import multiprocessing as mp
+import queue
+from typing import Dict, List, Optional, Tuple
+
+import crafter
+from crafter import constants, engine, objects, worldgen
+
+AREA = (64, 64)
+
+
+def world_seed(seed: int, episode: int) -> int:
+    """Seed crafter.Env.reset gives the world of `episode` (1-based) of an env created with `seed`."""
+    return hash((int(seed), int(episode))) % (2**31 - 1)
+
+
+def generate_world(seed: int, episode: int, area: Tuple[int, int] = AREA) -> Tuple[engine.World, objects.Player]:
+    """The world and player crafter.Env(seed=seed).reset() would build for `episode`, step for step."""
+    world = engine.World(area, constants.materials, (12, 12))
+    world.reset(seed=world_seed(seed, episode))
+    player = objects.Player(world, (area[0] // 2, area[1] // 2))
+    world.add(player)
+    worldgen.generate_world(world, player)
+    return world, player
+
+
+def _generator(tasks, results) -> None:
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            stream, seed, episode = task
+            # world and player go through one pickle, so the objects keep pointing at this world
+            results[stream].put((seed, episode, generate_world(seed, episode)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for q in results:
+            q.cancel_join_thread()  # nobody may read the worlds generated ahead any more
+
+
+class WorldStream:
+    """
+    One env's end of a WorldPool. start(seed) asks for the first `depth` episodes of a
+    crafter env with that seed; get(seed, episode) returns that episode's world (waiting
+    for it if it is not ready yet) and asks for the one `depth` episodes further on.
+    Worlds of an earlier seed still in flight after a restart are dropped. Picklable
+    into worker processes at their creation.
+    """
+
+    def __init__(self, index: int, tasks, results, depth: int):
+        self.index = index
+        self.tasks = tasks
+        self.results = results
+        self.depth = depth
+        self.seed = None
+        self._ready: Dict[int, Tuple[engine.World, objects.Player]] = {}
+
+    def start(self, seed: int) -> None:
+        self.seed = int(seed)
+        self._ready.clear()
+        for episode in range(1, self.depth + 1):
+            self.tasks.put((self.index, self.seed, episode))
+
+    def get(self, seed: int, episode: int) -> Tuple[engine.World, objects.Player]:
+        if int(seed) != self.seed:
+            self.start(seed)
+        while episode not in self._ready:
+            got_seed, got_episode, world = self.results.get()
+            if got_seed == self.seed and got_episode >= episode:
+                self._ready[got_episode] = world
+        self.tasks.put((self.index, self.seed, episode + self.depth))
+        return self._ready.pop(episode)
+
+
+class PooledCrafter(crafter.Env):
+    """
+    crafter.Env whose reset() swaps in a world pre-generated by a WorldStream instead of
+    generating it in place. The world of each (seed, episode) is the one crafter.Env
+    would generate, so episodes stay identical to an unpooled env with the same seed.
+    """
+
+    def __init__(self, worlds: WorldStream, **kwargs):
+        super().__init__(area=AREA, **kwargs)
+        self._worlds = worlds
+        worlds.start(self._seed)
+
+    def reset(self):
+        self._episode += 1
+        self._step = 0
+        world, player = self._worlds.get(self._seed, self._episode)
+        # the views render whichever world they hold, so repoint them too
+        self._world = self._local_view._world = self._sem_view._world = world
+        self._update_time()
+        self._player = player
+        self._last_health = player.health
+        self._unlocked = set()
+        return self._obs()
+
+
+class WorldPool:
+    """
+    `num_workers` processes generating Crafter worlds ahead of time for `num_streams` envs,
+    `depth` episodes ahead of each. Hand stream(i) to env i (make_crafter(..., worlds=...)).
+    Generation is pure Python, so the pool pays off where the processes get cores of their
+    own or run while the envs wait (e.g. on the learner).
+    """
+
+    def __init__(self, num_streams: int, num_workers: int, depth: int = 2, start_method: Optional[str] = None):
+        assert num_workers > 0 and depth > 0
+        ctx = mp.get_context(start_method)
+        self.tasks = ctx.Queue()
+        self.results = [ctx.Queue() for _ in range(num_streams)]
+        self.depth = depth
+        self.processes: List[mp.Process] = []
+        for _ in range(num_workers):
+            proc = ctx.Process(target=_generator, args=(self.tasks, self.results), daemon=True)
+            proc.start()
+            self.processes.append(proc)
+        self.closed = False
+
+    def stream(self, index: int) -> WorldStream:
+        return WorldStream(index, self.tasks, self.results[index], self.depth)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        # drop the queued requests so the workers see the sentinels right away
+        try:
+            while True:
+                self.tasks.get_nowait()
+        except queue.Empty:
+            pass
+        for _ in self.processes:
+            self.tasks.put(None)
+        for proc in self.processes:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        for q in self.results:
+            q.cancel_join_thread()
+        self.closed = True
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local hyperparameter sweeps over train.py on a core-pinned process pool.
+
+A spec (JSON) gives the train.py options shared by all runs, the ones to vary and the seeds:
+
+    {
+      "base":   {"steps": 200000, "eval_interval": 25000},
+      "grid":   {"lr": [0.0001, 0.00025], "n_step": [1, 3]},
+      "random": {"trials": 8, "seed": 0, "params": {"gamma": ["uniform", 0.98, 0.999],
+                                                     "batch_size": ["choice", [32, 64, 128]]}},
+      "seeds":  [0, 1, 2]
+    }
+
+Keys are train.py option names (dest form). Every grid point, times every random trial if
+both are given, is one config; each (config, seed) is one job, run as `python train.py ...`
+with --logdir <out>/<config>/<seed>, so a config dir reads like an agent dir in analysis/.
+Random params: ["uniform", lo, hi], ["loguniform", lo, hi], ["randint", lo, hi] (inclusive)
+or ["choice", [values]].
+
+Each job gets a disjoint set of CPUs (one per env worker, at least one, or --cores-per-job)
+with torch threads and OMP_NUM_THREADS to match, and only starts while its estimated RAM
+(process, env workers, replay) fits the --ram-gb budget; when the next job does not fit,
+smaller ones behind it start first, so no core idles while work is left. <out>/index.json
+records every job's state and final eval. Rerunning the same command skips finished jobs
+and restarts interrupted ones, from their checkpoint if the config sets
+--checkpoint-interval, else from scratch. <out>/results.csv lists every job.
+
+    python sweep.py scripts/sweep_example.json --out logdir/sweeps/example
+    python sweep.py scripts/sweep_example.json --out logdir/sweeps/example --dry-run
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import pickle
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import torch
+
+import train
+from src.utils.checkpoint import STATE
+
+ROOT = Path(__file__).resolve().parent
+INDEX = "index.json"
+GB = 1024**3
+# stack bytes over stored bytes (objects included) per transition of --replay-storage
+# compressed, measured on random-play Crafter with benchmarks/bench_codec.py
+CODEC_RATIO = {"zlib": 7.0, "lz4": 5.9, "delta+zlib": 8.4, "delta+lz4": 6.0}
+
+
+def parse_cpus(text: str) -> List[int]:
+    """'0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]."""
+    cpus = []
+    for part in text.split(","):
+        lo, _, hi = part.partition("-")
+        cpus.extend(range(int(lo), int(hi or lo) + 1))
+    return sorted(set(cpus))
+
+
+def available_ram_gb() -> float:
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024 / GB
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / GB
+
+
+def sample_param(rng: np.random.Generator, dist: list):
+    kind, *args = dist
+    if kind == "uniform":
+        return float(rng.uniform(args[0], args[1]))
+    if kind == "loguniform":
+        return float(math.exp(rng.uniform(math.log(args[0]), math.log(args[1]))))
+    if kind == "randint":
+        return int(rng.integers(args[0], args[1] + 1))
+    if kind == "choice":
+        return args[0][int(rng.integers(len(args[0])))]
+    raise ValueError(f"Unknown distribution {kind!r}, expected uniform, loguniform, randint or choice")
+
+
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    if isinstance(value, (list, tuple)):
+        return "-".join(_fmt(v) for v in value)
+    return str(value).replace("/", "_")
+
+
+def expand(spec: dict) -> List[Tuple[str, dict]]:
+    """(name, overrides) of every config: grid points x random trials."""
+    grid = spec.get("grid", {})
+    points = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    trials = [{}]
+    if "random" in spec:
+        rnd = spec["random"]
+        rng = np.random.default_rng(rnd.get("seed", 0))
+        trials = [{k: sample_param(rng, d) for k, d in rnd["params"].items()} for _ in range(rnd["trials"])]
+    configs = []
+    for point, (i, trial) in itertools.product(points, enumerate(trials)):
+        overrides = {**point, **trial}
+        name = ",".join(f"{k}={_fmt(v)}" for k, v in overrides.items())
+        if "random" in spec:
+            name = f"trial{i:03d}" + ("," + name if name else "")
+        configs.append((name or "base", overrides))
+    return configs
+
+
+def to_argv(options: dict) -> List[str]:
+    argv = []
+    for key, value in options.items():
+        flag = "--" + key.replace("_", "-")
+        if value is True:
+            argv.append(flag)
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, (list, tuple)):
+            argv += [flag] + [str(v) for v in value]
+        else:
+            argv += [flag, str(value)]
+    return argv
+
+
+def env_workers(opt) -> int:
+    """Env worker processes of a run: one per env once there is more than one (per actor thread)."""
+    if opt.actor_processes > 0:
+        return 0  # actor processes step their envs in-process
+    envs = opt.num_envs * max(1, opt.actors)
+    return envs if opt.num_envs > 1 else 0
+
+
+def reset_workers(opt) -> int:
+    """World generator processes of a run (--reset-workers per VecEnv)."""
+    return opt.reset_workers * max(1, opt.actors)
+
+
+def job_cores(opt) -> int:
+    """
+    Cores a run keeps busy: its env workers (the learner uses them while they wait) or one,
+    plus helpers and actor processes, which never wait for the learner.
+    """
+    return max(1, env_workers(opt)) + opt.actor_processes + reset_workers(opt) + int(opt.eval_process)
+
+
+def replay_bytes(opt) -> int:
+    """Host memory of the replay arrays and segment trees at full capacity."""
+    if opt.replay_backend == "torch" and not opt.cpu and torch.cuda.is_available():
+        return 0  # on the GPU
+    capacity, history = opt.replay_size, opt.history_length
+    scalars = 8 + 4 + 4 + 4  # action, reward, done, priority
+    if opt.replay_storage == "frames":
+        per_slot = 84 * 84 + 2 * history * 4 + 4 + 1 + scalars  # frame, obs/next idx, succ, has_transition
+    elif opt.replay_storage == "compressed":
+        per_slot = int(2 * history * 84 * 84 / CODEC_RATIO[opt.replay_codec]) + scalars
+    else:
+        per_slot = 2 * history * 84 * 84 + scalars
+    trees = 2 * 2 * (1 << (capacity - 1).bit_length()) * 8  # sum and max tree, float64
+    return capacity * per_slot + trees
+
+
+def estimate_ram_gb(opt, process_gb: float, worker_gb: float) -> float:
+    processes = process_gb * (1 + int(opt.eval_process))
+    workers = env_workers(opt) + reset_workers(opt) + opt.actor_processes
+    return processes + worker_gb * workers + replay_bytes(opt) / GB
+
+
+def read_evals(path: Path) -> List[dict]:
+    records = []
+    if path.exists():
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    records.append(pickle.load(f))
+                except (EOFError, pickle.UnpicklingError):
+                    break
+    return records
+
+
+def build_jobs(spec: dict, out: Path, args) -> List[dict]:
+    base = dict(spec.get("base", {}))
+    if "seeds" in base or "logdir" in base:
+        raise SystemExit("The sweep sets --seed and --logdir per job; leave seeds/logdir out of 'base'")
+    jobs = []
+    for name, overrides in expand(spec):
+        for seed in spec.get("seeds", [0]):
+            options = {**base, **overrides, "seed": seed, "logdir": str(out / name / str(seed))}
+            resume = options.get("checkpoint_interval", 0) > 0
+            if resume:
+                options["resume"] = True  # starts from scratch when there is no checkpoint yet
+            opt = train.get_options(to_argv(options))
+            checkpoint_dir = opt.checkpoint_dir or str(Path(opt.logdir) / "checkpoint")
+            cores = args.cores_per_job or job_cores(opt)
+            options["threads"] = cores
+            jobs.append(
+                {
+                    "id": f"{name}/{seed}",
+                    "config": name,
+                    "seed": seed,
+                    "overrides": overrides,
+                    "argv": to_argv(options),
+                    "logdir": options["logdir"],
+                    "resume": resume,
+                    "checkpoint_dir": checkpoint_dir,
+                    "cores_needed": cores,
+                    "ram_gb": round(estimate_ram_gb(opt, args.process_gb, args.worker_gb), 3),
+                    "status": "pending",
+                }
+            )
+    return jobs
+
+
+class Scheduler:
+    """
+    Runs the jobs as train.py subprocesses, each in its own session and pinned to its
+    cores, while cores and the RAM budget allow; keeps <out>/index.json up to date.
+    """
+
+    def __init__(self, out: Path, spec: dict, jobs: List[dict], cpus: List[int], ram_gb: float, poll: float = 1.0):
+        self.out = out
+        self.spec = spec
+        self.jobs = jobs
+        self.cpus = cpus
+        self.ram_gb = ram_gb
+        self.poll = poll
+        self.busy_core_s = 0.0
+
+    def save(self) -> None:
+        index = {"spec": self.spec, "cpus": self.cpus, "ram_gb": self.ram_gb, "jobs": self.jobs}
+        tmp = self.out / (INDEX + ".tmp")
+        tmp.write_text(json.dumps(index, indent=1))
+        os.replace(tmp, self.out / INDEX)
+
+    def _launch(self, job: dict, cores: List[int]) -> subprocess.Popen:
+        logdir = Path(job["logdir"])
+        if not (job["resume"] and (Path(job["checkpoint_dir"]) / STATE).exists()):
+            shutil.rmtree(logdir, ignore_errors=True)  # leftovers of an attempt with nothing to resume
+        logdir.mkdir(parents=True, exist_ok=True)
+        threads = str(len(cores))
+        env = dict(os.environ, OMP_NUM_THREADS=threads, MKL_NUM_THREADS=threads)
+        with open(logdir / "train.log", "ab") as log:
+            proc = subprocess.Popen(
+                [sys.executable, str(ROOT / "train.py")] + job["argv"],
+                cwd=ROOT,
+                env=env,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,  # a process group of its own, env workers included
+                preexec_fn=lambda: os.sched_setaffinity(0, cores),  # inherited by the env workers
+            )
+        job.update(status="running", cores=cores, started=time.time(), returncode=None)
+        print(f"[sweep] start  {job['id']} on cpus {cores}")
+        return proc
+
+    def _finish(self, job: dict, returncode: int) -> None:
+        job.update(status="done" if returncode == 0 else "failed", returncode=returncode, finished=time.time())
+        job["wall_s"] = round(job["finished"] - job["started"], 1)
+        self.busy_core_s += job["wall_s"] * len(job["cores"])
+        evals = read_evals(Path(job["logdir"]) / "eval_stats.pkl")
+        if evals:
+            job.update(
+                final_step=evals[-1]["step"],
+                final_return=evals[-1]["avg_return"],
+                best_return=max(e["avg_return"] for e in evals),
+            )
+        ret = f", final return {job['final_return']:.2f}" if evals else ""
+        print(f"[sweep] {job['status']:<6} {job['id']} after {job['wall_s']:.0f}s (exit {returncode}){ret}")
+
+    def run(self) -> None:
+        pending = [j for j in self.jobs if j["status"] == "pending"]
+        running: Dict[str, Tuple[dict, subprocess.Popen]] = {}
+        free, ram_free = list(self.cpus), self.ram_gb
+        t0 = time.time()
+        signal.signal(signal.SIGTERM, signal.default_int_handler)  # kill / a job scheduler: stop like Ctrl-C
+        try:
+            while pending or running:
+                for job in list(pending):
+                    # in order; a job that does not fit lets smaller ones behind it go first
+                    if job["cores_needed"] <= len(free) and job["ram_gb"] <= ram_free:
+                        cores, free = free[: job["cores_needed"]], free[job["cores_needed"] :]
+                        ram_free -= job["ram_gb"]
+                        running[job["id"]] = (job, self._launch(job, cores))
+                        pending.remove(job)
+                self.save()
+                time.sleep(self.poll)
+                for key, (job, proc) in list(running.items()):
+                    if proc.poll() is None:
+                        continue
+                    del running[key]
+                    self._finish(job, proc.returncode)
+                    free = sorted(free + job["cores"])
+                    ram_free += job["ram_gb"]
+        except KeyboardInterrupt:
+            print(f"[sweep] interrupted, stopping {len(running)} job(s); rerun to continue")
+            for job, proc in running.values():
+                os.killpg(proc.pid, signal.SIGTERM)
+            for job, proc in running.values():
+                try:
+                    proc.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                job["status"] = "pending"
+            self.save()
+            raise SystemExit(130)
+        self.save()
+        wall = time.time() - t0
+        if wall > 0 and self.busy_core_s > 0:
+            busy = self.busy_core_s / (wall * len(self.cpus))
+            print(f"[sweep] {wall:.0f}s, cores busy {100 * busy:.0f}% of the time")
+
+
+def write_results(out: Path, jobs: List[dict]) -> None:
+    keys = sorted({k for j in jobs for k in j["overrides"]})
+    with open(out / "results.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ["id", "config", "seed", "status", "wall_s", "final_step", "final_return", "best_return"] + keys
+        )
+        for j in jobs:
+            row = [j["id"], j["config"], j["seed"], j["status"], j.get("wall_s"), j.get("final_step")]
+            row += [j.get("final_return"), j.get("best_return")] + [j["overrides"].get(k) for k in keys]
+            writer.writerow(row)
+    finals: Dict[str, List[float]] = {}
+    for j in jobs:
+        if j.get("final_return") is not None:
+            finals.setdefault(j["config"], []).append(j["final_return"])
+    for config, values in sorted(finals.items(), key=lambda kv: -np.mean(kv[1])):
+        print(f"  {np.mean(values):8.2f} ± {np.std(values):5.2f}  ({len(values)} seeds)  {config}")
+    print(f"Wrote {out / 'results.csv'}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("spec", help="JSON sweep spec, see the module docstring.")
+    parser.add_argument(
+        "--out", required=True, help="Sweep dir: <out>/<config>/<seed> logdirs, index.json, results.csv."
+    )
+    parser.add_argument("--cpus", default=None, help="CPUs to use, e.g. 0-15 (default: this process' affinity).")
+    parser.add_argument("--cores-per-job", type=int, default=None, help="Default: one per env worker, at least one.")
+    parser.add_argument("--ram-gb", type=float, default=None, help="RAM budget (default: 90%% of MemAvailable).")
+    parser.add_argument("--process-gb", type=float, default=1.0, help="RAM of a train.py process besides its replay.")
+    parser.add_argument("--worker-gb", type=float, default=0.3, help="RAM of an env worker process.")
+    parser.add_argument("--retry-failed", action="store_true", help="Run failed jobs again.")
+    parser.add_argument("--poll", type=float, default=1.0, help="Seconds between job status checks.")
+    parser.add_argument("--dry-run", action="store_true", help="Print the jobs and their resources, run nothing.")
+    args = parser.parse_args()
+
+    spec = json.loads(Path(args.spec).read_text())
+    out = Path(args.out)
+    cpus = parse_cpus(args.cpus) if args.cpus else sorted(os.sched_getaffinity(0))
+    ram_gb = args.ram_gb if args.ram_gb is not None else 0.9 * available_ram_gb()
+    jobs = build_jobs(spec, out, args)
+    too_big = [j for j in jobs if j["cores_needed"] > len(cpus) or j["ram_gb"] > ram_gb]
+
+    # carry over the state of jobs an earlier run of this sweep already knows (same command line)
+    if (out / INDEX).exists():
+        previous = {j["id"]: j for j in json.loads((out / INDEX).read_text())["jobs"]}
+        for job in jobs:
+            old = previous.get(job["id"])
+            if old is not None and old["argv"] == job["argv"]:
+                if old["status"] == "done" or (old["status"] == "failed" and not args.retry_failed):
+                    job.update(old)
+    todo = [j for j in jobs if j["status"] == "pending"]
+    print(f"[sweep] {len(jobs)} jobs, {len(todo)} to run on {len(cpus)} cpus with {ram_gb:.1f} GB")
+
+    if args.dry_run:
+        for job in jobs:
+            status = "too big" if job in too_big else job["status"]
+            print(f"  {status:<7} {job['cores_needed']:>2} cpus {job['ram_gb']:6.2f} GB  {job['id']}")
+        return
+    if too_big:
+        job = too_big[0]
+        raise SystemExit(
+            f"{job['id']} needs {job['cores_needed']} cpus and {job['ram_gb']:.1f} GB, "
+            f"the sweep has {len(cpus)} cpus and {ram_gb:.1f} GB"
+        )
+    out.mkdir(parents=True, exist_ok=True)
+    Scheduler(out, spec, jobs, cpus, ram_gb, args.poll).run()
+    write_results(out, jobs)
+
+
+if __name__ == "__main__":
+    main()
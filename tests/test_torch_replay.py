@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""The torch segment trees and replay against their numpy counterparts, on the CPU."""
+import numpy as np
+import pytest
+import torch
+
+from src.agent.replay_buffer import PrioritizedReplayBuffer, TorchPrioritizedReplayBuffer
+from src.agent.segment_tree import MaxSegmentTree, SumSegmentTree, TorchMaxSegmentTree, TorchSumSegmentTree
+
+OBS_SHAPE = (2, 3, 3)
+REPLAY = dict(capacity=13, obs_shape=OBS_SHAPE, alpha=0.6, beta_start=0.4, beta_frames=100, device="cpu")
+
+
+def _transitions(rng: np.random.Generator, k: int):
+    return (
+        rng.integers(0, 256, (k,) + OBS_SHAPE, dtype=np.uint8),
+        rng.integers(0, 17, k),
+        rng.normal(size=k).astype(np.float32),
+        rng.integers(0, 256, (k,) + OBS_SHAPE, dtype=np.uint8),
+        (rng.random(k) < 0.2).astype(np.float32),
+    )
+
+
+@pytest.mark.parametrize("capacity", [1, 7, 8, 100])
+def test_segment_trees_match(capacity):
+    rng = np.random.default_rng(capacity)
+    sums, maxes = SumSegmentTree(capacity), MaxSegmentTree(capacity)
+    torch_sums, torch_maxes = TorchSumSegmentTree(capacity, "cpu"), TorchMaxSegmentTree(capacity, "cpu")
+    for _ in range(5):
+        idx = rng.integers(0, capacity, 2 * capacity)  # with duplicates
+        values = rng.random(len(idx))
+        for tree, torch_tree in ((sums, torch_sums), (maxes, torch_maxes)):
+            tree[idx] = values
+            torch_tree[torch.from_numpy(idx)] = torch.from_numpy(values)
+            np.testing.assert_allclose(torch_tree.tree.numpy(), tree.tree)
+        assert torch_sums.sum().item() == pytest.approx(sums.sum())
+        assert torch_maxes.max().item() == maxes.max()
+
+        prefix = rng.random(64) * sums.sum()
+        np.testing.assert_array_equal(
+            torch_sums.find_prefixsum_idx(torch.from_numpy(prefix)).numpy(), sums.find_prefixsum_idx(prefix)
+        )
+
+
+def _replays():
+    return PrioritizedReplayBuffer(**REPLAY), TorchPrioritizedReplayBuffer(**REPLAY)
+
+
+def _assert_same_state(replay: PrioritizedReplayBuffer, torch_replay: TorchPrioritizedReplayBuffer):
+    assert (torch_replay.pos, torch_replay.full, torch_replay.size) == (replay.pos, replay.full, replay.size)
+    for name in ("obs", "next_obs", "actions", "rewards", "dones", "priorities"):
+        np.testing.assert_array_equal(getattr(torch_replay, name).numpy(), getattr(replay, name), err_msg=name)
+    # p^alpha: numpy and torch float32 pow may differ in the last bit
+    np.testing.assert_allclose(torch_replay.sum_tree.tree.numpy(), replay.sum_tree.tree, rtol=1e-6)
+    np.testing.assert_array_equal(torch_replay.max_tree.tree.numpy(), replay.max_tree.tree)
+
+
+def test_add_batch_wraps_around_like_numpy():
+    rng = np.random.default_rng(0)
+    replay, torch_replay = _replays()
+    for k in (5, 6, 4, 13, 9):  # wraps in the third batch, a full-capacity batch, then again
+        batch = _transitions(rng, k)
+        replay.add_batch(*batch)
+        torch_replay.add_batch(*batch)
+        _assert_same_state(replay, torch_replay)
+    assert replay.full
+
+
+def test_update_priorities_like_numpy():
+    rng = np.random.default_rng(1)
+    replay, torch_replay = _replays()
+    batch = _transitions(rng, 10)
+    replay.add_batch(*batch)
+    torch_replay.add_batch(*batch)
+    for td_shape in ((6,), (6, 4)):  # per-sample errors and [B, N] quantile errors
+        indices = rng.integers(0, replay.size, 6)
+        td_errors = rng.normal(size=td_shape).astype(np.float32)
+        replay.update_priorities(indices, td_errors)
+        torch_replay.update_priorities(torch.from_numpy(indices), torch.from_numpy(td_errors))
+        _assert_same_state(replay, torch_replay)
+    # new transitions come in at the updated max priority
+    batch = _transitions(rng, 5)
+    replay.add_batch(*batch)
+    torch_replay.add_batch(*batch)
+    _assert_same_state(replay, torch_replay)
+
+
+def test_sampling_matches_given_the_same_uniforms(monkeypatch):
+    rng = np.random.default_rng(2)
+    replay, torch_replay = _replays()
+    for _ in range(3):
+        batch = _transitions(rng, 7)
+        replay.add_batch(*batch)
+        torch_replay.add_batch(*batch)
+    replay.update_priorities(np.arange(replay.size), rng.random(replay.size))
+    torch_replay.update_priorities(torch.arange(replay.size), torch.from_numpy(replay.priorities - replay.eps))
+
+    uniforms = {}
+    monkeypatch.setattr(np.random, "random_sample", lambda n: uniforms["u"])
+    monkeypatch.setattr(torch, "rand", lambda n, **kwargs: torch.from_numpy(uniforms["u"]))
+    for batch_size in (1, 8, 32):
+        uniforms["u"] = rng.random(batch_size)
+        indices, weights = replay.sample_indices(batch_size)
+        torch_indices, torch_weights = torch_replay.sample_indices(batch_size)
+        np.testing.assert_array_equal(torch_indices.numpy(), indices)
+        np.testing.assert_allclose(torch_weights.numpy(), weights, rtol=1e-6)
+    assert torch_replay.frame == replay.frame
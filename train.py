@@ -7,50 +7,57 @@ Crafter QR-DQN training script.
 - Uses GPU if available.
 """
 import argparse
-import pickle
+import copy
+import signal
+import sys
+import threading
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Dict, Tuple
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple, Union
 
+import crafter
 import numpy as np
 import torch
 import torch.nn.functional as F
+from torch.nn.utils import clip_grad_norm_
 
-from src.crafter_wrapper import Env
-from src.utils.seed import set_seed_everywhere
+from src.vec_env import VecEnv
+from src.utils.seed import RNGStream, get_rng_state, set_rng_state, set_seed_everywhere
+from src.utils.checkpoint import CheckpointWriter, load_checkpoint
+from src.utils import log_sink
+from src.utils.perf import perf
 from src.utils.schedule import LinearSchedule, CosineSchedule
 from src.agent.dqn_model import QRDuelingDQN
-from src.agent.replay_buffer import PrioritizedReplayBuffer, NStepAdder
-from src.agent.learner import quantile_huber_loss
+from src.agent.obs_codec import CODECS, make_codec
+from src.agent.replay_buffer import (
+    CompressedPrioritizedReplayBuffer,
+    FramePrioritizedReplayBuffer,
+    PrioritizedReplayBuffer,
+    TorchPrioritizedReplayBuffer,
+    VecNStepAdder,
+)
+from src.agent.learner import (
+    LossMeter,
+    MixedPrecision,
+    PriorityTransfer,
+    compute_targets,
+    fused_qr_dqn_loss,
+    quantile_huber_loss,
+)
 from src.agent.policy import GreedyPolicy, EpsGreedyPolicy
+from src.agent.actor import ActorThread, ReplayRatio, WeightStore, collect_step
+from src.agent.distributed import ActorPool
+from src.agent.prefetch import PrefetchSampler
+from src.agent.evaluator import EvalProcess, make_eval_env
+from src.agent.inference import InferenceEngine
+from src.agent.stacked import StackedQRDuelingDQN, learn_qr_dqn_stacked
 
 
-def _save_stats(episodic_returns, crt_step, path):
-    episodic_returns = torch.tensor(episodic_returns)
-    avg_return = episodic_returns.mean().item()
-    print(
-        "[{:06d}] eval results: R/ep={:03.2f}, std={:03.2f}.".format(
-            crt_step, avg_return, episodic_returns.std().item()
-        )
-    )
-    with open(path + "/eval_stats.pkl", "ab") as f:
-        pickle.dump({"step": crt_step, "avg_return": avg_return}, f)
-
-
-@torch.no_grad()
-def eval(agent: torch.nn.Module, env: Env, crt_step: int, opt) -> None:
-    """Greedy evaluation; no epsilon."""
-    agent.eval()
-    episodic_returns = []
-    greedy = GreedyPolicy(agent, opt.num_actions, opt.quantiles, device=opt.device)
-    for _ in range(opt.eval_episodes):
-        obs, done = env.reset(), False
-        episodic_returns.append(0.0)
-        while not done:
-            action = greedy.act(obs)
-            obs, reward, done, info = env.step(action)
-            episodic_returns[-1] += reward
-    _save_stats(episodic_returns, crt_step, opt.logdir)
-    agent.train()
+def _log_losses(losses: LossMeter, crt_step: int) -> None:
+    mean, count = losses.pop()
+    if count:
+        print("[{:06d}] train loss={:.4f} over {} updates.".format(crt_step, mean, count))
 
 
 def _info(opt):
@@ -65,7 +72,7 @@ def _info(opt):
         print("Warning! Logdir path exists, results can be corrupted.")
     print(f"Saving results in {opt.logdir}.")
     print(
-        f"Observations are of dims ({opt.history_length},84,84) with values in [0,1]. "
+        f"Observations are of dims ({opt.history_length},84,84) uint8, scaled to [0,1] by the network. "
         "Frame stacking handled by the provided wrapper."
     )
 
@@ -74,35 +81,99 @@ def build_optimizer(net: torch.nn.Module, lr: float) -> torch.optim.Optimizer:
     return torch.optim.Adam(net.parameters(), lr=lr, eps=1e-4)
 
 
-def compute_targets(
-    rewards: torch.Tensor,
-    dones: torch.Tensor,
-    gamma: float,
-    next_dist: torch.Tensor,
-) -> torch.Tensor:
+def build_replay(opt) -> Union[PrioritizedReplayBuffer, TorchPrioritizedReplayBuffer]:
+    if opt.replay_backend == "torch":
+        if opt.replay_storage != "stack" or opt.replay_dir is not None or opt.prefetch > 0:
+            raise SystemExit(
+                "--replay-storage frames/compressed, --replay-dir and --prefetch need --replay-backend numpy"
+            )
+        if opt.checkpoint_interval > 0 or opt.resume:
+            raise SystemExit("--checkpoint-interval/--resume are not supported with --replay-backend torch")
+        # everything on the training device, sampled and updated without numpy
+        return TorchPrioritizedReplayBuffer(
+            capacity=opt.replay_size,
+            obs_shape=(opt.history_length, 84, 84),
+            alpha=opt.prior_alpha,
+            beta_start=opt.prior_beta_start,
+            beta_frames=opt.prior_beta_frames,
+            device=opt.device,
+        )
+    kwargs = dict(
+        capacity=opt.replay_size,
+        obs_shape=(opt.history_length, 84, 84),
+        alpha=opt.prior_alpha,
+        beta_start=opt.prior_beta_start,
+        beta_frames=opt.prior_beta_frames,
+        device=opt.device,
+        store_uint8=True,
+        storage_dir=opt.replay_dir,
+    )
+    if opt.replay_storage == "frames":
+        # one 84x84 frame per slot instead of two stacks, ~8x less memory
+        streams = opt.num_envs * max(1, opt.actors)
+        return FramePrioritizedReplayBuffer(n_step=opt.n_step, num_streams=streams, **kwargs)
+    if opt.replay_storage == "compressed":
+        if opt.replay_dir is not None or opt.checkpoint_interval > 0 or opt.resume:
+            raise SystemExit("--replay-storage compressed keeps the replay in memory: no --replay-dir or checkpoints")
+        del kwargs["store_uint8"], kwargs["storage_dir"]
+        return CompressedPrioritizedReplayBuffer(
+            codec=make_codec(opt.replay_codec), threads=opt.replay_codec_threads, **kwargs
+        )
+    return PrioritizedReplayBuffer(**kwargs)
+
+
+def make_train_envs(opt) -> VecEnv:
+    """--num-envs training envs: a single one is stepped in-process, more get one worker process each."""
+    return VecEnv(
+        "train",
+        opt,
+        opt.num_envs,
+        num_workers=opt.num_envs if opt.num_envs > 1 else 0,
+        reset_workers=opt.reset_workers,
+        reset_depth=opt.reset_depth,
+        log_interval=opt.log_interval,
+        stats_binary=opt.stats_binary,
+    )
+
+
+def build_engine(net: QRDuelingDQN, opt, precision: MixedPrecision) -> Optional[InferenceEngine]:
     """
-    n-step bootstrapped targets for QR-DQN.
-    rewards: [B]
-    dones:   [B] (1 if terminal at n-step boundary)
-    next_dist: [B, Ntau] distribution (already gathered w.r.t. argmax_a Q_online)
-    returns target_z: [B, Ntau]
+    Acting engine for --inference (None without it); int8 with --inference-quantize, else
+    its weights are kept in the --precision dtype.
     """
-    # When done, we should not bootstrap
-    not_done = (1.0 - dones.float()).unsqueeze(1)  # [B,1]
-    target = rewards.unsqueeze(1) + gamma * not_done * next_dist
-    return target
+    if opt.inference is None:
+        return None
+    return InferenceEngine(
+        net, opt.device, opt.inference, opt.inference_quantize, max_batch=opt.num_envs, dtype=precision.dtype
+    )
 
 
 def main(opt):
+    if opt.threads is not None:
+        torch.set_num_threads(opt.threads)
+    if opt.seeds:
+        return train_seeds(opt)
     _info(opt)
     set_seed_everywhere(opt.seed)
 
     # --- Device & envs
     opt.device = torch.device("cuda" if (torch.cuda.is_available() and not opt.cpu) else "cpu")
     torch.backends.cudnn.benchmark = True
-    env = Env("train", opt)
-    eval_env = Env("eval", opt)
-    opt.num_actions = env.action_space.n
+    precision = MixedPrecision.from_name(opt.precision, opt.device)
+    if opt.actor_processes > 0:
+        _check_actor_processes(opt)
+        actor_envs = []  # every actor process steps envs of its own
+        opt.num_actions = len(crafter.constants.actions)
+    else:
+        actor_envs = [make_train_envs(opt) for _ in range(max(1, opt.actors))]  # one VecEnv per actor thread
+        envs = actor_envs[0]
+        opt.num_actions = envs.action_space.n
+    if opt.eval_process:
+        # evaluation runs in a process of its own on published weight snapshots
+        eval_env = None
+        evaluate = EvalProcess(opt, Path(opt.logdir) / "snapshots", opt.eval_max_pending, opt.eval_cores)
+    else:
+        eval_env, evaluate = make_eval_env(opt)
 
     # --- Networks
     online = QRDuelingDQN(
@@ -114,17 +185,9 @@ def main(opt):
     target.load_state_dict(online.state_dict())
     optimizer = build_optimizer(online, opt.lr)
 
-    # --- Replay & n-step
-    replay = PrioritizedReplayBuffer(
-        capacity=opt.replay_size,
-        obs_shape=(opt.history_length, 84, 84),
-        alpha=opt.prior_alpha,
-        beta_start=opt.prior_beta_start,
-        beta_frames=opt.prior_beta_frames,
-        device=opt.device,
-        store_uint8=True,
-    )
-    nstep_adder = NStepAdder(n=opt.n_step, gamma=opt.gamma)
+    # --- Replay & n-step (one stream per env)
+    replay = build_replay(opt)
+    nstep = VecNStepAdder(opt.num_envs, opt.n_step, opt.gamma, (opt.history_length, 84, 84))
 
     # --- Exploration schedule
     if opt.eps_schedule == "linear":
@@ -134,77 +197,564 @@ def main(opt):
 
     # --- Policies
     behavior = EpsGreedyPolicy(
-        net=online, num_actions=opt.num_actions, num_quantiles=opt.quantiles, schedule=eps_sched, device=opt.device
+        net=online,
+        num_actions=opt.num_actions,
+        num_quantiles=opt.quantiles,
+        schedule=eps_sched,
+        device=opt.device,
+        engine=build_engine(online, opt, precision),
+        precision=precision,
     )
     greedy_eval = GreedyPolicy(online, opt.num_actions, opt.quantiles, device=opt.device)
 
     # --- Main loop
     Path(opt.logdir).mkdir(parents=True, exist_ok=True)
-    step_cnt, ep_cnt, done = 0, 0, True
+    if opt.actors > 0 and (opt.checkpoint_interval > 0 or opt.resume):
+        raise SystemExit("--checkpoint-interval/--resume are not supported with --actors")
+    if opt.actors > 0 or opt.actor_processes > 0:
+        if opt.perf_every > 0 or opt.profile_steps:
+            perf.configure(opt.logdir, opt.perf_every or opt.steps, opt.profile_steps)
+        if opt.actor_processes > 0:
+            step_cnt = train_distributed(opt, online, target, optimizer, replay, evaluate, eval_env, precision)
+        else:
+            step_cnt = train_async(
+                opt, actor_envs, online, target, optimizer, replay, eps_sched, evaluate, eval_env, precision
+            )
+        perf.close_profiler(step_cnt)
+        perf.flush(step_cnt, replay)
+        replay.flush()
+        if step_cnt % opt.eval_interval != 0:
+            evaluate(online, eval_env, step_cnt, opt)
+        for envs in actor_envs:
+            envs.close()
+        _close_eval(eval_env, evaluate, opt)
+        return
+
+    step_cnt, ep_cnt = 0, opt.num_envs
     obs = None
+    checkpoint_dir = opt.checkpoint_dir or str(Path(opt.logdir) / "checkpoint")
+    checkpoint = None
+    if opt.resume:
+        restored = load_checkpoint(checkpoint_dir, replay)
+        if restored is not None:
+            state, checkpoint = restored
+            online.load_state_dict(state["online"])
+            target.load_state_dict(state["target"])
+            optimizer.load_state_dict(state["optimizer"])
+            behavior.t = state["policy_t"]
+            step_cnt, ep_cnt = state["step"], state["episodes"]
+            set_rng_state(state["rng"])
+            # the in-loop evals precede the snapshot at their step, the final one follows it
+            evaluated = step_cnt if step_cnt % opt.eval_interval == 0 else step_cnt - 1
+            _trim_logs(opt.logdir, state.get("logs"), evaluated)
+            if behavior.engine is not None:
+                behavior.engine.refresh(online)
+            # env state is not checkpointed: continue on fresh worlds drawn from the restored RNG
+            obs = envs.reset(seeds=np.random.randint(0, 2**31 - 1, size=envs.num_envs))
+            ep_cnt += opt.num_envs
+            print(f"Resumed from {checkpoint_dir} at step {step_cnt}, replay size {replay.size}.")
+        else:
+            print(f"No checkpoint in {checkpoint_dir}, starting from scratch.")
+            _trim_logs(opt.logdir, {}, 0)  # whatever an earlier attempt logged is redone
+    if checkpoint is None and opt.checkpoint_interval > 0:
+        checkpoint = CheckpointWriter(checkpoint_dir, replay)
+    if opt.perf_every > 0 or opt.profile_steps:
+        perf.configure(opt.logdir, opt.perf_every or opt.steps, opt.profile_steps, start_step=step_cnt)
+    if obs is None:
+        obs = envs.reset()  # [N, C, 84, 84] uint8
+    nstep.reset(obs)
 
     # Warmup: fill some experience (with epsilon=1 behavior inside policy)
-    while replay.size < opt.warmup_steps:
-        if done:
-            ep_cnt += 1
-            obs, done = env.reset(), False
-            nstep_adder.reset(obs)
-        action = behavior.act(obs, force_random=True)  # random during warmup
-        next_obs, reward, done, info = env.step(action)
-        ready = nstep_adder.add(action, reward, next_obs, done)
-        if ready is not None:
-            # (obs0, action, Rn, next_obs_n, done_n)
-            o0, a0, Rn, on, dn = ready
-            replay.add(o0, a0, Rn, on, dn)
-        obs = next_obs
-
-    # Training
-    losses_moving = []
+    if replay.size < opt.warmup_steps:
+        while replay.size < opt.warmup_steps:
+            with perf.phase("act"):
+                actions = behavior.act_batch(obs, force_random=True)  # random during warmup
+            obs, finished = collect_step(envs, actions, nstep, replay)
+            ep_cnt += finished
+        perf.flush(step_cnt, replay)  # the warmup gets a record of its own
+
+    # Training; with --prefetch batches come from a background thread and replay writes take its lock
+    sampler = PrefetchSampler(replay, opt.batch_size, depth=opt.prefetch) if opt.prefetch > 0 else replay
+    lock = sampler.lock if opt.prefetch > 0 else None
+    losses = LossMeter(opt.device)
+    priorities = PriorityTransfer(sampler.update_priorities, opt.device, on_device=opt.replay_backend == "torch")
+    loss_fn = torch.compile(fused_qr_dqn_loss) if opt.compile else fused_qr_dqn_loss
+    gamma_n = opt.gamma**opt.n_step  # since n-step target
+
+    def save_checkpoint():
+        priorities.flush()
+        envs.flush_logs()  # so the log sizes recorded below cover every episode so far
+        state = {
+            "online": online.state_dict(),
+            "target": target.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "policy_t": behavior.t,
+            "step": step_cnt,
+            "episodes": ep_cnt,
+            "rng": get_rng_state(),
+            "logs": _log_sizes(opt.logdir),
+        }
+        with lock if lock is not None else nullcontext():
+            checkpoint.save(state)
+
+    next_checkpoint = step_cnt + opt.checkpoint_interval
+    updates = 0
     while step_cnt < opt.steps:
-        if done:
-            ep_cnt += 1
-            obs, done = env.reset(), False
-            nstep_adder.reset(obs)
-
-        # --- Act & step
-        action = behavior.act(obs)
-        next_obs, reward, done, info = env.step(action)
-        ready = nstep_adder.add(action, reward, next_obs, done)
-        if ready is not None:
-            o0, a0, Rn, on, dn = ready
-            replay.add(o0, a0, Rn, on, dn)
-        obs = next_obs
-
-        # --- Learn
-        if step_cnt % opt.train_every == 0:
-            batch = replay.sample(opt.batch_size)
-            loss, td_errors = learn_qr_dqn(
-                batch=batch,
-                online=online,
-                target=target,
-                optimizer=optimizer,
-                gamma=opt.gamma ** opt.n_step,  # since n-step target
-                quantiles=opt.quantiles,
-                kappa=opt.huber_kappa,
-                double_dqn=True,
-                grad_norm_clip=opt.grad_clip,
-            )
-            replay.update_priorities(batch["indices"], td_errors)
-            losses_moving.append(loss)
+        # --- Act & step all envs
+        with perf.phase("act"):
+            actions = behavior.act_batch(obs)
+        obs, finished = collect_step(envs, actions, nstep, replay, lock)
+        ep_cnt += finished
+
+        # --- Per env step: learn, target updates, evaluation
+        for _ in range(opt.num_envs):
+            if step_cnt % opt.train_every == 0:
+                with perf.phase("sample"):
+                    batch = sampler.sample(opt.batch_size)
+                if opt.fused_learn:
+                    with perf.phase("learn"):
+                        loss, prios = learn_qr_dqn_fused(
+                            batch,
+                            online,
+                            target,
+                            optimizer,
+                            gamma_n,
+                            opt.huber_kappa,
+                            opt.grad_clip,
+                            loss_fn,
+                            precision,
+                        )
+                    with perf.phase("priorities"):
+                        priorities.push(batch["indices"], prios)
+                else:
+                    with perf.phase("learn"):
+                        loss, td_errors = learn_qr_dqn(
+                            batch=batch,
+                            online=online,
+                            target=target,
+                            optimizer=optimizer,
+                            gamma=opt.gamma ** opt.n_step,  # since n-step target
+                            quantiles=opt.quantiles,
+                            kappa=opt.huber_kappa,
+                            double_dqn=True,
+                            grad_norm_clip=opt.grad_clip,
+                            precision=precision,
+                        )
+                    with perf.phase("priorities"):
+                        sampler.update_priorities(batch["indices"], td_errors)
+                losses.add(loss)
+                perf.count("updates")
+                updates += 1
+                if behavior.engine is not None and updates % opt.actor_sync_interval == 0:
+                    with perf.phase("engine_refresh"):
+                        behavior.engine.refresh(online)
+
+            if (step_cnt + 1) % opt.target_update_interval == 0:
+                with perf.phase("target_sync"):
+                    target.load_state_dict(online.state_dict())
 
-        # --- Target updates
-        if (step_cnt + 1) % opt.target_update_interval == 0:
-            target.load_state_dict(online.state_dict())
+            if (step_cnt + 1) % opt.eval_interval == 0:
+                _log_losses(losses, step_cnt + 1)
+                with perf.phase("replay_flush"):
+                    replay.flush()
+                with perf.phase("eval"):
+                    evaluate(online, eval_env, step_cnt + 1, opt)
 
-        # --- Evaluation
-        if (step_cnt + 1) % opt.eval_interval == 0:
-            eval(online, eval_env, step_cnt + 1, opt)
+            step_cnt += 1
+            if step_cnt >= opt.steps:
+                break
 
-        step_cnt += 1
+        if opt.checkpoint_interval > 0 and step_cnt >= next_checkpoint:
+            with perf.phase("checkpoint"):
+                save_checkpoint()
+            next_checkpoint += opt.checkpoint_interval
+        perf.step(step_cnt, replay)
 
+    perf.close_profiler(step_cnt)
+    perf.flush(step_cnt, replay)
+    priorities.flush()
+    if checkpoint is not None:
+        save_checkpoint()
+        checkpoint.wait()
+    if opt.prefetch > 0:
+        sampler.close()
+
+    replay.flush()
     # One last eval at the very end if not aligned with interval
     if step_cnt % opt.eval_interval != 0:
-        eval(online, eval_env, step_cnt, opt)
+        evaluate(online, eval_env, step_cnt, opt)
+    envs.close()
+    _close_eval(eval_env, evaluate, opt)
+
+
+TRAIN_LOGS = ("stats.jsonl", "stats.bin")  # appended by the training envs
+
+
+def _log_sizes(logdir) -> Dict[str, int]:
+    return {name: log_sink.log_size(Path(logdir) / name) for name in TRAIN_LOGS}
+
+
+def _trim_logs(logdir, sizes: Optional[Dict[str, int]], step: int) -> None:
+    """
+    Drop what an interrupted run logged after the snapshot it resumes from: the training
+    logs go back to the `sizes` recorded with the snapshot (None: snapshot without them,
+    left alone), eval_stats.pkl keeps the records up to `step` (inclusive).
+    """
+    if sizes is not None:
+        for name in TRAIN_LOGS:
+            log_sink.truncate_log(Path(logdir) / name, sizes.get(name, 0))
+    log_sink.trim_pickles(Path(logdir) / "eval_stats.pkl", lambda record: record["step"] <= step)
+
+
+def _check_actor_processes(opt) -> None:
+    """--actor-processes runs without envs in this process and with the plain numpy replay."""
+    if opt.actors > 0:
+        raise SystemExit("--actors and --actor-processes are exclusive")
+    if opt.checkpoint_interval > 0 or opt.resume:
+        raise SystemExit("--checkpoint-interval/--resume are not supported with --actor-processes")
+    if opt.replay_backend != "numpy" or opt.replay_storage == "frames":
+        raise SystemExit("--actor-processes needs --replay-backend numpy and --replay-storage stack or compressed")
+    if opt.reset_workers > 0:
+        raise SystemExit("--reset-workers is not supported with --actor-processes (actors cannot fork)")
+    if opt.actor_batch < opt.num_envs:
+        raise SystemExit("--actor-batch must be at least --num-envs")
+
+
+def _close_eval(eval_env, evaluate, opt) -> None:
+    if isinstance(evaluate, EvalProcess):
+        evaluate.close()  # waits for the pending evaluations
+    elif opt.eval_envs > 0:
+        eval_env.close()
+    log_sink.close_all()  # stats.jsonl / eval_stats.pkl are complete once main() returns
+
+
+def train_async(
+    opt,
+    actor_envs: List[VecEnv],
+    online: torch.nn.Module,
+    target: torch.nn.Module,
+    optimizer: torch.optim.Optimizer,
+    replay: PrioritizedReplayBuffer,
+    eps_sched,
+    evaluate,
+    eval_env,
+    precision: MixedPrecision,
+) -> int:
+    """
+    Asynchronous mode: one actor thread per VecEnv acts with a copy of `online` that is
+    refreshed every --actor-sync-interval updates, while this thread learns continuously
+    at --replay-ratio updates per env step. Returns the number of post-warmup env steps.
+    """
+    lock = threading.Lock()  # guards the replay
+    weights = WeightStore(online)
+    ratio = opt.replay_ratio if opt.replay_ratio is not None else 1.0 / opt.train_every
+    gate = ReplayRatio(ratio, opt.steps, slack=opt.num_envs * len(actor_envs))
+    actors = []
+    for k, envs in enumerate(actor_envs):
+        net = QRDuelingDQN(
+            in_channels=opt.history_length, num_actions=opt.num_actions, num_quantiles=opt.quantiles
+        ).to(opt.device)
+        policy = EpsGreedyPolicy(
+            net=net,
+            num_actions=opt.num_actions,
+            num_quantiles=opt.quantiles,
+            schedule=eps_sched,
+            device=opt.device,
+            engine=build_engine(net, opt, precision),
+            precision=precision,
+        )
+        nstep = VecNStepAdder(envs.num_envs, opt.n_step, opt.gamma, (opt.history_length, 84, 84))
+        actors.append(
+            ActorThread(
+                envs, net, policy, weights, replay, lock, nstep, gate, opt.warmup_steps, stream_offset=k * opt.num_envs
+            )
+        )
+    for actor in actors:
+        actor.start()
+
+    try:
+        _learner_loop(opt, online, target, optimizer, replay, lock, weights, gate, evaluate, eval_env, precision)
+    finally:
+        gate.close()
+        for actor in actors:
+            actor.join()
+    for actor in actors:
+        if actor.error is not None:
+            raise actor.error
+    return gate.env_steps
+
+
+def train_distributed(
+    opt,
+    online: torch.nn.Module,
+    target: torch.nn.Module,
+    optimizer: torch.optim.Optimizer,
+    replay: PrioritizedReplayBuffer,
+    evaluate,
+    eval_env,
+    precision: MixedPrecision,
+) -> int:
+    """
+    Ape-X mode on one node: --actor-processes actor processes, each with its own
+    --num-envs envs and fixed epsilon, send n-step transitions with initial priorities
+    through shared memory to a replay server thread beside this learner
+    (src/agent/distributed.py), and reload the weights it publishes every
+    --actor-sync-interval updates. The actors never wait for the learner, which does at
+    most --replay-ratio updates per env step. Returns the number of post-warmup env steps.
+    """
+    lock = threading.Lock()  # guards the replay
+    ratio = opt.replay_ratio if opt.replay_ratio is not None else 1.0 / opt.train_every
+    pool = ActorPool(opt, online, replay, lock, ratio)
+    print(f"[actors] epsilons: {', '.join(f'{eps:.4f}' for eps in pool.epsilons)}")
+    pool.start()
+    try:
+        _learner_loop(
+            opt, online, target, optimizer, replay, lock, pool.weights, pool, evaluate, eval_env, precision, pool.report
+        )
+    finally:
+        pool.close()
+    pool.check()
+    print(f"[actors] {pool.report()}")
+    return pool.env_steps
+
+
+def _learner_loop(
+    opt,
+    online: torch.nn.Module,
+    target: torch.nn.Module,
+    optimizer: torch.optim.Optimizer,
+    replay: PrioritizedReplayBuffer,
+    lock: threading.Lock,
+    weights,
+    gate,
+    evaluate,
+    eval_env,
+    precision: MixedPrecision,
+    report=None,
+) -> None:
+    """
+    The learner of train_async/train_distributed: one update each time gate.acquire_update()
+    allows it, sampling and updating priorities under `lock`, publishing to `weights`
+    every --actor-sync-interval updates, with target syncs and evaluations at
+    gate.env_steps. `report()` is printed with each evaluation.
+    """
+    sampler = PrefetchSampler(replay, opt.batch_size, depth=opt.prefetch, lock=lock) if opt.prefetch > 0 else None
+    losses = LossMeter(opt.device)
+
+    def update_priorities(indices, td_errors):
+        with lock:
+            replay.update_priorities(indices, td_errors)
+
+    priorities = PriorityTransfer(update_priorities, opt.device, on_device=opt.replay_backend == "torch")
+    loss_fn = torch.compile(fused_qr_dqn_loss) if opt.compile else fused_qr_dqn_loss
+    gamma_n = opt.gamma**opt.n_step  # since n-step target
+    updates = 0
+    next_target, next_eval = opt.target_update_interval, opt.eval_interval
+
+    def follow_env_steps(env_steps: int) -> None:
+        """Target syncs and evaluations due by `env_steps`."""
+        nonlocal next_target, next_eval
+        while env_steps >= next_target:
+            with perf.phase("target_sync"):
+                target.load_state_dict(online.state_dict())
+            next_target += opt.target_update_interval
+        while env_steps >= next_eval:
+            _log_losses(losses, next_eval)
+            if report is not None:
+                print(f"[actors] {report()}")
+            with lock, perf.phase("replay_flush"):
+                replay.flush()
+            with perf.phase("eval"):
+                evaluate(online, eval_env, next_eval, opt)
+            next_eval += opt.eval_interval
+
+    try:
+        while gate.acquire_update():
+            with perf.phase("sample"):
+                if sampler is not None:
+                    batch = sampler.sample()
+                else:
+                    with lock:
+                        batch = replay.sample(opt.batch_size)
+            if opt.fused_learn:
+                with perf.phase("learn"):
+                    loss, prios = learn_qr_dqn_fused(
+                        batch, online, target, optimizer, gamma_n, opt.huber_kappa, opt.grad_clip, loss_fn, precision
+                    )
+                with perf.phase("priorities"):
+                    priorities.push(batch["indices"], prios)
+            else:
+                with perf.phase("learn"):
+                    loss, td_errors = learn_qr_dqn(
+                        batch=batch,
+                        online=online,
+                        target=target,
+                        optimizer=optimizer,
+                        gamma=opt.gamma ** opt.n_step,  # since n-step target
+                        quantiles=opt.quantiles,
+                        kappa=opt.huber_kappa,
+                        double_dqn=True,
+                        grad_norm_clip=opt.grad_clip,
+                        precision=precision,
+                    )
+                with perf.phase("priorities"):
+                    update_priorities(batch["indices"], td_errors)
+            losses.add(loss)
+            perf.count("updates")
+            updates += 1
+            if updates % opt.actor_sync_interval == 0:
+                weights.publish(online)
+
+            env_steps = gate.env_steps
+            follow_env_steps(env_steps)
+            perf.step(env_steps, replay)
+        if not gate.closed:
+            follow_env_steps(gate.env_steps)  # steps taken after the last update
+    finally:
+        priorities.flush()
+        if sampler is not None:
+            sampler.close()
+
+
+def train_seeds(opt) -> None:
+    """
+    Train every seed in --seeds side by side in this process. The K online (and target)
+    networks are stacked into one StackedQRDuelingDQN, so acting and each update are one
+    call for all seeds; everything else stays per seed: envs, replay, n-step adder,
+    exploration schedule, RNG stream and logdir <logdir>/<seed>. Each seed draws the
+    same random numbers in the same order as `--seed <seed>` alone would; results
+    still differ from separate runs in float rounding of the batched kernels.
+    """
+    if opt.actors > 0 or opt.actor_processes > 0 or opt.prefetch > 0 or opt.checkpoint_interval > 0 or opt.resume:
+        raise SystemExit(
+            "--seeds does not support --actors, --actor-processes, --prefetch, --checkpoint-interval or --resume"
+        )
+    if opt.inference:
+        raise SystemExit("--seeds does not support --inference")
+    if opt.eval_process:
+        raise SystemExit("--seeds does not support --eval-process")
+    opt.device = torch.device("cuda" if (torch.cuda.is_available() and not opt.cpu) else "cpu")
+    torch.backends.cudnn.benchmark = True
+    # vmap batches the members into grouped kernels, which only pays off on the GPU
+    mode = opt.stack_mode or ("vmap" if opt.device.type == "cuda" else "loop")
+    precision = MixedPrecision.from_name(opt.precision, opt.device)
+
+    runs, members = [], []
+    for seed in opt.seeds:
+        run = SimpleNamespace(opt=copy.copy(opt))
+        run.opt.seed, run.opt.logdir = seed, str(Path(opt.logdir) / str(seed))
+        if opt.replay_dir is not None:
+            run.opt.replay_dir = str(Path(opt.replay_dir) / str(seed))
+        _info(run.opt)
+        # same construction order as main(), so each seed starts from the same RNG draws
+        set_seed_everywhere(seed)
+        run.envs = make_train_envs(run.opt)
+        run.eval_env, evaluate = make_eval_env(run.opt)
+        opt.num_actions = run.opt.num_actions = run.envs.action_space.n
+        members.append(QRDuelingDQN(opt.history_length, opt.num_actions, opt.quantiles))
+        QRDuelingDQN(opt.history_length, opt.num_actions, opt.quantiles)  # main()'s target init draws too
+        run.replay = build_replay(run.opt)
+        run.nstep = VecNStepAdder(opt.num_envs, opt.n_step, opt.gamma, (opt.history_length, 84, 84))
+        if opt.eps_schedule == "linear":
+            eps_sched = LinearSchedule(opt.eps_start, opt.eps_end, opt.eps_decay_steps)
+        else:
+            eps_sched = CosineSchedule(opt.eps_start, opt.eps_end, opt.eps_decay_steps)
+        # only its exploration half is used, the greedy actions come from the stacked network
+        run.behavior = EpsGreedyPolicy(None, opt.num_actions, opt.quantiles, eps_sched, opt.device)
+        run.losses = LossMeter(opt.device)
+        Path(run.opt.logdir).mkdir(parents=True, exist_ok=True)
+        run.obs = run.envs.reset()
+        run.nstep.reset(run.obs)
+        run.rng = RNGStream()
+        runs.append(run)
+
+    online = StackedQRDuelingDQN(members, mode).to(opt.device)
+    target = StackedQRDuelingDQN(members, mode).to(opt.device)
+    del members
+    optimizer = build_optimizer(online, opt.lr)  # Adam is elementwise: one over the stack = one per seed
+    if opt.perf_every > 0 or opt.profile_steps:
+        perf.configure(opt.logdir, opt.perf_every or opt.steps, opt.profile_steps)
+
+    for run in runs:
+        with run.rng:
+            while run.replay.size < opt.warmup_steps:
+                with perf.phase("act"):
+                    actions, _ = run.behavior.explore_batch(opt.num_envs, force_random=True)
+                run.obs, _ = collect_step(run.envs, actions, run.nstep, run.replay)
+    perf.flush(0)
+
+    gamma_n = opt.gamma**opt.n_step  # since n-step target
+    step_cnt = 0
+    while step_cnt < opt.steps:
+        # --- Act: exploration drawn per seed, one stacked forward for the greedy actions
+        with perf.phase("act"):
+            explore = []
+            for run in runs:
+                with run.rng:
+                    explore.append(run.behavior.explore_batch(opt.num_envs))
+            if not all(mask.all() for _, mask in explore):
+                with torch.no_grad(), precision.autocast():
+                    obs = torch.from_numpy(np.stack([run.obs for run in runs])).to(opt.device)
+                    greedy = online(obs).mean(dim=3).argmax(dim=2).cpu().numpy()  # [K, N]
+                explore = [(np.where(mask, actions, greedy[k]), mask) for k, (actions, mask) in enumerate(explore)]
+        for run, (actions, _) in zip(runs, explore):
+            with run.rng:
+                run.obs, _ = collect_step(run.envs, actions, run.nstep, run.replay)
+
+        # --- Per env step: one stacked update for all seeds, target updates, evaluation
+        for _ in range(opt.num_envs):
+            if step_cnt % opt.train_every == 0:
+                with perf.phase("sample"):
+                    batches = []
+                    for run in runs:
+                        with run.rng:
+                            batches.append(run.replay.sample(opt.batch_size))
+                    batch = {key: torch.stack([b[key] for b in batches]) for key in batches[0] if key != "indices"}
+                with perf.phase("learn"):
+                    loss, td_errors = learn_qr_dqn_stacked(
+                        batch, online, target, optimizer, gamma_n, opt.huber_kappa, opt.grad_clip, precision
+                    )
+                with perf.phase("priorities"):
+                    if opt.replay_backend != "torch":
+                        td_errors = td_errors.cpu().numpy()
+                    for k, (run, b) in enumerate(zip(runs, batches)):
+                        run.replay.update_priorities(b["indices"], td_errors[k])
+                        run.losses.add(loss[k])
+                perf.count("updates")
+
+            if (step_cnt + 1) % opt.target_update_interval == 0:
+                with perf.phase("target_sync"):
+                    target.load_state_dict(online.state_dict())
+
+            if (step_cnt + 1) % opt.eval_interval == 0:
+                with perf.phase("eval"):
+                    _evaluate_runs(runs, online, evaluate, step_cnt + 1)
+
+            step_cnt += 1
+            if step_cnt >= opt.steps:
+                break
+        perf.step(step_cnt)
+
+    perf.close_profiler(step_cnt)
+    perf.flush(step_cnt)
+    if step_cnt % opt.eval_interval != 0:
+        _evaluate_runs(runs, online, evaluate, step_cnt)
+    for run in runs:
+        run.replay.flush()
+        run.envs.close()
+        if opt.eval_envs > 0:
+            run.eval_env.close()
+    log_sink.close_all()
+
+
+def _evaluate_runs(runs: List[SimpleNamespace], online: StackedQRDuelingDQN, evaluate, crt_step: int) -> None:
+    for k, run in enumerate(runs):
+        print(f"seed {run.opt.seed}:")
+        _log_losses(run.losses, crt_step)
+        run.replay.flush()
+        member = online.member(k)
+        with run.rng:
+            evaluate(member, run.eval_env, crt_step, run.opt)
 
 
 def learn_qr_dqn(
@@ -217,19 +767,22 @@ def learn_qr_dqn(
     kappa: float,
     double_dqn: bool = True,
     grad_norm_clip: float = 10.0,
+    precision: Optional[MixedPrecision] = None,
 ) -> Tuple[float, np.ndarray]:
     """
     One optimization step of QR-DQN with Double DQN target selection.
     batch contains:
-        obs:  [B, C, 84, 84] float32 in [0,1]
+        obs:  [B, C, 84, 84] uint8 (or float32 in [0,1])
         actions: [B] long
         rewards: [B] float
         next_obs: [B, C, 84, 84]
         dones: [B] float (1 if terminal)
         weights: [B] importance-sampling weights
         indices: [B] positions in replay
+    `precision` autocasts the forwards (float32 without it).
     Returns (scalar loss, |td_error| for PER)
     """
+    precision = precision or MixedPrecision()
     obs = batch["obs"]
     actions = batch["actions"].long()
     rewards = batch["rewards"]
@@ -240,12 +793,13 @@ def learn_qr_dqn(
     B = obs.size(0)
 
     # Current quantile distributions Z_theta(s,a) -> [B, A, N]
-    dist_all = online(obs)  # [B, A, N]
+    with precision.autocast():
+        dist_all = online(obs)  # [B, A, N]
     # Gather chosen actions
     action_index = actions.view(B, 1, 1).expand(B, 1, quantiles)
     dist = dist_all.gather(1, action_index).squeeze(1)  # [B, N]
 
-    with torch.no_grad():
+    with torch.no_grad(), precision.autocast():
         # Next action selection (Double DQN): argmax_a E[Z_online]
         next_dist_online = online(next_obs)  # [B, A, N]
         q_next_mean = next_dist_online.mean(dim=2)  # [B, A]
@@ -264,16 +818,55 @@ def learn_qr_dqn(
 
     optimizer.zero_grad(set_to_none=True)
     loss.backward()
-    torch.nn.utils.clip_grad_norm_(online.parameters(), grad_norm_clip)
+    clip_grad_norm_(online.parameters(), grad_norm_clip)
     optimizer.step()
 
     return loss.item(), td_abs.detach().cpu().numpy()
 
 
-def get_options():
+def learn_qr_dqn_fused(
+    batch: Dict[str, torch.Tensor],
+    online: torch.nn.Module,
+    target: torch.nn.Module,
+    optimizer: torch.optim.Optimizer,
+    gamma: float,
+    kappa: float,
+    grad_norm_clip: float = 10.0,
+    loss_fn=fused_qr_dqn_loss,
+    precision: Optional[MixedPrecision] = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Same update as learn_qr_dqn without any host sync: obs and next_obs share one online
+    forward and the TD errors are reduced to per-sample priorities on the device.
+    `loss_fn` may be a torch.compile'd fused_qr_dqn_loss; `precision` autocasts it.
+    Returns (detached scalar loss, priorities [B]), both on the device.
+    """
+    precision = precision or MixedPrecision()
+    with precision.autocast():
+        loss, prios = loss_fn(
+            online,
+            target,
+            batch["obs"],
+            batch["actions"],
+            batch["rewards"],
+            batch["next_obs"],
+            batch["dones"],
+            batch["weights"],
+            gamma,
+            kappa,
+        )
+    optimizer.zero_grad(set_to_none=True)
+    loss.backward()
+    clip_grad_norm_(online.parameters(), grad_norm_clip)
+    optimizer.step()
+    return loss.detach(), prios
+
+
+def get_options(argv=None):
     """
     Extend the starter parser with our agent hyperparameters.
     Defaults = best hyperparameters for full run (per brief).
+    `argv` defaults to the command line.
     """
     parser = argparse.ArgumentParser()
     parser.add_argument("--logdir", default="logdir/qr_dqn/0", help="logdir/agent_name/<seed>")
@@ -287,8 +880,89 @@ def get_options():
         "--eval-interval", type=int, default=25_000, metavar="STEPS", help="Training steps between evaluations."
     )
     parser.add_argument("--eval-episodes", type=int, default=20, metavar="N", help="Eval episodes to average.")
+    parser.add_argument(
+        "--eval-envs",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Run the eval episodes batched on a pool of N envs (a process each if N > 1); 0 = one after another.",
+    )
+    parser.add_argument(
+        "--eval-process",
+        action="store_true",
+        help="Evaluate in a separate process on weight snapshots published to <logdir>/snapshots; training goes on.",
+    )
+    parser.add_argument(
+        "--eval-max-pending",
+        type=int,
+        default=1,
+        metavar="N",
+        help="With --eval-process, snapshots waiting beyond N are dropped, oldest first (the last one never).",
+    )
+    parser.add_argument(
+        "--eval-cores", type=int, nargs="+", default=None, metavar="CPU", help="Pin the --eval-process to these CPUs."
+    )
     parser.add_argument("--cpu", action="store_true", help="Force CPU even if CUDA is available.")
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads (default: torch's choice).")
+    parser.add_argument(
+        "--num-envs", type=int, default=1, help="Parallel training envs; more than one runs a worker process per env."
+    )
+    parser.add_argument(
+        "--reset-workers",
+        type=int,
+        default=0,
+        help="Processes pre-generating the worlds of upcoming training episodes (per set of --num-envs envs), so "
+        "auto-resets swap in a ready world (src/world_pool.py). 0 = generate on reset.",
+    )
+    parser.add_argument("--reset-depth", type=int, default=2, help="Episodes pre-generated ahead per env.")
+    parser.add_argument(
+        "--log-interval",
+        type=float,
+        default=log_sink.FLUSH_INTERVAL,
+        help="Seconds episode stats and eval records may wait in memory before a background thread appends them.",
+    )
+    parser.add_argument(
+        "--stats-binary", action="store_true", help="Also log training episodes to a compact stats.bin per env dir."
+    )
     parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--seeds",
+        type=int,
+        nargs="+",
+        default=None,
+        metavar="SEED",
+        help="Train these seeds together in one process with stacked networks; each logs to <logdir>/<seed>.",
+    )
+    parser.add_argument(
+        "--stack-mode",
+        choices=["vmap", "loop"],
+        default=None,
+        help="How --seeds runs the stacked networks (default: vmap on CUDA, loop on CPU).",
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=int,
+        default=0,
+        metavar="STEPS",
+        help="Snapshot nets, optimizer, replay and RNGs every STEPS steps in the background (0 = off).",
+    )
+    parser.add_argument("--checkpoint-dir", default=None, help="Where snapshots go (default: <logdir>/checkpoint).")
+    parser.add_argument("--resume", action="store_true", help="Continue from the snapshot in --checkpoint-dir.")
+    parser.add_argument(
+        "--perf-every",
+        type=int,
+        default=0,
+        metavar="STEPS",
+        help="Every STEPS steps append per-phase timings, counters, replay fill and RSS to <logdir>/perf.jsonl.",
+    )
+    parser.add_argument(
+        "--profile-steps",
+        type=int,
+        nargs=2,
+        default=None,
+        metavar=("START", "STOP"),
+        help="torch.profiler trace of env steps [START, STOP) to <logdir>/profile.",
+    )
 
     # --- Algorithm hyperparams (tuned defaults)
     parser.add_argument("--lr", type=float, default=2.5e-4)
@@ -300,9 +974,96 @@ def get_options():
     parser.add_argument("--grad-clip", type=float, default=10.0)
     parser.add_argument("--quantiles", type=int, default=51)
     parser.add_argument("--huber-kappa", type=float, default=1.0)
+    parser.add_argument(
+        "--fused-learn",
+        action="store_true",
+        help="One online forward for obs and next_obs, priorities and loss stats kept on the device.",
+    )
+    parser.add_argument("--compile", action="store_true", help="torch.compile the fused loss (needs --fused-learn).")
+    parser.add_argument(
+        "--precision",
+        choices=list(MixedPrecision.DTYPES),
+        default="fp32",
+        help="Autocast dtype of the network forwards when learning and acting: fp32 (no autocast) or bf16 (CPU/CUDA). "
+        "Targets, loss and priorities stay float32; evaluation runs in float32.",
+    )
+    parser.add_argument(
+        "--inference",
+        choices=["eager", "trace", "compile"],
+        default=None,
+        help="Act with an expected-value copy of the network (src/agent/inference.py) run this way; it follows "
+        "the learner every --actor-sync-interval updates. Default: act with the full network.",
+    )
+    parser.add_argument(
+        "--inference-quantize", action="store_true", help="int8 dynamic quantization of the acting copy (CPU)."
+    )
+
+    # --- Asynchronous actors / learner
+    parser.add_argument(
+        "--actors", type=int, default=0, help="Actor threads, each with its own --num-envs envs; 0 = single loop."
+    )
+    parser.add_argument(
+        "--replay-ratio",
+        type=float,
+        default=None,
+        help="Learner updates per env step with --actors (default 1/--train-every).",
+    )
+    parser.add_argument(
+        "--actor-sync-interval", type=int, default=100, help="Learner updates between weight publications."
+    )
+    parser.add_argument(
+        "--actor-processes",
+        type=int,
+        default=0,
+        help="Ape-X actor processes, each with its own --num-envs envs (stepped in-process) and epsilon, streaming "
+        "prioritized transitions to the learner's replay; 0 = off.",
+    )
+    parser.add_argument(
+        "--apex-eps", type=float, default=0.4, help="Actor i of N explores with eps ** (1 + alpha * i / (N - 1))."
+    )
+    parser.add_argument("--apex-alpha", type=float, default=7.0, help="See --apex-eps.")
+    parser.add_argument(
+        "--actor-batch", type=int, default=64, help="Transitions an actor process sends (and prioritizes) at once."
+    )
+    parser.add_argument(
+        "--actor-slots", type=int, default=2, help="Shared-memory batches per actor process in flight to the replay."
+    )
 
     # --- Replay (PER)
+    parser.add_argument(
+        "--prefetch", type=int, default=0, metavar="K", help="Batches sampled ahead on a background thread (0 = off)."
+    )
     parser.add_argument("--replay-size", type=int, default=250_000)
+    parser.add_argument(
+        "--replay-backend",
+        choices=["numpy", "torch"],
+        default="numpy",
+        help="torch: replay tensors on the training device, sampled and updated with torch ops (no numpy round-trip).",
+    )
+    parser.add_argument(
+        "--replay-storage",
+        choices=["stack", "frames", "compressed"],
+        default="stack",
+        help="stack: obs/next_obs stacks per transition; frames: every frame once, stacks rebuilt on sample; "
+        "compressed: stacks encoded with --replay-codec, decoded on sample.",
+    )
+    parser.add_argument(
+        "--replay-codec",
+        choices=list(CODECS),
+        default="zlib",
+        help="Codec of --replay-storage compressed (lz4 needs the lz4 package, else zlib is used).",
+    )
+    parser.add_argument(
+        "--replay-codec-threads",
+        type=int,
+        default=2,
+        help="Threads encoding added batches and decoding sampled ones (0 = inline).",
+    )
+    parser.add_argument(
+        "--replay-dir",
+        default=None,
+        help="Keep the replay in memory-mapped files in this dir (flushed at each eval, reopened if present).",
+    )
     parser.add_argument("--warmup-steps", type=int, default=20_000)
     parser.add_argument("--prior-alpha", type=float, default=0.6)
     parser.add_argument("--prior-beta-start", type=float, default=0.4)
@@ -314,8 +1075,15 @@ def get_options():
     parser.add_argument("--eps-decay-steps", type=int, default=800_000)
     parser.add_argument("--eps-schedule", choices=["linear", "cosine"], default="cosine")
 
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.compile and not args.fused_learn:
+        parser.error("--compile compiles the fused loss, add --fused-learn")
+    if args.eval_max_pending < 1:
+        parser.error("--eval-max-pending must be at least 1: the newest snapshot is always kept")
+    return args
 
 
 if __name__ == "__main__":
+    # SIGTERM (e.g. sweep.py stopping a job) unwinds like an exception, so buffered logs still get flushed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(128 + signal.SIGTERM))
     main(get_options())